@@ -1,6 +1,8 @@
 # app/api/folder_file_router.py
-from fastapi import APIRouter, Depends, HTTPException, Form, status, Query, File as FastAPIFile, UploadFile
+import json
+from fastapi import APIRouter, Depends, HTTPException, Form, status, Query, Header, Request, File as FastAPIFile, UploadFile
 from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Union, Tuple, Any, Dict # <-- Thêm Tuple, Any, Dict
 from uuid import UUID
@@ -8,6 +10,12 @@ from app.db.database import get_db
 from app.services.folder_file_service import DocumentService
 from app.services.ocr_service import ocr_service, UploadCancelledError
 from app.services.postgres_service import postgres_service
+from app.services.ingest_job_service import ingest_job_service, extract_file_to_db
+from app.services.upload_progress_service import upload_progress, UploadProgressForbiddenError, UploadProgressLimitError
+from app.services.upload_registry_service import upload_registry
+from app.services.ingest_dedup_service import ingest_dedup
+from app.services.vector_index_service import vector_index_service
+from app.services.resumable_upload_service import resumable_upload_service
 from app.db.models import Folder, File, User, UserGroup, GroupAccessLevel, FileAccessLevel, AccessLevel
 from datetime import datetime
 
@@ -19,7 +27,14 @@ from app.schemas.folder_file_schema import (
     FileUpdate,
     FilePublic,
     FolderContentResponse,
-    PaginatedFiles
+    PaginatedFiles,
+    FileSearchItem,
+    PaginatedFileSearch,
+    IngestJobAccepted,
+    IngestJobPublic,
+    ResumableUploadCreate,
+    ResumableUploadStatus,
+    ResumableUploadPartResult
 )
 from app.schemas.user_schema import UserPublic # Giả sử UserPublic có id và role
 from app.api.deps import get_current_active_user, get_current_active_admin
@@ -28,7 +43,6 @@ from app.core.db_retry import retry_on_deadlock # <-- THÊM IMPORT NÀY
 
 router = APIRouter(tags=["Folders & Files"])
 document_service = DocumentService()
-document_service = DocumentService()
 
 # Hàm helper để tạo thông báo tích cực (dùng chung cho các router)
 def create_positive_message(base_message: str, attempts: int) -> str:
@@ -189,6 +203,96 @@ async def list_folder_content(
 
 
 # --- FILES ENDPOINTS ---
+async def _ingest_saved_file(uploaded_file_info: dict, upload_id: Optional[str], async_processing: bool):
+    """Bước 2 của upload (dùng chung cho POST /files và upload nhiều phần): OCR đồng bộ hoặc tạo job chạy nền"""
+    # Cập nhật thông tin upload
+    if upload_id:
+        await document_service.register_upload(upload_id, {
+            "status": "queued" if async_processing else "processing",
+            "storage_path": uploaded_file_info.get("storage_path"),
+            "file_id": uploaded_file_info.get("id")
+        })
+    
+    if uploaded_file_info.get("error"):
+         raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Lỗi khi lưu tệp tin: {uploaded_file_info['error']}"
+        )
+    
+    # Bước 2: Thực hiện OCR trên file đã upload
+    file_path = uploaded_file_info['storage_path']
+
+    # --- START MODIFICATION: CHECK FOR CANCELLATION BEFORE OCR ---
+    # Nếu có upload_id, kiểm tra xem nó có bị hủy trước khi bắt đầu OCR không
+    if upload_id and not document_service.get_upload_info(upload_id):
+        print(f"Upload {upload_id} was canceled before OCR processing. Aborting.")
+        upload_progress.emit(upload_id, 'cancelled')
+        # File tạm đã được dọn dẹp bởi hàm cancel_upload, không cần làm gì thêm.
+        # Trả về lỗi cho client biết rằng quá trình đã bị hủy
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Upload {upload_id} was canceled by the user."
+        )
+    # --- END MODIFICATION ---
+
+    if async_processing:
+        job = await ingest_job_service.create_job(file_id=uploaded_file_info['id'], upload_id=upload_id)
+        accepted = IngestJobAccepted(
+            job_id=job['id'],
+            file_id=uploaded_file_info['id'],
+            status=job['status'],
+            status_url=f"/api/file/jobs/{job['id']}"
+        )
+        upload_progress.emit(upload_id, 'queued', job_id=job['id'], file_id=uploaded_file_info['id'])
+        if upload_id:
+            # Worker nhận job sẽ tự theo dõi upload qua registry
+            upload_registry.forget(upload_id)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=accepted.model_dump(mode="json"))
+
+    try:
+        # Trích xuất theo từng trang, ghi dần vào file_pages và ghép extracted_text trong SQL
+        # (file trùng nội dung với file đã xử lý xong được sao chép kết quả, không OCR lại)
+        ingest_result = await extract_file_to_db(
+            file_id=uploaded_file_info['id'],
+            file_path=file_path,
+            upload_id=upload_id,
+            document_service=document_service,
+            update_data={"processing_status": "completed"}
+        )
+    except UploadCancelledError:
+        # Ghi log và ném lại lỗi HTTP để client biết
+        print(f"Upload {upload_id} was canceled during OCR processing. Aborting.")
+        upload_progress.emit(upload_id, 'cancelled')
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Upload {upload_id} was canceled by the user."
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not ingest_result["success"]:
+        # File đã được đánh dấu 'failed' (giống job chạy nền); giữ file đã lưu để xử lý lại
+        error = ingest_result.get("error") or "OCR thất bại"
+        if upload_id:
+            await document_service.finish_upload(upload_id)
+        upload_progress.emit(upload_id, 'failed', file_id=uploaded_file_info['id'], error=error)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Không trích xuất được nội dung file: {error}"
+        )
+
+    # Xóa file tạm sau khi đã trích xuất OCR
+    await document_service.cleanup_upload_file(file_path)
+
+    # Xóa khỏi danh sách active uploads nếu có
+    if upload_id:
+        await document_service.finish_upload(upload_id)
+
+    upload_progress.emit(upload_id, 'completed', file_id=uploaded_file_info['id'],
+                         pages=ingest_result["pages"], processed_pages=ingest_result["processed_pages"])
+    return FilePublic.model_validate(ingest_result["file"])
+
+
 @router.post("/files", response_model=FilePublic, status_code=status.HTTP_201_CREATED)
 async def create_file(
     file: UploadFile = FastAPIFile(...) ,
@@ -199,17 +303,23 @@ async def create_file(
     project_code: Optional[str] = Form(None),
     project_name: Optional[str] = Form(None),
     document_type: Optional[str] = Form(None),
-    upload_id: Optional[str] = Form(None)
+    upload_id: Optional[str] = Form(None),
+    async_processing: bool = Form(False)
 ):
     """
     Tải lên một tệp tin vật lý và lưu thông tin của nó vào cơ sở dữ liệu.
     (Được bọc Deadlock Retry cho các thao tác ghi DB)
+
+    Nếu async_processing=true: trả về 202 ngay sau khi lưu file, OCR chạy nền và
+    trạng thái được theo dõi qua GET /jobs/{job_id}.
+    Tiến độ chi tiết theo upload_id: GET /files/progress/{upload_id} (SSE).
     """
     uploaded_file_info = None
     try:
         # Đăng ký upload nếu có upload_id
         if upload_id:
-            document_service.register_upload(upload_id, {"status": "uploading"})
+            await document_service.register_upload(upload_id, {"status": "uploading"}, user_id=str(current_user.id))
+            upload_progress.open(upload_id, str(current_user.id))
 
         # Bước 1: Lưu tệp tin vật lý và tạo record file trong DB
         # BỌC LỜI GỌI SERVICE 1 BẰNG RETRY_ON_DEADLOCK
@@ -217,6 +327,7 @@ async def create_file(
             document_service.save_upload_file,
             file=file,
             user_id=str(current_user.id),
+            upload_id=upload_id,
             folder_id=str(folder_id) if folder_id else None,
             is_template=is_template,
             project_code=project_code,
@@ -225,108 +336,170 @@ async def create_file(
         )
         uploaded_file_info, attempts1 = result1
         
-        # Cập nhật thông tin upload
-        if upload_id:
-            document_service.register_upload(upload_id, {
-                "status": "processing",
-                "storage_path": uploaded_file_info.get("storage_path"),
-                "file_id": uploaded_file_info.get("id")
-            })
-        
-        if uploaded_file_info.get("error"):
-             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Lỗi khi lưu tệp tin: {uploaded_file_info['error']}"
-            )
-        
         if attempts1 > 1:
             print(create_positive_message(f"Tạo record file '{uploaded_file_info['original_file_name']}' thành công.", attempts1))
 
 
-        # Bước 2: Thực hiện OCR trên file đã upload
-        file_path = uploaded_file_info['storage_path']
+        return await _ingest_saved_file(uploaded_file_info, upload_id, async_processing)
+        
+    except HTTPException as e:
+        upload_progress.emit(upload_id, 'failed', error=str(e.detail))
+        if upload_id:
+            await document_service.finish_upload(upload_id)
+        raise e
+    except Exception as e:
+        upload_progress.emit(upload_id, 'failed', error=str(e))
+        if upload_id:
+            await document_service.finish_upload(upload_id)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Lỗi khi xử lý tải lên tệp: {str(e)}"
+        ) 
+    
+# --- UPLOAD NHIỀU PHẦN (RESUMABLE) ---
+def _check_resumable_access(upload: Optional[dict], current_user: UserPublic) -> dict:
+    if not upload:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy phiên upload")
+    if current_user.role != "admin" and upload["user_id"] != str(current_user.id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Bạn không có quyền với phiên upload này")
+    return upload
+
+@router.post("/files/uploads", response_model=ResumableUploadStatus, status_code=status.HTTP_201_CREATED,
+             summary="Tạo phiên upload nhiều phần (resumable)")
+async def create_resumable_upload(
+    payload: ResumableUploadCreate,
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """
+    Tạo phiên upload cho file lớn (tối đa RESUMABLE_UPLOAD_MAX_MB).
 
-        # --- START MODIFICATION: CHECK FOR CANCELLATION BEFORE OCR ---
-        # Nếu có upload_id, kiểm tra xem nó có bị hủy trước khi bắt đầu OCR không
-        if upload_id and not document_service.get_upload_info(upload_id):
-            print(f"Upload {upload_id} was canceled before OCR processing. Aborting.")
-            # File tạm đã được dọn dẹp bởi hàm cancel_upload, không cần làm gì thêm.
-            # Trả về lỗi cho client biết rằng quá trình đã bị hủy
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Upload {upload_id} was canceled by the user."
-            )
-        # --- END MODIFICATION ---
+    Sau đó gửi từng phần bằng PUT /files/uploads/{session_id}/parts/{part_number} (phần n gồm các byte
+    [(n-1)*part_size, n*part_size), có thể gửi song song), xem các phần đã nhận bằng GET /files/uploads/{session_id}
+    và gọi POST /files/uploads/{session_id}/complete khi đã gửi đủ.
+    """
+    upload = await resumable_upload_service.create_session(
+        user_id=str(current_user.id),
+        filename=payload.filename,
+        file_size=payload.file_size,
+        mime_type=payload.mime_type,
+        part_size=payload.part_size,
+        content_sha256=payload.content_sha256,
+        upload_id=payload.upload_id,
+        file_metadata={
+            "folder_id": str(payload.folder_id) if payload.folder_id else None,
+            "is_template": payload.is_template,
+            "project_code": payload.project_code,
+            "project_name": payload.project_name,
+            "document_type": payload.document_type
+        }
+    )
+    if payload.upload_id:
+        await document_service.register_upload(payload.upload_id, {"status": "uploading"}, user_id=str(current_user.id))
+        upload_progress.open(payload.upload_id, str(current_user.id))
+    return resumable_upload_service.describe(upload)
+
+@router.get("/files/uploads/{session_id}", response_model=ResumableUploadStatus, summary="Các phần đã nhận của phiên upload")
+async def get_resumable_upload(
+    session_id: UUID,
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """Trạng thái phiên: các phần và khoảng byte đã nhận, các phần còn thiếu (dùng để tiếp tục sau khi mất kết nối)"""
+    upload = _check_resumable_access(await resumable_upload_service.get_session(str(session_id)), current_user)
+    return resumable_upload_service.describe(upload)
+
+@router.put("/files/uploads/{session_id}/parts/{part_number}", response_model=ResumableUploadPartResult,
+            summary="Gửi một phần của file")
+async def upload_resumable_part(
+    session_id: UUID,
+    part_number: int,
+    request: Request,
+    current_user: UserPublic = Depends(get_current_active_user),
+    part_sha256: Optional[str] = Header(None, alias="X-Part-SHA256")
+):
+    """
+    Body là nội dung nhị phân của phần (application/octet-stream), được ghi dần vào file tạm của phần.
+    Gửi lại một phần sẽ ghi đè phần cũ. Header X-Part-SHA256 (tùy chọn) để kiểm tra nội dung phần.
+    """
+    upload = _check_resumable_access(
+        await resumable_upload_service.get_session(str(session_id), include_parts=False), current_user
+    )
+    return await resumable_upload_service.write_part(upload, part_number, request.stream(), checksum=part_sha256)
 
+@router.post("/files/uploads/{session_id}/complete", response_model=FilePublic, status_code=status.HTTP_201_CREATED,
+             summary="Hoàn tất upload nhiều phần và trích xuất file")
+async def complete_resumable_upload(
+    session_id: UUID,
+    async_processing: bool = Query(False),
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """
+    Kiểm tra đã đủ các phần, chuyển file vào thư mục uploads và xử lý như POST /files
+    (OCR đồng bộ, hoặc trả về 202 + job chạy nền nếu async_processing=true).
+    Nếu còn thiếu phần, trả về 409 kèm missing_parts; gửi tiếp các phần đó rồi gọi lại.
+    """
+    upload = _check_resumable_access(
+        await resumable_upload_service.get_session(str(session_id), include_parts=False), current_user
+    )
+    upload_id = upload.get("upload_id")
+    if upload_id:
+        registered = await upload_registry.lookup(upload_id)
+        if registered and registered["status"] == "cancelled":
+            await resumable_upload_service.abort(upload["id"])
+            upload_progress.emit(upload_id, 'cancelled')
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Upload {upload_id} was canceled by the user.")
+
+    # Lỗi ở bước này (thiếu phần, sai checksum) không kết thúc phiên: client gửi lại phần lỗi rồi hoàn tất lại
+    upload, content_hash = await resumable_upload_service.begin_complete(upload["id"])
+    try:
         try:
-            ocr_result = await run_in_threadpool(
-                ocr_service.process_file,
-                file_path=file_path,
+            uploaded_file_info, attempts = await retry_on_deadlock(
+                document_service.save_assembled_file,
+                source_path=resumable_upload_service.partial_path(upload["id"]),
+                original_file_name=upload["original_file_name"],
+                mime_type=upload["mime_type"],
+                content_hash=content_hash,
+                user_id=upload["user_id"],
                 upload_id=upload_id,
-                document_service=document_service
-            )
-        except UploadCancelledError:
-            # Ghi log và ném lại lỗi HTTP để client biết
-            print(f"Upload {upload_id} was canceled during OCR processing. Aborting.")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Upload {upload_id} was canceled by the user."
+                **upload["file_metadata"]
             )
+        except Exception:
+            await resumable_upload_service.release(upload["id"])
+            raise
+        await resumable_upload_service.mark_completed(upload["id"], uploaded_file_info["id"])
+        if attempts > 1:
+            print(create_positive_message(f"Tạo record file '{uploaded_file_info['original_file_name']}' thành công.", attempts))
+
+        return await _ingest_saved_file(uploaded_file_info, upload_id, async_processing)
 
-        # Lấy kết quả text đã trích xuất
-        extracted_text = None
-        char_count = None
-        word_count = None
-        if ocr_result and ocr_result.get('success', False):
-            extracted_text = ocr_result.get('text', '')
-            if extracted_text:
-                char_count = len(extracted_text)
-                word_count = len(extracted_text.split())
-
-        # Cập nhật thông tin OCR cho file vừa lưu
-        if extracted_text:
-            update_data = {
-                "extracted_text": extracted_text,
-                "char_count": char_count,
-                "word_count": word_count
-            }
-            # BỌC LỜI GỌI SERVICE 2 BẰNG RETRY_ON_DEADLOCK (Update record file)
-            result2: Tuple[dict, int] = await retry_on_deadlock(
-                 postgres_service.update_file_data, file_id=uploaded_file_info['id'], update_data=update_data
-            )
-            result, attempts2 = result2
-            
-            if not result["success"]:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Lỗi khi cập nhật thông tin OCR: {result['error']}"
-                )
-            
-            if attempts2 > 1:
-                print(create_positive_message(f"Cập nhật OCR cho file '{uploaded_file_info['original_file_name']}' thành công.", attempts2))
-            
-            # Xóa file tạm sau khi đã trích xuất OCR thành công
-            await document_service.cleanup_upload_file(file_path)
-            
-            # Xóa khỏi danh sách active uploads nếu có
-            if upload_id:
-                document_service.active_uploads.pop(upload_id, None)
-                
-            return FilePublic.model_validate(result["file"])
-            
-        # Return original file info if no OCR results
-        # Xóa file tạm ngay cả khi không có kết quả OCR
-        await document_service.cleanup_upload_file(file_path)
-        return FilePublic.model_validate(uploaded_file_info)
-        
     except HTTPException as e:
+        upload_progress.emit(upload_id, 'failed', error=str(e.detail))
+        if upload_id:
+            await document_service.finish_upload(upload_id)
         raise e
     except Exception as e:
+        upload_progress.emit(upload_id, 'failed', error=str(e))
+        if upload_id:
+            await document_service.finish_upload(upload_id)
         raise HTTPException(
             status_code=500,
             detail=f"Lỗi khi xử lý tải lên tệp: {str(e)}"
-        ) 
-    
+        )
+
+@router.delete("/files/uploads/{session_id}", status_code=status.HTTP_204_NO_CONTENT, summary="Hủy phiên upload nhiều phần")
+async def abort_resumable_upload(
+    session_id: UUID,
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """Hủy phiên đang upload và xóa file tạm"""
+    upload = _check_resumable_access(
+        await resumable_upload_service.get_session(str(session_id), include_parts=False), current_user
+    )
+    if not await resumable_upload_service.abort(upload["id"]):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Phiên upload đang ở trạng thái {upload['status']}")
+    if upload.get("upload_id"):
+        upload_progress.emit(upload["upload_id"], 'cancelled')
+        await document_service.finish_upload(upload["upload_id"])
+
 @router.delete("/files/cancel-upload/{upload_id}")
 async def cancel_upload(
     upload_id: str,
@@ -336,14 +509,97 @@ async def cancel_upload(
     """
     Hủy quá trình upload file đang diễn ra
     """
-    result = await document_service.cancel_upload(upload_id, db)
+    result = await document_service.cancel_upload(
+        upload_id, db, user_id=None if current_user.role == "admin" else str(current_user.id)
+    )
+    if result.get("forbidden"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=result["message"])
     if not result["success"]:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=result["message"]
         )
+    upload_progress.emit(upload_id, 'cancelled')
     return {"success": result["success"], "message": result["message"]}
 
+@router.get("/files/progress/{upload_id}", summary="Tiến độ upload dạng Server-Sent Events")
+async def stream_upload_progress(
+    upload_id: str,
+    current_user: UserPublic = Depends(get_current_active_user),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """
+    Stream sự kiện tiến độ của một upload (text/event-stream) tới khi upload kết thúc.
+
+    Sự kiện: bytes_saved, file_saved, queued, page_rendered, page_ocr_done, ocr_cache_hit,
+    progress, dedup_wait, dedup_hit, db_write, db_write_done và một trong completed | failed | cancelled.
+    Mỗi sự kiện gồm data, elapsed_ms (từ lúc bắt đầu upload) và totals cộng dồn.
+    Có thể mở stream trước khi gửi file; kết nối lại với Last-Event-ID để nhận tiếp.
+    """
+    subscriber_id = None if current_user.role == "admin" else str(current_user.id)
+    if subscriber_id and upload_progress.get_owner(upload_id) is None:
+        # Upload có thể đã bắt đầu ở worker khác
+        upload_session = await upload_registry.lookup(upload_id)
+        if upload_session and upload_session.get("user_id") and upload_session["user_id"] != subscriber_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Bạn không có quyền xem tiến độ upload này")
+    try:
+        upload_progress.attach(upload_id, subscriber_id)
+    except UploadProgressForbiddenError:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Bạn không có quyền xem tiến độ upload này")
+    except UploadProgressLimitError:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Đang theo dõi quá nhiều upload chưa bắt đầu")
+
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def event_stream():
+        async for event in upload_progress.subscribe(upload_id, last_event_id=after_id, subscriber_id=subscriber_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            payload = {"upload_id": upload_id, **event}
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/jobs/{job_id}", response_model=IngestJobPublic, summary="Trạng thái job OCR chạy nền")
+async def get_ingest_job(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """Lấy trạng thái, tiến độ và (khi hoàn thành) thông tin file của một job OCR"""
+    job = await ingest_job_service.get_job(str(job_id))
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy job")
+
+    file = await document_service.get_file_by_id(db, UUID(job["file_id"]))
+    if not file:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy tệp tin của job")
+    if current_user.role != "admin" and file.uploaded_by_user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Bạn không có quyền xem job này")
+
+    if job["status"] == "completed":
+        job["file"] = FilePublic.model_validate(file)
+    return IngestJobPublic.model_validate(job)
+
+@router.get("/ocr/metrics", summary="Thống kê OCR client (admin)")
+async def get_ocr_metrics(current_user: UserPublic = Depends(get_current_active_admin)):
+    """Giới hạn đồng thời / circuit breaker, connection pool, cache, tiền xử lý ảnh của OCR client, tỷ lệ dùng lại file trùng và vector index"""
+    return {
+        "limiter": ocr_service.get_limiter_stats(),
+        "http_pool": ocr_service.get_http_pool_stats(),
+        "requests": ocr_service.get_request_stats(),
+        "cache": ocr_service.get_cache_stats(),
+        "preprocess": ocr_service.get_preprocess_stats(),
+        "dedup": ingest_dedup.get_stats(),
+        "vector_index": vector_index_service.get_stats()
+    }
+
+
 @router.get("/files", response_model=List[FilePublic])
 async def get_all_files(
     db: AsyncSession = Depends(get_db),
@@ -364,6 +620,38 @@ async def get_file_by_id(
         raise HTTPException(status_code=404, detail="Tệp tin không tồn tại.")
     return file
 
+@router.get("/files/{file_id}/words", summary="Vị trí và độ tin cậy các từ OCR (highlight)")
+async def get_file_words(
+    file_id: UUID,
+    page_number: Optional[int] = Query(None, ge=1, description="Chỉ lấy một trang"),
+    min_confidence: int = Query(0, ge=0, le=100, description="Bỏ các từ có độ tin cậy thấp hơn (0-100)"),
+    db: AsyncSession = Depends(get_db),
+    current_user: UserPublic = Depends(get_current_active_user)
+):
+    """Trả về text, bbox (tọa độ ảnh/trang gốc) và độ tin cậy của các từ OCR theo trang."""
+    from app.services.ocr_words_service import OCRWordBoxes
+
+    file = await document_service.get_file_by_id(db, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="Tệp tin không tồn tại.")
+    if current_user.role != "admin" and file.uploaded_by_user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Bạn không có quyền xem nội dung tệp tin này")
+
+    result = await postgres_service.get_file_page_words(str(file_id), page_number=page_number)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi đọc word boxes: {result['error']}")
+
+    pages = []
+    for row in result["pages"]:
+        boxes = OCRWordBoxes.from_bytes(bytes(row["boxes"]))
+        pages.append({
+            "page_number": row["page_number"],
+            "word_count": row["word_count"],
+            "avg_confidence": row["avg_confidence"],
+            "words": boxes.to_words(row["text"] or "", row["text_offset"], min_confidence)
+        })
+    return {"file_id": str(file_id), "pages": pages}
+
 @router.put("/files/{file_id}", response_model=FilePublic)
 async def update_file(
     file_id: UUID,
@@ -497,7 +785,7 @@ async def refresh_my_access(
     return
 
 
-@router.get("/files/search/scr", response_model=PaginatedFiles, summary="Tìm kiếm file với filter")
+@router.get("/files/search/scr", response_model=PaginatedFileSearch, summary="Tìm kiếm file với filter")
 async def search_files_endpoint(
     db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_active_user),
@@ -508,7 +796,7 @@ async def search_files_endpoint(
     modified_from: Optional[datetime] = Query(None, description="Modified từ ngày"),
     modified_to: Optional[datetime] = Query(None, description="Modified đến ngày"),
     uploader_only: bool = Query(False, description="Chỉ file do bạn upload"),
-    content: Optional[str] = Query(None, description="Tìm trong nội dung extracted_text"),
+    content: Optional[str] = Query(None, description="Tìm trong nội dung (không phân biệt dấu, hỗ trợ \"cụm từ\", OR, -loại trừ)"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100)
 ):
@@ -530,8 +818,11 @@ async def search_files_endpoint(
         page_size=page_size
     )
 
-    # Convert File objects sang schema trả về
-    items = [FilePublic.model_validate(f) for f in result["items"]]
+    # Convert File objects sang schema trả về, kèm độ liên quan / đoạn trích khi tìm theo nội dung
+    items = [
+        FileSearchItem.model_validate(f).model_copy(update=result["highlights"].get(str(f.id), {}))
+        for f in result["items"]
+    ]
 
     return {
         "page": result["page"],
@@ -55,6 +55,46 @@ app.include_router(folder_file_router.router, prefix="/api/file", tags=["folder_
 app.include_router(autocomplete_router.router, prefix="/api/autoc", tags=["folder_file"])
 
 
+@app.on_event("startup")
+async def start_upload_registry():
+    # Nhận lệnh hủy upload từ các worker khác (LISTEN upload_cancel)
+    from app.services.upload_registry_service import upload_registry
+    await upload_registry.start()
+
+
+@app.on_event("shutdown")
+async def stop_upload_registry():
+    from app.services.upload_registry_service import upload_registry
+    await upload_registry.stop()
+
+
+@app.on_event("startup")
+async def start_ingest_workers():
+    # Worker OCR chạy nền cho các upload async_processing=true
+    from app.services.ingest_job_service import ingest_job_service
+    await ingest_job_service.start(folder_file_router.document_service)
+
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    from app.services.ingest_job_service import ingest_job_service
+    await ingest_job_service.stop()
+
+
+@app.on_event("shutdown")
+async def close_ocr_http_pool():
+    # Đóng các kết nối keep-alive tới OCR server
+    from app.services.ocr_service import ocr_service
+    ocr_service.close()
+
+
+@app.on_event("shutdown")
+async def stop_extraction_pool():
+    # Dừng các worker process trích xuất (OCR_EXTRACTION_MODE=process)
+    from app.services.extraction_pool_service import extraction_pool
+    extraction_pool.shutdown()
+
+
 # @app.get("/")
 # async def root():
 #         return FileResponse("ui/indexV3.html")
@@ -122,4 +122,77 @@ class PaginatedFiles(BaseModel):
     page: int
     page_size: int
     total: int
-    items: List[FilePublic]
\ No newline at end of file
+    items: List[FilePublic]
+
+class FileSearchItem(FilePublic):
+    search_rank: Optional[float] = None     # Độ liên quan (ts_rank_cd) khi tìm theo nội dung
+    search_snippet: Optional[str] = None    # Đoạn trích chứa từ khóa, đánh dấu bằng <b>...</b>
+
+class PaginatedFileSearch(PaginatedFiles):
+    items: List[FileSearchItem]
+
+# =========================
+# Ingest Job (OCR chạy nền)
+# =========================
+class IngestJobAccepted(BaseModel):
+    job_id: UUID
+    file_id: UUID
+    status: str
+    status_url: str
+
+class IngestJobPublic(BaseModel):
+    id: UUID
+    file_id: UUID
+    upload_id: Optional[str]
+    status: str
+    pages_done: int
+    pages_total: Optional[int]
+    attempts: int
+    error_message: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    file: Optional[FilePublic] = None  # Chỉ có khi job đã hoàn thành
+
+    class Config:
+        from_attributes = True
+
+# =========================
+# Upload nhiều phần (resumable)
+# =========================
+class ResumableUploadCreate(BaseModel):
+    filename: str = Field(..., description="Tên gốc của tệp tin.")
+    file_size: int = Field(..., gt=0, description="Kích thước toàn bộ file (bytes).")
+    mime_type: Optional[str] = None
+    part_size: Optional[int] = Field(None, description="Kích thước mỗi phần (bytes), mặc định RESUMABLE_PART_SIZE_MB.")
+    content_sha256: Optional[str] = Field(None, description="SHA-256 của toàn bộ file để kiểm tra khi hoàn tất.")
+    upload_id: Optional[str] = Field(None, description="ID để theo dõi tiến độ (SSE) và hủy upload.")
+    folder_id: Optional[UUID] = None
+    is_template: bool = False
+    project_code: Optional[str] = None
+    project_name: Optional[str] = None
+    document_type: Optional[str] = None
+
+class ResumableUploadStatus(BaseModel):
+    session_id: UUID
+    status: str  # uploading | completing | completed | aborted
+    upload_id: Optional[str]
+    original_file_name: str
+    file_size_bytes: int
+    part_size: int
+    total_parts: int
+    bytes_received: int
+    received_parts: List[int]
+    missing_parts: List[int]
+    received_ranges: List[List[int]]  # Các khoảng byte [start, end) đã nhận
+    file_id: Optional[UUID]
+    expires_at: datetime
+
+class ResumableUploadPartResult(BaseModel):
+    part_number: int
+    size_bytes: int
+    sha256: str
+    parts_received: int
+    bytes_received: int
+    total_parts: int
@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import List, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from langchain_openai import ChatOpenAI
+from app.services.llm_provider_service import create_chat_model
 
 from app.schemas.chatbot_schema import ChatRequest  # ✅ import từ schemas
 
@@ -112,7 +112,7 @@ and messenger history:
 current user: {payload.message}
 """
 
-    llm = ChatOpenAI(model=settings["model"], temperature=0)
+    llm = create_chat_model(settings["model"], temperature=0)
 
     # log user message
     user_msg_id = str(uuid.uuid4())
@@ -3,7 +3,11 @@ from datetime import datetime
 from typing import List, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from langchain_openai import ChatOpenAI
+from app.services.llm_provider_service import create_chat_model
+from app.services.document_chunk_service import document_chunk_service
+from app.services.context_packer_service import context_packer
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 import os
 
 from app.schemas.chatbot_schema import ChatRequest
@@ -157,40 +161,42 @@ async def handle_chat_v2(payload: ChatRequest, db: AsyncSession) -> Dict[str, An
     # 2. Lấy hoặc tạo chatsetting theo user_id (không còn theo session_id)
     settings = await get_or_create_user_settings(db, payload.user_id)
 
-    # 3. Xử lý docs
+    # 3. Xử lý docs: chỉ đưa các chunk liên quan tới câu hỏi vào prompt (RAG_ENABLED=false: toàn bộ extracted_text)
     context_text = ""
+    context_chunks = None
+    retrieval_stats = None
     if settings["using_document"]:
         file_ids = [f.file_id for f in payload.files]
-        extracts = await get_file_extracts(db, file_ids)
-        context_text = "\n\n".join(extracts)
+        if document_chunk_service.enabled:
+            retrieval = await document_chunk_service.retrieve(db, file_ids, payload.message)
+            context_chunks = retrieval["chunks"]
+            retrieval_stats = retrieval["stats"]
+        else:
+            extracts = await get_file_extracts(db, file_ids)
+            context_text = "\n\n".join(extracts)
         # context_text = "\n\n".join(text for text, _ in extracts)
         # # hoặc bạn cũng có thể dùng original_file_name tùy nhu cầu
         # file_names = [name for _, name in extracts]
 
     # 4. Xử lý lịch sử (theo session_id như cũ)
-    history_text = ""
+    history = []
     if settings["is_history"]:
         limit = settings["max_context_messages"] or 15
         history = await get_chat_history(db, session_id, limit)
-        history_text = "\n".join(history)
 
-    # 5. Build final prompt
-    final_prompt = f"""
-{settings['system_prompt']}
-
-{context_text}
-
-
-### Lịch sử trò chuyện:
-{history_text}
-
-### Tin nhắn mới:
-{payload.message} 
-"""
+    # 5. Build final prompt: vừa ngân sách max_tokens / context window của model (bỏ bớt chunk ít liên quan, tin nhắn cũ)
+    try:
+        packed = await run_in_threadpool(
+            context_packer.pack, settings["model"], settings["max_tokens"], settings["system_prompt"], payload.message,
+            chunks=context_chunks, context_text=context_text, history=history
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    final_prompt = packed["prompt"]
 
 
     # 6. Call LLM (dùng model từ user chatsettings, không lấy env key cứng nữa)
-    llm = ChatOpenAI(model=settings["model"], temperature=0, api_key=settings.get("api_key") or os.getenv("OPENAI_API_KEY"),streaming=True)
+    llm = create_chat_model(settings["model"], temperature=0, api_key=settings.get("api_key") or os.getenv("OPENAI_API_KEY"),streaming=True)
     print("prompt", final_prompt)
     print("api key", settings.get("api_key"))
 
@@ -224,7 +230,9 @@ async def handle_chat_v2(payload: ChatRequest, db: AsyncSession) -> Dict[str, An
     await db.commit()
     return {
         "message": response.content,
-        "used_files": payload.files if settings["show_sources"] else []
+        "used_files": payload.files if settings["show_sources"] else [],
+        "retrieval": retrieval_stats,
+        "context": packed["stats"]
     }
 
 async def get_chat_history_list(db: AsyncSession, user_id: str):
@@ -0,0 +1,331 @@
+import os
+import math
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.document_chunk_service import DocumentChunkService, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình đóng gói prompt theo ngân sách token (chat_settings.max_tokens và context window của model)
+CONTEXT_RESPONSE_RESERVE_TOKENS = int(os.getenv("CONTEXT_RESPONSE_RESERVE_TOKENS", "4096"))  # Chừa cho câu trả lời
+CONTEXT_SAFETY_MARGIN_TOKENS = int(os.getenv("CONTEXT_SAFETY_MARGIN_TOKENS", "64"))          # Định dạng message của provider
+CONTEXT_DEFAULT_WINDOW_TOKENS = int(os.getenv("CONTEXT_DEFAULT_WINDOW_TOKENS", "16385"))     # Model không có trong MODEL_CONTEXT_WINDOWS
+CONTEXT_RATIO_SYSTEM = float(os.getenv("CONTEXT_RATIO_SYSTEM", "0.2"))
+CONTEXT_RATIO_DOCUMENTS = float(os.getenv("CONTEXT_RATIO_DOCUMENTS", "0.55"))
+CONTEXT_RATIO_HISTORY = float(os.getenv("CONTEXT_RATIO_HISTORY", "0.25"))
+CONTEXT_MESSAGE_MAX_RATIO = float(os.getenv("CONTEXT_MESSAGE_MAX_RATIO", "0.5"))             # Tin nhắn mới dài hơn thì bị cắt
+CONTEXT_HISTORY_SUMMARY_TOKENS = int(os.getenv("CONTEXT_HISTORY_SUMMARY_TOKENS", "40"))      # Tin nhắn cũ được rút gọn còn chừng này token
+
+# Context window (token) theo tiền tố tên model, lấy tiền tố dài nhất khớp
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-5': 400000,
+    'o1': 200000,
+    'o3': 200000,
+    'o4-mini': 200000,
+}
+_O200K_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+PROMPT_TEMPLATE = """
+{system_prompt}
+
+{context_text}
+
+
+### Lịch sử trò chuyện:
+{history_text}
+
+### Tin nhắn mới:
+{message}
+"""
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(model: str) -> Any:
+    try:
+        import tiktoken  # Có sẵn cùng langchain-openai; chỉ nạp ở lần chat đầu tiên
+    except ImportError:
+        logger.warning("Chưa cài tiktoken, ước lượng dư số token khi đóng gói prompt")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base" if model.startswith(_O200K_PREFIXES) else "cl100k_base")
+    except Exception as e:
+        # Lần đầu tiktoken tải bảng BPE qua mạng (TIKTOKEN_CACHE_DIR để dùng offline)
+        logger.warning(f"Không tải được tokenizer cho model {model}, ước lượng dư số token: {e}")
+        return None
+
+
+class TokenCounter:
+    """Đếm / cắt token bằng tokenizer của model (tiktoken).
+
+    Không có tokenizer thì ước lượng dư (mỗi 2 byte UTF-8 tính một token) để prompt vẫn không vượt giới hạn.
+    """
+
+    def __init__(self, model: str):
+        self._encoding = _load_encoding(model)
+        self.name = self._encoding.name if self._encoding is not None else "estimate"
+
+    def count(self, value: str) -> int:
+        if not value:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(value, disallowed_special=()))
+        return max(estimate_tokens(value), math.ceil(len(value.encode("utf-8")) / 2))
+
+    def truncate(self, value: str, max_tokens: int, keep_tail: bool = False) -> str:
+        """Giữ tối đa max_tokens token đầu (hoặc cuối nếu keep_tail)"""
+        if max_tokens <= 0 or not value:
+            return ""
+        if self.count(value) <= max_tokens:
+            return value
+        if self._encoding is not None:
+            tokens = self._encoding.encode(value, disallowed_special=())
+            kept = tokens[-max_tokens:] if keep_tail else tokens[:max_tokens]
+            # Bỏ ký tự bị cắt giữa chừng (byte UTF-8 không đủ)
+            result = self._encoding.decode(kept).replace("\ufffd", "")
+            while result and self.count(result) > max_tokens:
+                result = result[1:] if keep_tail else result[:-1]
+            return result
+        # Ước lượng: tìm nhị phân số ký tự giữ lại
+        low, high = 0, len(value)
+        while low < high:
+            middle = (low + high + 1) // 2
+            part = value[len(value) - middle:] if keep_tail else value[:middle]
+            if self.count(part) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return value[len(value) - low:] if keep_tail else value[:low]
+
+
+class ContextPacker:
+    """Ghép prompt chat không vượt ngân sách token.
+
+    Ngân sách = min(chat_settings.max_tokens, context window của model - phần chừa cho câu trả lời) - phần dư.
+    Tin nhắn mới luôn được giữ (cắt nếu dài hơn CONTEXT_MESSAGE_MAX_RATIO ngân sách); phần còn lại chia cho
+    system prompt / tài liệu / lịch sử theo CONTEXT_RATIO_*, phần nào cần ít hơn thì nhường cho phần khác.
+    Phần vượt mức bị bỏ từ chỗ ít giá trị nhất: chunk ít liên quan nhất, tin nhắn cũ nhất (rút gọn còn vài
+    chục token rồi mới bỏ hẳn), cuối system prompt.
+    """
+
+    def __init__(self, ratios: Optional[Dict[str, float]] = None,
+                 response_reserve: int = CONTEXT_RESPONSE_RESERVE_TOKENS,
+                 safety_margin: int = CONTEXT_SAFETY_MARGIN_TOKENS):
+        self.ratios = ratios or {
+            'system': CONTEXT_RATIO_SYSTEM,
+            'documents': CONTEXT_RATIO_DOCUMENTS,
+            'history': CONTEXT_RATIO_HISTORY,
+        }
+        self.response_reserve = response_reserve
+        self.safety_margin = safety_margin
+
+    @staticmethod
+    def context_window(model: str) -> int:
+        matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+        return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else CONTEXT_DEFAULT_WINDOW_TOKENS
+
+    def prompt_budget(self, model: str, max_tokens: Optional[int]) -> int:
+        limit = self.context_window(model) - self.response_reserve
+        if max_tokens:
+            limit = min(limit, int(max_tokens))
+        return max(0, limit - self.safety_margin)
+
+    @staticmethod
+    def render(system_prompt: str, context_text: str, history_text: str, message: str) -> str:
+        return PROMPT_TEMPLATE.format(system_prompt=system_prompt, context_text=context_text,
+                                      history_text=history_text, message=message)
+
+    @staticmethod
+    def allocate(needs: Dict[str, int], ratios: Dict[str, float], available: int) -> Dict[str, int]:
+        """Chia available theo tỷ lệ; phần cần ít hơn phần được chia thì nhường chỗ thừa cho các phần còn lại"""
+        allocation = {part: 0 for part in needs}
+        active = {part for part, need in needs.items() if need > 0}
+        remaining = available
+        while active and remaining > 0:
+            weights = {part: max(ratios.get(part, 0.0), 1e-6) for part in active}
+            total_weight = sum(weights.values())
+            shares = {part: int(remaining * weights[part] / total_weight) for part in active}
+            satisfied = {part for part in active if needs[part] <= shares[part]}
+            if not satisfied:
+                allocation.update(shares)
+                break
+            for part in satisfied:
+                allocation[part] = needs[part]
+                remaining -= needs[part]
+            active -= satisfied
+        return allocation
+
+    def pack(self, model: str, max_tokens: Optional[int], system_prompt: str, message: str,
+             chunks: Optional[List[Dict[str, Any]]] = None, context_text: str = "",
+             history: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Trả về {"prompt", "stats"}. Tài liệu là chunks (kết quả retrieve, có "rank") hoặc context_text.
+
+        ValueError nếu ngân sách không đủ cho cả khung prompt.
+        """
+        model = model or ""
+        counter = TokenCounter(model)
+        budget = self.prompt_budget(model, max_tokens)
+        system_prompt, history = system_prompt or "", history or []
+        overhead = counter.count(self.render("", "", "", ""))
+        if budget <= overhead:
+            raise ValueError(f"Ngân sách token ({budget}) không đủ cho prompt, hãy tăng max_tokens trong cài đặt chat")
+
+        message_tokens = counter.count(message)
+        message_limit = min(int(budget * CONTEXT_MESSAGE_MAX_RATIO), budget - overhead)
+        message_truncated = message_tokens > message_limit
+        if message_truncated:
+            message = counter.truncate(message, message_limit)
+        available = budget - overhead - counter.count(message)
+
+        full_documents = DocumentChunkService.format_context(chunks) if chunks is not None else context_text
+        needs = {
+            'system': counter.count(system_prompt),
+            'documents': counter.count(full_documents),
+            'history': counter.count("\n".join(history)),
+        }
+        allocation = self.allocate(needs, self.ratios, available)
+        parts = self._pack_parts(counter, allocation, system_prompt, chunks, context_text, history)
+
+        # Ghép các phần có thể lệch vài token so với tổng từng phần: bớt tiếp cho tới khi vừa
+        prompt = self.render(parts['system'][0], parts['documents'][0], parts['history'][0], message)
+        prompt_tokens = counter.count(prompt)
+        while prompt_tokens > budget:
+            overflow = prompt_tokens - budget + 8
+            part = next((name for name in ('documents', 'history', 'system') if allocation[name] > 0), None)
+            if part is None:
+                message = counter.truncate(message, counter.count(message) - overflow)
+                message_truncated = True
+            else:
+                allocation[part] = max(0, min(allocation[part], parts[part][1]['tokens']) - overflow)
+                parts = self._pack_parts(counter, allocation, system_prompt, chunks, context_text, history)
+            prompt = self.render(parts['system'][0], parts['documents'][0], parts['history'][0], message)
+            prompt_tokens = counter.count(prompt)
+
+        stats = {
+            'model': model,
+            'tokenizer': counter.name,
+            'context_window': self.context_window(model),
+            'budget': budget,
+            'prompt_tokens': prompt_tokens,
+            'message': {'tokens': counter.count(message), 'original_tokens': message_tokens, 'truncated': message_truncated},
+        }
+        for name, (_, part_stats) in parts.items():
+            stats[name] = dict(part_stats, allocated=allocation[name], original_tokens=needs[name])
+        if any(stats[name]['tokens'] < needs[name] for name in needs) or message_truncated:
+            logger.info(f"Prompt {prompt_tokens}/{budget} token ({counter.name}): "
+                        + ", ".join(f"{name} {stats[name]['tokens']}/{needs[name]}" for name in needs))
+        return {"prompt": prompt, "stats": stats}
+
+    def _pack_parts(self, counter: TokenCounter, allocation: Dict[str, int], system_prompt: str,
+                    chunks: Optional[List[Dict[str, Any]]], context_text: str,
+                    history: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        system_text = counter.truncate(system_prompt, allocation['system'])
+        return {
+            'system': (system_text, {'tokens': counter.count(system_text), 'truncated': system_text != system_prompt}),
+            'documents': self._pack_documents(counter, allocation['documents'], chunks, context_text),
+            'history': self._pack_history(counter, allocation['history'], history),
+        }
+
+    @staticmethod
+    def _pack_documents(counter: TokenCounter, budget: int, chunks: Optional[List[Dict[str, Any]]],
+                        context_text: str) -> Tuple[str, Dict[str, Any]]:
+        """Giữ các chunk liên quan nhất vừa ngân sách, chỗ còn lại dùng cho phần đầu của chunk kế tiếp"""
+        if chunks is None:
+            value = counter.truncate(context_text, budget)
+            return value, {'tokens': counter.count(value), 'truncated': value != context_text}
+
+        by_rank = sorted(range(len(chunks)), key=lambda i: chunks[i].get("rank", i))
+
+        def render(keep: int, partial: Optional[Dict[str, Any]] = None) -> str:
+            chosen = {i: chunks[i] for i in by_rank[:keep]}
+            if partial is not None:
+                chosen[by_rank[keep]] = partial
+            return DocumentChunkService.format_context([chosen[i] for i in sorted(chosen)])
+
+        # Số chunk nhiều nhất (theo thứ hạng) còn vừa ngân sách
+        low, high = 0, len(chunks)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if counter.count(render(middle)) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        value = render(low)
+        partial_chunk = False
+        if low < len(chunks):
+            spare = budget - counter.count(value) - 32  # Tên file / nhãn trang của chunk thêm vào
+            if spare >= 32:
+                chunk = chunks[by_rank[low]]
+                partial = dict(chunk, text=counter.truncate(chunk["text"], spare) + " …", overlap_tokens=0)
+                candidate = render(low, partial)
+                if counter.count(candidate) <= budget:
+                    value, partial_chunk = candidate, True
+        return value, {
+            'tokens': counter.count(value),
+            'truncated': low < len(chunks),
+            'chunks_kept': low,
+            'chunks_dropped': len(chunks) - low - int(partial_chunk),
+            'chunk_truncated': partial_chunk,
+        }
+
+    @staticmethod
+    def _pack_history(counter: TokenCounter, budget: int, history: List[str]) -> Tuple[str, Dict[str, Any]]:
+        """Giữ nguyên các tin nhắn mới nhất; tin cũ hơn rút gọn, hết chỗ thì bỏ và ghi chú số tin đã bỏ"""
+        value = "\n".join(history)
+        if counter.count(value) <= budget:
+            return value, {'tokens': counter.count(value), 'truncated': False, 'messages_kept': len(history),
+                           'messages_summarized': 0, 'messages_dropped': 0}
+        marker_reserve = 16
+        limit = budget - marker_reserve
+        lines: List[str] = []  # Mới nhất trước
+        used = kept_full = summarized = 0
+        full = True
+        for entry in reversed(history):
+            if full:
+                cost = counter.count(entry) + 1
+                if used + cost <= limit:
+                    lines.append(entry)
+                    used += cost
+                    kept_full += 1
+                    continue
+                # Tin đầu tiên không vừa được nửa chỗ còn lại, các tin cũ hơn chỉ còn bản rút gọn
+                full = False
+                size = max(CONTEXT_HISTORY_SUMMARY_TOKENS, (limit - used) // 2)
+            else:
+                size = CONTEXT_HISTORY_SUMMARY_TOKENS
+            short = counter.truncate(entry, min(size, limit - used - 3))
+            if not short:
+                break
+            if short != entry:
+                short += " …"
+            cost = counter.count(short) + 1
+            if used + cost > limit:
+                break
+            lines.append(short)
+            used += cost
+            summarized += 1
+        dropped = len(history) - kept_full - summarized
+        if dropped and budget - used >= marker_reserve:
+            lines.append(f"({dropped} tin nhắn cũ hơn đã được lược bỏ)")
+        value = "\n".join(reversed(lines))
+        return value, {
+            'tokens': counter.count(value),
+            'truncated': True,
+            'messages_kept': kept_full,
+            'messages_summarized': summarized,
+            'messages_dropped': dropped,
+        }
+
+
+# Khởi tạo service
+context_packer = ContextPacker()
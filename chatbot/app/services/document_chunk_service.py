@@ -0,0 +1,452 @@
+import os
+import re
+import math
+import time
+import asyncio
+import logging
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.postgres_service import postgres_service
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình chia chunk khi trích xuất và chọn chunk khi chat
+RAG_ENABLED = os.getenv("RAG_ENABLED", "true").lower() == "true"
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "400"))                   # Kích thước tối đa mỗi chunk
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "60"))    # Phần lặp lại từ cuối chunk trước
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))                                   # Số chunk đưa vào prompt
+RAG_FULL_TEXT_MAX_TOKENS = int(os.getenv("RAG_FULL_TEXT_MAX_TOKENS", "2000"))  # Tài liệu nhỏ hơn mức này được đưa vào nguyên văn
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid").lower()         # hybrid | bm25 | vector
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "50"))          # Số ứng viên lấy từ mỗi nhánh trước khi trộn
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))                                  # Hằng số k của reciprocal rank fusion
+RAG_BM25_K1 = 1.2
+RAG_BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_BLOCK_SPLIT_RE = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;:])\s+|\n")
+_HEADING_KEYWORD_RE = re.compile(r"^(chương|điều|mục|phần|phụ lục|chapter|section|article)\s+[\divxlc]+\b", re.IGNORECASE)
+_HEADING_NUMBER_RE = re.compile(r"^(#{1,6}\s+\S|([IVXLC]+|\d+(\.\d+)*)[.)]\s+\S)")
+_HEADING_MAX_CHARS = 120
+
+
+def estimate_tokens(value: str) -> int:
+    """Ước lượng số token (từ + dấu câu) của đoạn text"""
+    return len(_TOKEN_RE.findall(value or ""))
+
+
+def _tail_tokens(value: str, count: int) -> str:
+    """count token cuối của đoạn text (giữ nguyên định dạng gốc)"""
+    matches = list(_TOKEN_RE.finditer(value))
+    if count <= 0 or not matches:
+        return ""
+    return value[matches[max(0, len(matches) - count)].start():]
+
+
+def _skip_tokens(value: str, count: int) -> str:
+    """Bỏ count token đầu của đoạn text"""
+    if count <= 0:
+        return value
+    for index, match in enumerate(_TOKEN_RE.finditer(value)):
+        if index == count:
+            return value[match.start():]
+    return ""
+
+
+def _is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > _HEADING_MAX_CHARS:
+        return False
+    if _HEADING_KEYWORD_RE.match(line) or _HEADING_NUMBER_RE.match(line):
+        return True
+    # Dòng viết hoa toàn bộ (vd. "HỢP ĐỒNG MUA BÁN")
+    letters = [ch for ch in line if ch.isalpha()]
+    return len(letters) >= 4 and line.isupper()
+
+
+def normalize_terms(value: str) -> List[str]:
+    """Từ viết thường, bỏ dấu tiếng Việt, kèm cặp từ liền nhau (từ ghép tiếng Việt thường gồm 2 âm tiết)"""
+    folded = unicodedata.normalize("NFD", (value or "").lower().replace("đ", "d"))
+    folded = "".join(ch for ch in folded if unicodedata.category(ch) != "Mn")
+    words = _WORD_RE.findall(folded)
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class DocumentChunker:
+    """Chia text theo trang thành các chunk khoảng chunk_tokens token, có phần lặp overlap_tokens.
+
+    Text được tách theo đoạn (dòng trống); chunk mới bắt đầu tại tiêu đề (Chương/Điều/1.2/CHỮ HOA...)
+    nếu chunk hiện tại đã đủ dài, và ưu tiên cắt ở cuối trang khi chunk đã quá nửa kích thước.
+    Đoạn dài hơn một chunk được cắt theo câu rồi theo token. Nhận từng trang một (add_page) để
+    dùng trực tiếp trong lúc trích xuất mà không cần giữ cả tài liệu.
+    """
+
+    def __init__(self, chunk_tokens: int = RAG_CHUNK_TOKENS, overlap_tokens: int = RAG_CHUNK_OVERLAP_TOKENS):
+        self.chunk_tokens = max(50, chunk_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.chunk_tokens // 2))
+        self._blocks: List[Tuple[str, int]] = []  # (text, số token)
+        self._tokens = 0
+        self._overlap = 0          # Số token đầu chunk hiện tại lặp lại từ chunk trước
+        self._page_start: Optional[int] = None
+        self._page_end: Optional[int] = None
+        self._heading: Optional[str] = None
+        self._next_index = 0
+
+    def add_page(self, page_number: int, page_text: str) -> List[Dict[str, Any]]:
+        """Thêm text của một trang, trả về các chunk đã hoàn chỉnh"""
+        chunks: List[Dict[str, Any]] = []
+        for block in _BLOCK_SPLIT_RE.split(page_text or ""):
+            block = block.strip()
+            if not block:
+                continue
+            first_line = block.split("\n", 1)[0]
+            if _is_heading(first_line):
+                if self._tokens - self._overlap >= self.chunk_tokens // 4:
+                    chunks.extend(self._emit(carry_overlap=False))
+                elif self._tokens == self._overlap:
+                    # Chưa có nội dung mới: bỏ phần lặp của mục trước
+                    self._reset()
+                self._heading = first_line.strip()
+            for piece, tokens in self._split_block(block):
+                if self._tokens + tokens > self.chunk_tokens and self._tokens > self._overlap:
+                    chunks.extend(self._emit(carry_overlap=True))
+                self._append(piece, tokens, page_number)
+        if self._tokens - self._overlap >= self.chunk_tokens // 2:
+            # Cắt ở cuối trang khi chunk đã đủ dài
+            chunks.extend(self._emit(carry_overlap=True))
+        return chunks
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Trả về chunk cuối (nếu có nội dung chưa nằm trong chunk nào)"""
+        if self._tokens > self._overlap:
+            return self._emit(carry_overlap=False)
+        return []
+
+    def _split_block(self, block: str) -> Iterable[Tuple[str, int]]:
+        tokens = estimate_tokens(block)
+        if tokens <= self.chunk_tokens:
+            yield block, tokens
+            return
+        pending: List[str] = []
+        pending_tokens = 0
+        for sentence in _SENTENCE_SPLIT_RE.split(block):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            sentence_tokens = estimate_tokens(sentence)
+            if pending and pending_tokens + sentence_tokens > self.chunk_tokens:
+                yield " ".join(pending), pending_tokens
+                pending, pending_tokens = [], 0
+            if sentence_tokens > self.chunk_tokens:
+                # Câu quá dài (vd. bảng OCR không có dấu câu): cắt theo token
+                matches = list(_TOKEN_RE.finditer(sentence))
+                for start in range(0, len(matches), self.chunk_tokens):
+                    end = min(start + self.chunk_tokens, len(matches))
+                    yield sentence[matches[start].start():matches[end - 1].end()], end - start
+                continue
+            pending.append(sentence)
+            pending_tokens += sentence_tokens
+        if pending:
+            yield " ".join(pending), pending_tokens
+
+    def _append(self, piece: str, tokens: int, page_number: int) -> None:
+        if self._page_start is None:
+            self._page_start = page_number
+        self._page_end = page_number
+        self._blocks.append((piece, tokens))
+        self._tokens += tokens
+
+    def _reset(self) -> None:
+        self._blocks, self._tokens, self._overlap = [], 0, 0
+        self._page_start = self._page_end = None
+
+    def _emit(self, carry_overlap: bool) -> List[Dict[str, Any]]:
+        chunk = {
+            "chunk_index": self._next_index,
+            "page_start": self._page_start,
+            "page_end": self._page_end,
+            "heading": self._heading,
+            "text": "\n\n".join(piece for piece, _ in self._blocks),
+            "token_count": self._tokens,
+            "overlap_tokens": self._overlap
+        }
+        self._next_index += 1
+        last_page = self._page_end
+        tail = _tail_tokens(chunk["text"], self.overlap_tokens) if carry_overlap else ""
+        self._reset()
+        if tail:
+            self._append(tail, estimate_tokens(tail), last_page)
+            self._overlap = self._tokens
+        return [chunk]
+
+
+class DocumentChunkService:
+    """Chọn các chunk liên quan tới câu hỏi thay vì đưa toàn bộ extracted_text vào prompt.
+
+    Chunk được tạo khi trích xuất (bảng file_chunks); file cũ chưa có chunk được chia ngay lần
+    chat đầu tiên. Chunk được xếp hạng trong phạm vi các file được chọn bằng hai nhánh chạy song song:
+    BM25 trên từ đã bỏ dấu và cặp từ liền nhau (khớp chính xác số hợp đồng, mã dự án, "Điều 5"...) và
+    vector index (gần nghĩa), rồi trộn bằng reciprocal rank fusion (RAG_RETRIEVAL_MODE=hybrid).
+    """
+
+    def __init__(self, enabled: bool = RAG_ENABLED, top_k: int = RAG_TOP_K,
+                 full_text_max_tokens: int = RAG_FULL_TEXT_MAX_TOKENS, retrieval_mode: str = RAG_RETRIEVAL_MODE,
+                 hybrid_candidates: int = RAG_HYBRID_CANDIDATES):
+        self.enabled = enabled
+        self.top_k = top_k
+        self.full_text_max_tokens = full_text_max_tokens
+        self.retrieval_mode = retrieval_mode
+        self.hybrid_candidates = hybrid_candidates
+
+    async def build_file_chunks(self, db: AsyncSession, file_id: str) -> int:
+        """Chia chunk cho file đã trích xuất (từ file_pages, hoặc extracted_text với file cũ)"""
+        chunker = DocumentChunker()
+        chunks: List[Dict[str, Any]] = []
+        result = await db.stream(text("""
+            SELECT page_number, text FROM file_pages
+            WHERE file_id = :file_id AND success AND text <> ''
+            ORDER BY page_number
+        """), {"file_id": file_id})
+        has_pages = False
+        async for page_number, page_text in result:
+            has_pages = True
+            chunks.extend(chunker.add_page(page_number, page_text))
+        if not has_pages:
+            row = (await db.execute(text("SELECT extracted_text FROM files WHERE id = :file_id"), {"file_id": file_id})).fetchone()
+            if row and row[0]:
+                chunks.extend(chunker.add_page(1, row[0]))
+        chunks.extend(chunker.finish())
+        write = await postgres_service.upsert_file_chunks(file_id, chunks, replace=True)
+        if not write["success"]:
+            raise RuntimeError(f"Lỗi khi lưu chunk của file {file_id}: {write['error']}")
+        return len(chunks)
+
+    async def _load_chunks(self, db: AsyncSession, file_ids: List[str]) -> List[Dict[str, Any]]:
+        result = await db.execute(text("""
+            SELECT c.file_id, f.original_file_name, c.chunk_index, c.page_start, c.page_end, c.heading,
+                   c.text, c.token_count, c.overlap_tokens
+            FROM file_chunks c
+            JOIN files f ON f.id = c.file_id
+            WHERE c.file_id = ANY(:ids)
+            ORDER BY c.file_id, c.chunk_index
+        """), {"ids": file_ids})
+        chunks = [dict(row._mapping) for row in result.fetchall()]
+        for chunk in chunks:
+            chunk["file_id"] = str(chunk["file_id"])
+        return chunks
+
+    async def retrieve(self, db: AsyncSession, file_ids: List[str], query: str, top_k: Optional[int] = None) -> Dict[str, Any]:
+        """Chọn top_k chunk liên quan nhất trong các file, trả về {"context_text", "chunks", "stats"}.
+
+        chunks theo thứ tự trong tài liệu, mỗi chunk có "rank" là thứ hạng liên quan.
+        """
+        top_k = top_k or self.top_k
+        if not file_ids:
+            return {"context_text": "", "chunks": [], "stats": self._stats("none", [], [])}
+        started = time.perf_counter()
+
+        # File đã trích xuất nhưng chưa có chunk (trích xuất trước khi có file_chunks)
+        missing = await db.execute(text("""
+            SELECT f.id FROM files f
+            WHERE f.id = ANY(:ids) AND f.extracted_text IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM file_chunks c WHERE c.file_id = f.id)
+        """), {"ids": file_ids})
+        for (file_id,) in missing.fetchall():
+            count = await self.build_file_chunks(db, str(file_id))
+            logger.info(f"Đã chia {count} chunk cho file {file_id} (file trích xuất trước khi có file_chunks)")
+
+        chunks = await self._load_chunks(db, file_ids)
+        stages = {"load": {"ms": _elapsed_ms(started), "candidates": len(chunks)}}
+        full_tokens = sum(chunk["token_count"] - chunk["overlap_tokens"] for chunk in chunks)
+        strategy = None
+        if full_tokens <= self.full_text_max_tokens:
+            selected, mode = chunks, "full"
+        else:
+            ranked, strategy = await self.rank(chunks, query, file_ids, top_k, stages)
+            selected, mode = self._pick(chunks, ranked, top_k), "chunks"
+
+        order = {file_id: index for index, file_id in enumerate(file_ids)}
+        if mode == "chunks":
+            for rank, chunk in enumerate(selected):
+                chunk["rank"] = rank  # Thứ hạng liên quan (0 = tốt nhất), dùng khi cần bỏ bớt chunk cho vừa ngân sách token
+        selected = sorted(selected, key=lambda c: (order.get(c["file_id"], len(order)), c["chunk_index"]))
+        if mode == "full":
+            for rank, chunk in enumerate(selected):
+                chunk["rank"] = rank
+        context_text = self.format_context(selected)
+        stats = self._stats(mode, chunks, selected, full_tokens=full_tokens, context_tokens=estimate_tokens(context_text))
+        stats.update({"strategy": strategy, "stages": stages, "total_ms": _elapsed_ms(started)})
+        logger.info(f"Chọn {stats['chunks_selected']}/{stats['chunks_total']} chunk ({strategy or mode}), "
+                    f"{stats['context_tokens']}/{stats['full_tokens']} token (tiết kiệm {stats['tokens_saved']}), "
+                    + ", ".join(f"{name} {stage['ms']}ms/{stage['candidates']}" for name, stage in stages.items()))
+        return {"context_text": context_text, "chunks": selected, "stats": stats}
+
+    async def rank(self, chunks: List[Dict[str, Any]], query: str, file_ids: List[str], top_k: int,
+                   stages: Dict[str, Dict[str, Any]]) -> Tuple[List[int], str]:
+        """Xếp hạng chỉ số chunk theo BM25 và vector index chạy song song, trộn bằng RRF.
+
+        Ghi thời gian và số ứng viên của từng nhánh vào stages; trả về (thứ tự chunk, strategy).
+        Vector index tắt hoặc lỗi thì chỉ dùng BM25.
+        """
+        # Import trong hàm: embedding_service (dùng bởi vector_index_service) import normalize_terms từ module này
+        from app.services.vector_index_service import vector_index_service
+
+        use_vector = self.retrieval_mode in ("hybrid", "vector") and vector_index_service.enabled
+        use_bm25 = self.retrieval_mode != "vector" or not use_vector
+        candidates = max(self.hybrid_candidates, top_k)
+
+        async def run_bm25() -> List[int]:
+            started = time.perf_counter()
+            ranked = [i for i, _ in await run_in_threadpool(self.rank_bm25, chunks, query)][:candidates]
+            stages["bm25"] = {"ms": _elapsed_ms(started), "candidates": len(ranked)}
+            return ranked
+
+        async def run_vector() -> List[int]:
+            started = time.perf_counter()
+            positions = {(chunk["file_id"], chunk["chunk_index"]): i for i, chunk in enumerate(chunks)}
+            try:
+                # Luôn giới hạn theo file_ids: duyệt chính xác các dòng của file được chọn, không dùng HNSW
+                hits = await vector_index_service.search(query, top_k=candidates, file_ids=file_ids)
+            except Exception as e:
+                logger.warning(f"Lỗi khi tìm trong vector index, chỉ dùng BM25: {e}")
+                hits = []
+            # Điểm <= 0: không liên quan (vd. hashing embedder không có từ chung)
+            ranked = [positions[key] for key in ((hit["file_id"], hit["chunk_index"]) for hit in hits if hit["score"] > 0)
+                      if key in positions]
+            stages["vector"] = {"ms": _elapsed_ms(started), "candidates": len(ranked)}
+            return ranked
+
+        branches = ([run_bm25()] if use_bm25 else []) + ([run_vector()] if use_vector else [])
+        rankings = await asyncio.gather(*branches)
+        if len(rankings) == 1:
+            return rankings[0], "bm25" if use_bm25 else "vector"
+        if not rankings[1] and use_bm25:
+            return rankings[0], "bm25"
+
+        started = time.perf_counter()
+        fused = self.fuse(rankings)
+        stages["fusion"] = {"ms": _elapsed_ms(started), "candidates": len(fused),
+                            "overlap": len(set(rankings[0]) & set(rankings[1]))}
+        return fused, "hybrid"
+
+    @staticmethod
+    def fuse(rankings: List[List[int]], k: int = RAG_RRF_K) -> List[int]:
+        """Reciprocal rank fusion: điểm = tổng 1 / (k + hạng) qua các danh sách; hòa điểm giữ thứ tự danh sách đầu"""
+        scores: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, i in enumerate(ranking, start=1):
+                scores[i] = scores.get(i, 0.0) + 1.0 / (k + rank)
+        return sorted(scores, key=lambda i: scores[i], reverse=True)
+
+    @classmethod
+    def select(cls, chunks: List[Dict[str, Any]], query: str, top_k: int) -> List[Dict[str, Any]]:
+        """Chọn top_k chunk chỉ theo BM25"""
+        return cls._pick(chunks, [i for i, _ in cls.rank_bm25(chunks, query)], top_k)
+
+    @staticmethod
+    def rank_bm25(chunks: List[Dict[str, Any]], query: str) -> List[Tuple[int, float]]:
+        """[(chỉ số chunk, điểm BM25)] của các chunk có điểm > 0, điểm giảm dần"""
+        if not chunks:
+            return []
+        query_terms = set(normalize_terms(query))
+        docs = [Counter(normalize_terms(f"{chunk['heading'] or ''}\n{chunk['text']}")) for chunk in chunks]
+        lengths = [sum(doc.values()) for doc in docs]
+        avg_length = (sum(lengths) / len(lengths)) or 1.0
+        doc_freq = Counter(term for doc in docs for term in query_terms if term in doc)
+        n_docs = len(docs)
+
+        scores = []
+        for doc, length in zip(docs, lengths):
+            score = 0.0
+            for term in query_terms:
+                tf = doc.get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                score += idf * tf * (RAG_BM25_K1 + 1) / (tf + RAG_BM25_K1 * (1 - RAG_BM25_B + RAG_BM25_B * length / avg_length))
+            scores.append(score)
+
+        ranked = sorted((i for i in range(n_docs) if scores[i] > 0), key=lambda i: scores[i], reverse=True)
+        return [(i, scores[i]) for i in ranked]
+
+    @staticmethod
+    def _pick(chunks: List[Dict[str, Any]], ranked: List[int], top_k: int) -> List[Dict[str, Any]]:
+        """Lấy top_k chunk theo thứ tự ranked; mỗi file có mặt trong ranked được giữ ít nhất chunk tốt nhất của nó"""
+        if not chunks:
+            return []
+        if not ranked:
+            # Câu hỏi chung chung (vd. "phân tích tài liệu"): lấy phần đầu của từng file
+            by_file: Dict[str, List[int]] = {}
+            for i, chunk in enumerate(chunks):
+                by_file.setdefault(chunk["file_id"], []).append(i)
+            ranked = [i for group in zip(*_pad(list(by_file.values()))) for i in group if i is not None]
+
+        picked: List[int] = []
+        seen_files = set()
+        for i in ranked:
+            if chunks[i]["file_id"] not in seen_files and len(picked) < top_k:
+                seen_files.add(chunks[i]["file_id"])
+                picked.append(i)
+        for i in ranked:
+            if len(picked) >= top_k:
+                break
+            if i not in picked:
+                picked.append(i)
+        return [chunks[i] for i in picked]
+
+    @staticmethod
+    def format_context(chunks: List[Dict[str, Any]]) -> str:
+        """Ghép chunk theo file: tên file, rồi từng chunk kèm số trang / tiêu đề.
+
+        Chunk liền sau chunk đã chọn được bỏ phần lặp để không đưa cùng một đoạn hai lần.
+        """
+        parts: List[str] = []
+        previous: Optional[Dict[str, Any]] = None
+        for chunk in chunks:
+            same_file = previous is not None and previous["file_id"] == chunk["file_id"]
+            if not same_file:
+                parts.append(f"\n\n{chunk['original_file_name']}")
+            elif chunk["chunk_index"] != previous["chunk_index"] + 1:
+                parts.append("\n...")
+            if same_file and chunk["chunk_index"] == previous["chunk_index"] + 1:
+                parts.append("\n" + _skip_tokens(chunk["text"], chunk["overlap_tokens"]))
+            else:
+                pages = chunk["page_start"] if chunk["page_start"] == chunk["page_end"] else f"{chunk['page_start']}-{chunk['page_end']}"
+                label = f"[Trang {pages}" + (f" | {chunk['heading']}]" if chunk["heading"] else "]")
+                parts.append(f"\n{label}\n{chunk['text']}")
+            previous = chunk
+        return "".join(parts).strip()
+
+    @staticmethod
+    def _stats(mode: str, chunks: List[Dict[str, Any]], selected: List[Dict[str, Any]],
+               full_tokens: int = 0, context_tokens: int = 0) -> Dict[str, Any]:
+        return {
+            "mode": mode,
+            "files": len({chunk["file_id"] for chunk in chunks}),
+            "chunks_total": len(chunks),
+            "chunks_selected": len(selected),
+            "full_tokens": full_tokens,
+            "context_tokens": context_tokens,
+            "tokens_saved": max(0, full_tokens - context_tokens),
+            "saved_ratio": round(1 - context_tokens / full_tokens, 4) if full_tokens else 0.0
+        }
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _pad(groups: List[List[int]]) -> List[List[Optional[int]]]:
+    longest = max((len(group) for group in groups), default=0)
+    return [group + [None] * (longest - len(group)) for group in groups]
+
+
+# Khởi tạo service
+document_chunk_service = DocumentChunkService()
@@ -0,0 +1,126 @@
+import os
+import hashlib
+import logging
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from app.services.document_chunk_service import normalize_terms
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình embedding cho vector index
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "hashing").lower()   # hashing | openai | huggingface
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")                        # Tên model cho openai / huggingface
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))                    # Số chiều của hashing embedder
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+
+def _normalize_rows(matrix: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Embedding xác định (không cần model / mạng): băm từ đã bỏ dấu và cặp từ liền nhau vào dim chiều.
+
+    Cùng text luôn cho cùng vector trên mọi máy, nên dùng được cho kiểm thử và chạy offline.
+    Dấu của mỗi chiều cũng lấy từ hash để giảm va chạm; vector được chuẩn hóa L2 (tích vô hướng = cosine).
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _bucket(self, term: str):
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if (value >> 63) & 1 else -1.0
+
+    def embed_documents(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, value in enumerate(texts):
+            for term in normalize_terms(value):
+                index, sign = self._bucket(term)
+                matrix[row, index] += sign
+        # Giảm ảnh hưởng của từ lặp nhiều lần (giống sublinear tf)
+        np.copyto(matrix, np.sign(matrix) * np.log1p(np.abs(matrix)))
+        return _normalize_rows(matrix)
+
+    def embed_query(self, value: str) -> "np.ndarray":
+        return self.embed_documents([value])[0]
+
+
+class LangChainEmbedder:
+    """Bọc một đối tượng Embeddings của LangChain (OpenAI, HuggingFace...) để trả về ma trận NumPy đã chuẩn hóa"""
+
+    def __init__(self, name: str, factory: Callable[[], Any], batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.name = name
+        self.dim: Optional[int] = None  # Biết sau lần embed đầu tiên
+        self._factory = factory
+        self._client = None
+        self.batch_size = batch_size
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
+
+    def embed_documents(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            rows.extend(self._get_client().embed_documents(texts[start:start + self.batch_size]))
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+        self.dim = matrix.shape[1]
+        return _normalize_rows(matrix)
+
+    def embed_query(self, value: str) -> "np.ndarray":
+        import numpy as np
+        vector = np.asarray([self._get_client().embed_query(value)], dtype=np.float32)
+        self.dim = vector.shape[1]
+        return _normalize_rows(vector)[0]
+
+
+def _create_hashing(model: str) -> HashingEmbedder:
+    return HashingEmbedder()
+
+
+def _create_openai(model: str) -> LangChainEmbedder:
+    model = model or "text-embedding-3-small"
+
+    def factory():
+        # Chỉ nạp SDK khi embed lần đầu
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model, api_key=os.getenv("OPENAI_API_KEY"))
+    return LangChainEmbedder(f"openai-{model}", factory)
+
+
+def _create_huggingface(model: str) -> LangChainEmbedder:
+    model = model or "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+    def factory():
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model)
+    return LangChainEmbedder(f"huggingface-{model}", factory)
+
+
+# Tên provider -> hàm tạo embedder; mỗi hàm tự import SDK của provider đó
+_EMBEDDERS: Dict[str, Callable[[str], Any]] = {
+    'hashing': _create_hashing,
+    'openai': _create_openai,
+    'huggingface': _create_huggingface,
+}
+
+
+def create_embedder(provider: Optional[str] = None, model: Optional[str] = None) -> Any:
+    """Tạo embedder cho provider (mặc định EMBEDDING_PROVIDER)"""
+    provider = (provider or EMBEDDING_PROVIDER).lower()
+    factory = _EMBEDDERS.get(provider)
+    if factory is None:
+        raise ValueError(f"Embedding provider không được hỗ trợ: {provider}")
+    return factory(model if model is not None else EMBEDDING_MODEL)
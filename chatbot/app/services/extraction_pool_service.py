@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import zlib
+import asyncio
+import logging
+import threading
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Chế độ trích xuất: 'thread' (mặc định, trong process API) hoặc 'process' (ProcessPoolExecutor riêng)
+OCR_EXTRACTION_MODE = os.getenv("OCR_EXTRACTION_MODE", "thread").lower()
+OCR_PROCESS_WORKERS = int(os.getenv("OCR_PROCESS_WORKERS", "2"))
+OCR_PROCESS_MAX_TASKS_PER_CHILD = int(os.getenv("OCR_PROCESS_MAX_TASKS_PER_CHILD", "20"))  # Tạo lại worker sau N file
+OCR_PROCESS_MEMORY_MB = int(os.getenv("OCR_PROCESS_MEMORY_MB", "2048"))                    # Giới hạn bộ nhớ ảo mỗi worker, 0 = không giới hạn
+OCR_PROCESS_PAGE_BATCH = int(os.getenv("OCR_PROCESS_PAGE_BATCH", "10"))                  # Số trang mỗi lần worker gửi về
+OCR_PROCESS_QUEUE_SIZE = 4                                                                # Số message chờ tối đa, worker đợi khi đầy
+OCR_PROCESS_CANCEL_POLL_SECONDS = 0.5
+
+
+def _init_worker(memory_mb: int) -> None:
+    """Chạy một lần khi worker khởi động: đặt giới hạn bộ nhớ (chỉ hỗ trợ Linux/Unix)"""
+    if memory_mb <= 0:
+        return
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Không thể đặt giới hạn bộ nhớ cho worker trích xuất: {e}")
+
+
+def _compact_page(page: Dict[str, Any]) -> Dict[str, Any]:
+    """Chỉ giữ các trường cần cho file_pages, file_page_words và thống kê (bỏ ocr_raw_response...)"""
+    return {
+        'page_number': page['page_number'],
+        'text': page.get('text') or '',
+        'has_images': bool(page.get('has_images', False)),
+        'success': bool(page.get('success', False)),
+        'error': page.get('error') or page.get('ocr_error'),
+        'ocr_decision': page.get('ocr_decision'),
+        'word_boxes': page.get('word_boxes'),
+        'ocr_text_offset': page.get('ocr_text_offset', 0)
+    }
+
+
+class _CancelFlag:
+    """Thay document_service trong worker: ocr_service kiểm tra hủy qua get_upload_info()"""
+
+    def __init__(self, event: Any):
+        self._event = event
+
+    def get_upload_info(self, upload_id: str) -> bool:
+        return not self._event.is_set()
+
+
+def _put(channel: Any, cancel_event: Any, item: Any) -> None:
+    """Đưa item vào hàng đợi về process cha; hàng đợi đầy thì chờ (process cha ghi DB chậm) trừ khi đã bị hủy"""
+    from app.services.ocr_service import UploadCancelledError
+
+    while True:
+        try:
+            channel.put(item, timeout=OCR_PROCESS_CANCEL_POLL_SECONDS)
+            return
+        except queue.Full:
+            if cancel_event.is_set():
+                raise UploadCancelledError("Extraction was cancelled while waiting for the API process.")
+
+
+def _extract_in_worker(file_path: str, is_image: bool, upload_id: Optional[str], channel: Any,
+                       cancel_event: Any, batch_size: int) -> Optional[Dict[str, Any]]:
+    """Hàm chạy trong worker: gửi dần từng nhóm trang (JSON nén zlib), sự kiện tiến độ và lời gọi progress
+    qua channel. Trả về None khi xong, {'cancelled': True} khi bị hủy hoặc {'error': ...} khi lỗi."""
+    # Import trong worker để process cha không phải nạp lại khi pickle hàm
+    from app.services.ocr_service import ocr_service, UploadCancelledError
+    from app.services.upload_progress_service import upload_progress
+
+    def send_batch(batch: List[Dict[str, Any]]) -> None:
+        _put(channel, cancel_event, ('pages', zlib.compress(json.dumps(batch, ensure_ascii=False).encode('utf-8'))))
+
+    upload_progress.forward_to(lambda event_upload_id, event, data: _put(channel, cancel_event, ('event', event_upload_id, event, data)))
+    # ocr_service chỉ kiểm tra hủy / phát sự kiện khi có upload_id; process cha bỏ sự kiện nếu upload không có id
+    pages = ocr_service.iter_file_pages(
+        file_path, is_image, upload_id=upload_id or 'extraction', document_service=_CancelFlag(cancel_event),
+        progress_callback=lambda done, total: _put(channel, cancel_event, ('progress', done, total))
+    )
+    batch: List[Dict[str, Any]] = []
+    try:
+        for page in pages:
+            batch.append(_compact_page(page))
+            if len(batch) >= batch_size:
+                send_batch(batch)
+                batch = []
+            if cancel_event.is_set():
+                raise UploadCancelledError("Extraction was cancelled between pages.")
+        if batch:
+            send_batch(batch)
+        return None
+    except UploadCancelledError:
+        return {'cancelled': True}
+    except HTTPException as e:
+        # HTTPException không pickle ổn định qua process, trả về dạng dữ liệu
+        return {'error': {'status_code': e.status_code, 'detail': e.detail}}
+    finally:
+        pages.close()
+        upload_progress.forward_to(None)
+
+
+class ExtractionPool:
+    """Chạy trích xuất (PyMuPDF, python-docx/pptx, pandas) trong process riêng.
+
+    Worker được tạo lại sau OCR_PROCESS_MAX_TASKS_PER_CHILD file để trả lại bộ nhớ,
+    và bị giới hạn bộ nhớ ảo OCR_PROCESS_MEMORY_MB. Trang được gửi về theo từng nhóm
+    OCR_PROCESS_PAGE_BATCH trang (JSON nén, chỉ gồm text) qua hàng đợi có giới hạn cùng
+    sự kiện tiến độ, nên process cha ghi DB dần như chế độ thread và không process nào
+    giữ toàn bộ file trong bộ nhớ. Hủy upload được báo cho worker qua một Event.
+    """
+
+    def __init__(self, enabled: bool = OCR_EXTRACTION_MODE == "process", max_workers: int = OCR_PROCESS_WORKERS,
+                 max_tasks_per_child: int = OCR_PROCESS_MAX_TASKS_PER_CHILD, memory_mb: int = OCR_PROCESS_MEMORY_MB,
+                 page_batch: int = OCR_PROCESS_PAGE_BATCH):
+        self.enabled = enabled
+        self.max_workers = max(1, max_workers)
+        self.max_tasks_per_child = max_tasks_per_child
+        self.memory_mb = memory_mb
+        self.page_batch = max(1, page_batch)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager: Optional[Any] = None  # multiprocessing.Manager: hàng đợi / Event dùng được giữa các process
+        self._lock = threading.Lock()
+        # Không gửi quá max_workers file cùng lúc: file chờ không chiếm chỗ trong hàng đợi của pool
+        # (ProcessPoolExecutor của Python 3.11 có thể treo khi thay worker mà còn task xếp hàng)
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._stats = {'tasks': 0, 'failed': 0, 'cancelled': 0, 'pool_restarts': 0, 'payload_bytes': 0, 'batches': 0}
+
+    def _get_executor(self) -> Tuple[ProcessPoolExecutor, Any]:
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+            if self._executor is None:
+                # spawn: không kế thừa event loop / kết nối DB của process API
+                kwargs = {}
+                if self.max_tasks_per_child > 0 and sys.version_info >= (3, 11):
+                    kwargs['max_tasks_per_child'] = self.max_tasks_per_child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.memory_mb,),
+                    **kwargs
+                )
+                logger.info(f"Khởi tạo process pool trích xuất: {self.max_workers} worker")
+            return self._executor, self._manager
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._stats['pool_restarts'] += 1
+
+    async def iter_pages(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None,
+                         document_service: Optional[Any] = None,
+                         progress_callback: Optional[Callable[[int, int], None]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Trích xuất file trong worker, trả về dần từng trang đã rút gọn.
+
+        Sự kiện tiến độ của worker được phát lại qua upload_progress của process này và
+        progress_callback được gọi như chế độ thread. Khi upload bị hủy (hoặc người gọi
+        dừng giữa chừng) worker được báo dừng và dừng lại ở trang kế tiếp.
+        """
+        from app.services.ocr_service import UploadCancelledError
+        from app.services.upload_progress_service import upload_progress
+
+        def is_cancelled() -> bool:
+            return bool(upload_id and document_service and not document_service.get_upload_info(upload_id))
+
+        if is_cancelled():
+            raise UploadCancelledError(f"Upload {upload_id} was cancelled before processing.")
+
+        async with self._slots:
+            if is_cancelled():
+                raise UploadCancelledError(f"Upload {upload_id} was cancelled before processing.")
+            executor, manager = await run_in_threadpool(self._get_executor)
+            channel = manager.Queue(maxsize=OCR_PROCESS_QUEUE_SIZE)
+            cancel_event = manager.Event()
+            future = asyncio.get_running_loop().run_in_executor(
+                executor, _extract_in_worker, file_path, is_image, upload_id, channel, cancel_event, self.page_batch
+            )
+            cancelled_by_user = False
+            try:
+                while True:
+                    try:
+                        message = await run_in_threadpool(channel.get, True, OCR_PROCESS_CANCEL_POLL_SECONDS)
+                    except queue.Empty:
+                        if future.done() and channel.empty():
+                            break
+                        message = None
+                    if message is None:
+                        pass
+                    elif message[0] == 'pages':
+                        self._stats['batches'] += 1
+                        self._stats['payload_bytes'] += len(message[1])
+                        for page in json.loads(zlib.decompress(message[1])):
+                            yield page
+                    elif message[0] == 'event':
+                        _, event_upload_id, event, data = message
+                        upload_progress.emit(event_upload_id if upload_id else None, event, **data)
+                    elif message[0] == 'progress' and progress_callback:
+                        try:
+                            progress_callback(message[1], message[2])
+                        except Exception as e:
+                            logger.warning(f"Lỗi trong progress callback: {e}")
+                    if not cancelled_by_user and is_cancelled():
+                        cancelled_by_user = True
+                        cancel_event.set()
+                outcome = future.result()
+            except BrokenProcessPool as e:
+                # Worker bị kill (thường do vượt giới hạn bộ nhớ): tạo lại pool cho lần sau
+                self._stats['failed'] += 1
+                self._reset_executor()
+                raise HTTPException(status_code=500, detail=f"Lỗi xử lý file: worker trích xuất bị dừng ({e})")
+            except MemoryError:
+                self._stats['failed'] += 1
+                raise HTTPException(status_code=500, detail="Lỗi xử lý file: vượt quá giới hạn bộ nhớ của worker trích xuất")
+            except BaseException:
+                # Người gọi dừng giữa chừng (lỗi ghi DB, generator bị đóng): báo worker dừng và chờ nó trả slot
+                if not future.done():
+                    cancel_event.set()
+                    await self._drain(channel, future)
+                raise
+
+        if outcome and outcome.get('cancelled'):
+            self._stats['cancelled'] += 1
+            raise UploadCancelledError(f"Upload {upload_id} was cancelled during processing.")
+        if outcome and 'error' in outcome:
+            self._stats['failed'] += 1
+            raise HTTPException(status_code=outcome['error']['status_code'], detail=outcome['error']['detail'])
+        self._stats['tasks'] += 1
+
+    @staticmethod
+    async def _drain(channel: Any, future: "asyncio.Future") -> None:
+        """Bỏ các message còn lại để worker không kẹt ở put(), chờ tới khi worker dừng"""
+        while not future.done():
+            try:
+                await run_in_threadpool(channel.get, True, OCR_PROCESS_CANCEL_POLL_SECONDS)
+            except queue.Empty:
+                pass
+            except Exception:
+                break
+        if future.done() and not future.cancelled():
+            future.exception()  # Đã xử lý, tránh cảnh báo "exception was never retrieved"
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'enabled': self.enabled, 'max_workers': self.max_workers}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+
+
+# Khởi tạo service
+extraction_pool = ExtractionPool()
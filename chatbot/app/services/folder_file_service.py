@@ -1,6 +1,7 @@
 from pathlib import Path
 import shutil
 import os
+import hashlib
 from typing import List, Optional, Union, Dict, Any, BinaryIO
 from uuid import UUID, uuid4
 from datetime import datetime, timezone, date, timedelta
@@ -14,7 +15,8 @@ from sqlalchemy.exc import IntegrityError, SQLAlchemyError, DBAPIError
 from sqlalchemy.orm import joinedload, aliased
 from app.services.user_access_level_service import UserAccessLevelService
 from datetime import timedelta, datetime, timezone
-from sqlalchemy import select, distinct, or_, union, func, and_, exists
+from sqlalchemy import select, distinct, or_, union, func, and_, exists, literal_column, text, cast, literal
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from functools import wraps
 
 def db_transaction(timeout: int = 30):
@@ -48,9 +50,19 @@ from app.schemas.folder_file_schema import (
 )
 from app.services.postgres_service import postgres_service
 from app.services.user_access_level_service import UserAccessLevelService
+from app.services.upload_progress_service import upload_progress
+from app.services.upload_registry_service import upload_registry
+from app.services.vector_index_service import vector_index_service
 
 logger = logging.getLogger(__name__)
 
+# Tìm kiếm toàn văn không phân biệt dấu (cần chạy sql_onProduction/Tekjoy_Migration_FullTextSearch.sql,
+# chưa chạy thì tự dùng ILIKE như trước)
+FULLTEXT_SEARCH_ENABLED = os.getenv("FULLTEXT_SEARCH_ENABLED", "true").lower() == "true"
+FULLTEXT_SEARCH_CONFIG = os.getenv("FULLTEXT_SEARCH_CONFIG", "tekjoy_unaccent")
+FULLTEXT_HEADLINE_MAX_CHARS = int(os.getenv("FULLTEXT_HEADLINE_MAX_CHARS", "200000"))  # Chỉ tạo đoạn trích từ phần đầu văn bản
+_HEADLINE_OPTIONS = 'StartSel=<b>, StopSel=</b>, MaxFragments=2, MinWords=8, MaxWords=25, FragmentDelimiter=" … "'
+
 class DocumentService:
     def __init__(self):
         """Khởi tạo service và tạo các thư mục cần thiết."""
@@ -66,9 +78,12 @@ class DocumentService:
             'text': ['text/plain']
         }
         
-        # Dictionary để theo dõi các upload đang diễn ra
-        self.active_uploads = {}
+        # Các upload đang diễn ra được theo dõi trong upload_registry (bảng upload_sessions, dùng chung giữa các worker)
         
+        # Database đã có f_unaccent / cấu hình tìm kiếm / cột search_vector chưa (chỉ ghi nhớ khi đã có)
+        self._fulltext_ready = False
+        self._fulltext_warned = False
+
         # Tạo các thư mục nếu chưa tồn tại
         self._setup_directories()
     
@@ -130,46 +145,64 @@ class DocumentService:
             logger.error(f"Lỗi khi xóa file tạm {file_path}: {e}")
             return False
             
-    def register_upload(self, upload_id: str, file_info: dict) -> None:
+    async def register_upload(self, upload_id: str, file_info: dict, user_id: Optional[str] = None) -> None:
         """Đăng ký một upload đang diễn ra.
         
         Args:
             upload_id: ID của upload
             file_info: Thông tin về file đang upload
+            user_id: Người upload
         """
-        self.active_uploads[upload_id] = file_info
+        await upload_registry.register(upload_id, file_info, user_id=user_id)
         
     def get_upload_info(self, upload_id: str) -> dict:
-        """Lấy thông tin về một upload đang diễn ra.
+        """Lấy thông tin về một upload đang diễn ra trong process này.
+        
+        Không truy vấn DB nên gọi được từ thread OCR; upload bị hủy ở worker khác
+        sẽ trả về None sau khi nhận NOTIFY (hoặc tối đa UPLOAD_REGISTRY_POLL_SECONDS).
         
         Args:
             upload_id: ID của upload
             
         Returns:
-            dict: Thông tin về upload hoặc None nếu không tồn tại
+            dict: Thông tin về upload hoặc None nếu không tồn tại / đã bị hủy
         """
-        return self.active_uploads.get(upload_id)
+        return upload_registry.get(upload_id)
+
+    async def finish_upload(self, upload_id: str) -> None:
+        """Xóa upload đã xử lý xong khỏi registry"""
+        try:
+            await upload_registry.finish(upload_id)
+        except Exception as e:
+            logger.warning(f"Không thể xóa upload {upload_id} khỏi registry: {e}")
         
-    async def cancel_upload(self, upload_id: str, db: AsyncSession) -> dict:
+    async def cancel_upload(self, upload_id: str, db: AsyncSession, user_id: Optional[str] = None) -> dict:
         """Hủy một upload đang diễn ra.
         
         Args:
             upload_id: ID của upload cần hủy
             db: Database session
+            user_id: Người yêu cầu hủy; None (admin) được hủy upload của mọi người
             
         Returns:
-            dict: Kết quả hủy upload
+            dict: Kết quả hủy upload ("forbidden": True nếu upload thuộc người khác)
         """
-        upload_info = self.active_uploads.get(upload_id)
+        if user_id:
+            upload_session = await upload_registry.lookup(upload_id)
+            if upload_session and upload_session.get("user_id") != user_id:
+                return {"success": False, "forbidden": True, "message": "Bạn không có quyền hủy upload này"}
+
+        # Ghi trạng thái hủy vào DB và NOTIFY cho worker đang xử lý upload (có thể là worker khác)
+        upload_info = await upload_registry.cancel(upload_id, user_id=user_id)
         if not upload_info:
             return {"success": False, "message": "Upload không tồn tại hoặc đã hoàn thành"}
             
         # Xóa file tạm nếu đã được lưu
-        if "storage_path" in upload_info:
+        if upload_info.get("storage_path"):
             await self.cleanup_upload_file(upload_info["storage_path"])
             
         # Xóa thông tin file khỏi database nếu đã được tạo
-        if "file_id" in upload_info:
+        if upload_info.get("file_id"):
             try:
                 file_id = upload_info["file_id"]
                 file = await db.get(File, file_id)
@@ -177,13 +210,11 @@ class DocumentService:
                     await db.delete(file)
                     await db.commit()
                     logger.info(f"Đã xóa file {file_id} từ database")
+                await vector_index_service.delete_file(file_id)
             except Exception as e:
                 logger.error(f"Lỗi khi xóa file từ database: {e}")
                 await db.rollback()
                 
-        # Xóa khỏi danh sách active uploads
-        self.active_uploads.pop(upload_id, None)
-        
         return {"success": True, "message": "Đã hủy upload thành công"}
             
     async def create_folder(self, db: AsyncSession, folder_data: FolderCreate, user_id: UUID) -> Optional[FolderPublic]:
@@ -522,13 +553,23 @@ class DocumentService:
             logger.error(f"Lỗi khi xóa thư mục {folder_id}: {e}")
             return False
 
-    async def _save_file_chunks(self, file: UploadFile, filepath: Path, chunk_size: int = 1024 * 1024) -> int:
+    @staticmethod
+    def _write_chunk(f: BinaryIO, chunk: bytes, hasher: Optional[Any] = None) -> None:
+        """Ghi một chunk và cập nhật hash nội dung (chạy trong thread pool)"""
+        f.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+
+    async def _save_file_chunks(self, file: UploadFile, filepath: Path, chunk_size: int = 1024 * 1024, upload_id: Optional[str] = None,
+                                hasher: Optional[Any] = None) -> int:
         """Lưu file theo từng chunk để tiết kiệm bộ nhớ.
         
         Args:
             file: File upload từ client
             filepath: Đường dẫn đích để lưu file
             chunk_size: Kích thước mỗi chunk (mặc định 1MB)
+            upload_id: ID của upload, dùng để phát sự kiện 'bytes_saved' sau mỗi chunk
+            hasher: Đối tượng hashlib được cập nhật theo từng chunk (tính hash trong lúc ghi, không đọc lại file)
             
         Returns:
             int: Tổng kích thước file đã lưu (bytes)
@@ -544,8 +585,9 @@ class DocumentService:
                     if not chunk:
                         break
                     # Ghi chunk vào file đích (đồng bộ, chạy trong thread pool)
-                    await run_in_threadpool(f.write, chunk)
+                    await run_in_threadpool(self._write_chunk, f, chunk, hasher)
                     total_size += len(chunk)
+                    upload_progress.emit(upload_id, 'bytes_saved', bytes=len(chunk), saved=total_size, total=file.size)
                     
                     # Kiểm tra kích thước tối đa (50MB)
                     if total_size > 50 * 1024 * 1024:  # 50MB
@@ -566,46 +608,57 @@ class DocumentService:
                 detail=f"Không thể lưu file: {e}"
             )
 
-    async def save_upload_file(self, file: UploadFile, user_id: str = None, **kwargs) -> dict:
-        """Xử lý lưu file upload và lưu thông tin vào PostgreSQL."""
-        # Tạo tên file duy nhất
+    async def _insert_file_record(self, filepath: Path, original_file_name: str, mime_type: Optional[str], file_size: int,
+                                  content_hash: str, user_id: Optional[str] = None, upload_id: Optional[str] = None, **kwargs) -> dict:
+        """Lưu thông tin file đã nằm trong thư mục uploads vào PostgreSQL."""
+        # Chuẩn bị dữ liệu để lưu vào database
+        file_info = {
+            "original_file_name": original_file_name,
+            "file_extension": filepath.suffix[1:],  # Bỏ dấu . ở đầu
+            "mime_type": mime_type,
+            "file_size_bytes": file_size,
+            "storage_path": str(filepath.absolute()),
+            "download_link": f"/uploads/{filepath.name}",
+            "uploaded_by_user_id": user_id,
+            "processing_status": "uploaded",
+            "content_hash": content_hash
+        }
+        
+        # Thêm các thông tin bổ sung nếu có
+        file_info.update(kwargs)
+        
+        result = await postgres_service.insert_file_data(**file_info)
+        if not result["success"]:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Lỗi khi lưu thông tin file: {result.get('error', 'Unknown error')}"
+            )
+
+        upload_progress.emit(upload_id, 'file_saved', file_id=result["file_info"].get("id"), bytes=file_size)
+        return result["file_info"]
+
+    def _new_upload_path(self, original_file_name: str) -> Path:
+        """Tạo tên file duy nhất trong thư mục uploads"""
         utc_time = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
-        filename = f"{utc_time}_{file.filename}"
-        filepath = self.upload_dir / filename
+        return self.upload_dir / f"{utc_time}_{original_file_name}"
+
+    async def save_upload_file(self, file: UploadFile, user_id: str = None, upload_id: Optional[str] = None, **kwargs) -> dict:
+        """Xử lý lưu file upload và lưu thông tin vào PostgreSQL."""
+        filepath = self._new_upload_path(file.filename)
         
         try:
-            # Lưu file từng chunk
-            file_size = await self._save_file_chunks(file, filepath)
+            # Lưu file từng chunk, đồng thời tính SHA-256 nội dung để dùng lại kết quả trích xuất của file trùng
+            hasher = hashlib.sha256()
+            file_size = await self._save_file_chunks(file, filepath, upload_id=upload_id, hasher=hasher)
             logger.info(f"Đã lưu file {file.filename} thành công, kích thước: {file_size} bytes")
 
-            # Chuẩn bị dữ liệu để lưu vào database
-            file_info = {
-                "original_file_name": file.filename,
-                "file_extension": filepath.suffix[1:],  # Bỏ dấu . ở đầu
-                "mime_type": file.content_type,
-                "file_size_bytes": file_size,
-                "storage_path": str(filepath.absolute()),
-                "download_link": f"/uploads/{filename}",
-                "uploaded_by_user_id": user_id,
-                "processing_status": "uploaded"
-            }
-            
-            # Thêm các thông tin bổ sung nếu có
-            file_info.update(kwargs)
-            
             # Lưu thông tin vào database
             try:
-                result = await postgres_service.insert_file_data(**file_info)
-                
-                if not result["success"]:
-                    await self._safe_delete_file(filepath)
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"Lỗi khi lưu thông tin file: {result.get('error', 'Unknown error')}"
-                    )
-
-                return result["file_info"]
-                
+                return await self._insert_file_record(filepath, file.filename, file.content_type, file_size,
+                                                      hasher.hexdigest(), user_id=user_id, upload_id=upload_id, **kwargs)
+            except HTTPException:
+                await self._safe_delete_file(filepath)
+                raise
             except Exception as db_error:
                 await self._safe_delete_file(filepath)
                 logger.error(f"Lỗi database khi lưu file: {db_error}", exc_info=True)
@@ -620,13 +673,35 @@ class DocumentService:
             
         except Exception as e:
             logger.error(f"Lỗi không xác định khi xử lý upload file: {e}", exc_info=True)
-            if 'filepath' in locals():
-                await self._safe_delete_file(filepath)
+            await self._safe_delete_file(filepath)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Đã xảy ra lỗi không xác định: {str(e)}"
             )
 
+    async def save_assembled_file(self, source_path: Union[str, Path], original_file_name: str, mime_type: Optional[str],
+                                  content_hash: str, user_id: str = None, upload_id: Optional[str] = None, **kwargs) -> dict:
+        """Chuyển file đã ghép từ upload nhiều phần vào thư mục uploads và lưu thông tin vào PostgreSQL.
+
+        File được đổi tên (không sao chép). Nếu lưu DB thất bại, file được trả về vị trí cũ để có thể hoàn tất lại.
+        """
+        source_path = Path(source_path)
+        filepath = self._new_upload_path(original_file_name)
+        await run_in_threadpool(os.replace, source_path, filepath)
+        file_size = (await run_in_threadpool(filepath.stat)).st_size
+        try:
+            return await self._insert_file_record(filepath, original_file_name, mime_type, file_size, content_hash,
+                                                  user_id=user_id, upload_id=upload_id, **kwargs)
+        except Exception as e:
+            await run_in_threadpool(os.replace, filepath, source_path)
+            if isinstance(e, HTTPException):
+                raise
+            logger.error(f"Lỗi database khi lưu file {original_file_name}: {e}", exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Lỗi khi lưu thông tin file vào database: {str(e)}"
+            )
+
     async def create_file(self, db: AsyncSession, file_data: FileCreate, user_id: UUID) -> Optional[FilePublic]:
         """Tạo một tệp tin mới."""
         try:
@@ -705,6 +780,7 @@ class DocumentService:
             # Xóa bản ghi trong database
             await db.delete(file)
             await db.commit()
+            await vector_index_service.delete_file(str(file_id))
             return True
             
         except SQLAlchemyError as e:
@@ -929,6 +1005,26 @@ class DocumentService:
         user_access_service = UserAccessLevelService()
         await user_access_service.refresh_user_access_files(db, user_id=user_id, is_admin=is_admin, files=files)
 
+    async def _fulltext_available(self, db: AsyncSession) -> bool:
+        """Tìm kiếm toàn văn dùng được chưa: đã bật và đã chạy Tekjoy_Migration_FullTextSearch.sql"""
+        if not FULLTEXT_SEARCH_ENABLED:
+            return False
+        if self._fulltext_ready:
+            return True
+        result = await db.execute(text("""
+            SELECT to_regprocedure('f_unaccent(text)') IS NOT NULL
+               AND EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = :config)
+               AND EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_schema = current_schema() AND table_name = 'files' AND column_name = 'search_vector')
+        """), {"config": FULLTEXT_SEARCH_CONFIG})
+        if not result.scalar():
+            if not self._fulltext_warned:
+                logger.warning("Chưa chạy Tekjoy_Migration_FullTextSearch.sql, tìm kiếm theo tên / nội dung dùng ILIKE")
+                self._fulltext_warned = True
+            return False
+        self._fulltext_ready = True
+        return True
+
     async def search_files(
         self,
         db: AsyncSession,
@@ -967,11 +1063,22 @@ class DocumentService:
         filters = []
         
         # Text search filters
+        tsquery = None
+        fulltext = bool(name_query or content_query) and await self._fulltext_available(db)
         if name_query:
-            filters.append(File.original_file_name.ilike(f"%{name_query}%"))
+            if fulltext:
+                # Khớp biểu thức của index trigram idx_files_name_trgm
+                filters.append(func.lower(func.f_unaccent(File.original_file_name))
+                               .like(func.lower(func.f_unaccent(f"%{name_query}%"))))
+            else:
+                filters.append(File.original_file_name.ilike(f"%{name_query}%"))
         if file_extension:
             filters.append(File.file_extension == file_extension)
-        if content_query:
+        if content_query and fulltext and content_query.strip():
+            # Cú pháp như công cụ tìm kiếm: "cụm từ", OR, -loại trừ; không phân biệt dấu
+            tsquery = func.websearch_to_tsquery(cast(literal(FULLTEXT_SEARCH_CONFIG), REGCONFIG), content_query)
+            filters.append(literal_column("files.search_vector").op("@@")(tsquery))
+        elif content_query:
             filters.append(File.extracted_text.ilike(f"%{content_query}%"))
         # Timestamp filters
         if upload_from_utc:
@@ -1016,10 +1123,13 @@ class DocumentService:
         # Count query
         count_query = select(func.count()).select_from(base_query.subquery())
         
-        # Data query với pagination
+        # Data query với pagination (tìm theo nội dung thì xếp theo độ liên quan trước)
+        order_by = [File.upload_timestamp.desc()]
+        if tsquery is not None:
+            order_by.insert(0, func.ts_rank_cd(literal_column("files.search_vector"), tsquery).desc())
         data_query = (
             base_query
-            .order_by(File.upload_timestamp.desc())
+            .order_by(*order_by)
             .limit(page_size)
             .offset((page - 1) * page_size)
         )
@@ -1031,9 +1141,30 @@ class DocumentService:
         total, result = await asyncio.gather(total_task, files_task)
         files = result.scalars().all()
         
+        highlights = {}
+        if tsquery is not None and files:
+            highlights = await self._search_highlights(db, [str(f.id) for f in files], content_query)
+        
         return {
             "page": page,
             "page_size": page_size,
             "total": total or 0,
-            "items": files
+            "items": files,
+            "highlights": highlights
         }
+
+    async def _search_highlights(self, db: AsyncSession, file_ids: List[str], content_query: str) -> Dict[str, Dict[str, Any]]:
+        """Độ liên quan và đoạn trích (ts_headline) cho các file của trang kết quả.
+
+        Chạy riêng sau khi đã phân trang để chỉ tạo đoạn trích cho tối đa page_size file.
+        """
+        result = await db.execute(text("""
+            SELECT id,
+                   ts_rank_cd(search_vector, q) AS search_rank,
+                   ts_headline(CAST(:config AS regconfig), left(coalesce(extracted_text, ''), :max_chars), q, :options) AS search_snippet
+            FROM files, websearch_to_tsquery(CAST(:config AS regconfig), :query) AS q
+            WHERE id = ANY(CAST(:ids AS uuid[]))
+        """), {"config": FULLTEXT_SEARCH_CONFIG, "max_chars": FULLTEXT_HEADLINE_MAX_CHARS,
+               "options": _HEADLINE_OPTIONS, "query": content_query, "ids": file_ids})
+        return {str(row.id): {"search_rank": float(row.search_rank), "search_snippet": row.search_snippet}
+                for row in result.fetchall()}
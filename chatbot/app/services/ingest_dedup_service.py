@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from ..db.database import get_session
+from app.services.postgres_service import postgres_service
+from app.services.upload_progress_service import upload_progress
+from app.services.upload_registry_service import upload_registry
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình dùng lại kết quả trích xuất cho file trùng nội dung
+INGEST_DEDUP_ENABLED = os.getenv("INGEST_DEDUP_ENABLED", "true").lower() == "true"
+INGEST_DEDUP_WAIT_SECONDS = float(os.getenv("INGEST_DEDUP_WAIT_SECONDS", "600"))  # Chờ tối đa lần trích xuất đang chạy của file trùng
+INGEST_DEDUP_POLL_SECONDS = float(os.getenv("INGEST_DEDUP_POLL_SECONDS", "2"))     # Chu kỳ kiểm tra lần trích xuất ở worker khác
+INGEST_DEDUP_HEARTBEAT_SECONDS = 15
+INGEST_DEDUP_STALE_SECONDS = 60                                                    # Không heartbeat quá lâu = worker đã chết
+
+
+class IngestDeduplicator:
+    """Dùng lại kết quả trích xuất theo content_hash (SHA-256 nội dung file) và gộp các lần trích xuất trùng.
+
+    - File đã trích xuất xong có cùng hash: sao chép kết quả, không OCR lại.
+    - Cùng nội dung đang được trích xuất (single-flight): upload sau chờ lần đang chạy rồi sao chép.
+      Trong một process dùng asyncio.Event theo hash; giữa các worker dùng một dòng trong bảng
+      ingest_inflight có heartbeat (không giữ transaction), dòng của worker chết tự hết hạn.
+      Nếu lần đang chạy thất bại (không có kết quả để dùng lại), upload sau tự trích xuất.
+    """
+
+    def __init__(self, enabled: bool = INGEST_DEDUP_ENABLED, wait_seconds: float = INGEST_DEDUP_WAIT_SECONDS):
+        self.enabled = enabled
+        self.wait_seconds = wait_seconds
+        self._inflight: Dict[str, asyncio.Event] = {}
+        self._stats = {'lookups': 0, 'hits': 0, 'joined': 0, 'waited': 0, 'misses': 0, 'pages_reused': 0, 'bytes_skipped': 0}
+
+    async def run(self, file_id: str, extract: Callable[[], Awaitable[Dict[str, Any]]],
+                  reuse: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+                  progress_id: Optional[str] = None) -> Dict[str, Any]:
+        """Trích xuất file_id bằng extract() hoặc dùng lại kết quả của file trùng nội dung bằng reuse(source_id).
+
+        reuse trả về None nếu không sao chép được (vd. file nguồn vừa bị xóa), khi đó sẽ trích xuất bình thường.
+        """
+        if not self.enabled or not await postgres_service.files_has_column("content_hash"):
+            return await extract()
+        lookup = await postgres_service.find_extraction_source(file_id)
+        content_hash = lookup.get("content_hash") if lookup["success"] else None
+        if not content_hash:
+            # File cũ chưa có hash hoặc lỗi khi tra cứu
+            return await extract()
+        self._stats['lookups'] += 1
+
+        result = await self._try_reuse(lookup, reuse, progress_id, joined=False)
+        if result:
+            return result
+
+        # Single-flight trong process: chờ lần trích xuất đang chạy của cùng nội dung
+        while content_hash in self._inflight:
+            upload_progress.emit(progress_id, 'dedup_wait', content_hash=content_hash)
+            try:
+                await asyncio.wait_for(self._inflight[content_hash].wait(), timeout=self.wait_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Chờ trích xuất trùng nội dung {content_hash[:12]} quá {self.wait_seconds}s, tự trích xuất")
+                break
+            result = await self._try_reuse(await postgres_service.find_extraction_source(file_id), reuse, progress_id, joined=True)
+            if result:
+                return result
+
+        event = asyncio.Event()
+        owner = content_hash not in self._inflight
+        if owner:
+            self._inflight[content_hash] = event
+        try:
+            async with self._cross_worker_claim(content_hash, file_id, progress_id) as waited:
+                if waited:
+                    # Worker khác vừa trích xuất xong cùng nội dung
+                    result = await self._try_reuse(await postgres_service.find_extraction_source(file_id), reuse,
+                                                   progress_id, joined=True)
+                    if result:
+                        return result
+                self._stats['misses'] += 1
+                return await extract()
+        finally:
+            if owner:
+                self._inflight.pop(content_hash, None)
+                event.set()
+
+    async def _try_reuse(self, lookup: Dict[str, Any], reuse: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+                         progress_id: Optional[str], joined: bool) -> Optional[Dict[str, Any]]:
+        source_id = lookup.get("source_id") if lookup.get("success") else None
+        if not source_id:
+            return None
+        result = await reuse(source_id)
+        if not result:
+            return None
+        self._stats['joined' if joined else 'hits'] += 1
+        self._stats['pages_reused'] += result.get("pages") or 0
+        self._stats['bytes_skipped'] += lookup.get("file_size_bytes") or 0
+        upload_progress.emit(progress_id, 'dedup_hit', source_file_id=source_id, pages=result.get("pages"), joined=joined)
+        return result
+
+    @asynccontextmanager
+    async def _cross_worker_claim(self, content_hash: str, file_id: str, progress_id: Optional[str]) -> AsyncIterator[bool]:
+        """Đánh dấu nội dung đang được trích xuất (bảng ingest_inflight) tới khi thoát context.
+
+        Nếu worker khác đang trích xuất cùng nội dung thì chờ (mỗi INGEST_DEDUP_POLL_SECONDS thử lại, tối đa
+        INGEST_DEDUP_WAIT_SECONDS) tới khi họ xong; trả về True nếu đã phải chờ. Không giữ transaction hay
+        kết nối DB trong lúc trích xuất: mỗi lần đánh dấu / heartbeat là một câu lệnh ngắn, dòng của worker
+        chết không còn heartbeat quá INGEST_DEDUP_STALE_SECONDS sẽ bị worker khác lấy lại.
+        Lỗi khi đánh dấu (vd. chưa chạy migration) không chặn việc trích xuất.
+        """
+        waited = False
+        claimed = False
+        deadline = time.monotonic() + self.wait_seconds
+        try:
+            while True:
+                claimed = await self._claim(content_hash, file_id)
+                if claimed is not False or time.monotonic() >= deadline:
+                    break
+                if not waited:
+                    waited = True
+                    self._stats['waited'] += 1
+                    upload_progress.emit(progress_id, 'dedup_wait', content_hash=content_hash)
+                await asyncio.sleep(INGEST_DEDUP_POLL_SECONDS)
+            if waited and not claimed:
+                logger.warning(f"Chờ trích xuất trùng nội dung {content_hash[:12]} quá {self.wait_seconds}s, tự trích xuất")
+        except Exception as e:
+            logger.warning(f"Không đánh dấu được trích xuất cho nội dung {content_hash[:12]}: {e}")
+            claimed = None
+
+        heartbeat = asyncio.create_task(self._heartbeat(content_hash, file_id)) if claimed else None
+        try:
+            yield waited
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+                try:
+                    await heartbeat
+                except asyncio.CancelledError:
+                    pass
+            if claimed:
+                try:
+                    await self._release(content_hash, file_id)
+                except Exception as e:
+                    logger.warning(f"Lỗi khi bỏ đánh dấu trích xuất {content_hash[:12]}: {e}")
+
+    @staticmethod
+    async def _claim(content_hash: str, file_id: str) -> bool:
+        """True nếu đã đánh dấu được (chưa ai trích xuất hoặc dòng cũ đã quá hạn heartbeat), False nếu worker khác đang chạy"""
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    INSERT INTO ingest_inflight (content_hash, file_id, worker_id)
+                    VALUES (:content_hash, :file_id, :worker_id)
+                    ON CONFLICT (content_hash) DO UPDATE SET
+                        file_id = EXCLUDED.file_id,
+                        worker_id = EXCLUDED.worker_id,
+                        started_at = NOW(),
+                        heartbeat_at = NOW()
+                    WHERE ingest_inflight.heartbeat_at < NOW() - make_interval(secs => :stale_seconds)
+                    RETURNING file_id
+                """), {"content_hash": content_hash, "file_id": file_id, "worker_id": upload_registry.worker_id,
+                       "stale_seconds": INGEST_DEDUP_STALE_SECONDS})
+                claimed = result.fetchone() is not None
+                await session.commit()
+                return claimed
+            except Exception:
+                await session.rollback()
+                raise
+
+    @staticmethod
+    async def _heartbeat(content_hash: str, file_id: str) -> None:
+        while True:
+            await asyncio.sleep(INGEST_DEDUP_HEARTBEAT_SECONDS)
+            try:
+                async with get_session() as session:
+                    await session.execute(text("""
+                        UPDATE ingest_inflight SET heartbeat_at = NOW()
+                        WHERE content_hash = :content_hash AND file_id = :file_id
+                    """), {"content_hash": content_hash, "file_id": file_id})
+                    await session.commit()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Lỗi heartbeat trích xuất {content_hash[:12]}: {e}")
+
+    @staticmethod
+    async def _release(content_hash: str, file_id: str) -> None:
+        async with get_session() as session:
+            try:
+                await session.execute(text("""
+                    DELETE FROM ingest_inflight WHERE content_hash = :content_hash AND file_id = :file_id
+                """), {"content_hash": content_hash, "file_id": file_id})
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Số lần dùng lại kết quả (hits: file đã xong, joined: chờ lần đang chạy) và tỷ lệ dùng lại"""
+        stats = dict(self._stats)
+        reused = stats['hits'] + stats['joined']
+        stats['hit_rate'] = round(reused / stats['lookups'], 4) if stats['lookups'] else 0.0
+        stats['inflight'] = len(self._inflight)
+        stats['enabled'] = self.enabled
+        return stats
+
+
+# Khởi tạo service
+ingest_dedup = IngestDeduplicator()
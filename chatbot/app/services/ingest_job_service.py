@@ -0,0 +1,490 @@
+import os
+import asyncio
+import logging
+from contextlib import aclosing
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from sqlalchemy import text
+
+from ..db.database import get_session
+from app.core.db_retry import retry_on_deadlock
+from app.services.ocr_service import ocr_service, UploadCancelledError
+from app.services.postgres_service import postgres_service
+from app.services.extraction_pool_service import extraction_pool
+from app.services.upload_progress_service import upload_progress
+from app.services.upload_registry_service import upload_registry
+from app.services.ingest_dedup_service import ingest_dedup
+from app.services.document_chunk_service import DocumentChunker
+from app.services.vector_index_service import vector_index_service
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình worker OCR chạy nền
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))                    # Số job chạy song song trong mỗi process
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))        # Chu kỳ quét job mới trong DB
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "600"))      # Job 'processing' không heartbeat quá lâu sẽ được chạy lại
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_PROGRESS_FLUSH_SECONDS = 1.0
+INGEST_PAGE_FLUSH_SIZE = int(os.getenv("INGEST_PAGE_FLUSH_SIZE", "10"))  # Số trang mỗi lần ghi vào file_pages
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    """Chuyển row SQL thành dict, UUID/datetime thành chuỗi (giống postgres_service)"""
+    data = dict(row._mapping)
+    for key, value in data.items():
+        if isinstance(value, UUID):
+            data[key] = str(value)
+        elif isinstance(value, datetime):
+            data[key] = value.isoformat()
+    return data
+
+
+def _page_row(page: Dict[str, Any]) -> Dict[str, Any]:
+    """Giữ lại các trường cần lưu của một trang (bỏ ocr_raw_response, bbox...)"""
+    page_text = page.get('text') or ''
+    return {
+        "page_number": page['page_number'],
+        "text": page_text,
+        "char_count": len(page_text),
+        "word_count": len(page_text.split()),
+        "has_images": bool(page.get('has_images', False)),
+        "success": bool(page.get('success', False)),
+        "error_message": page.get('error') or page.get('ocr_error')
+    }
+
+
+def _word_row(page: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Word boxes OCR của trang dạng blob cho file_page_words, None nếu trang không có"""
+    if not page.get('word_boxes'):
+        return None
+    from app.services.ocr_words_service import decode_word_boxes  # NumPy chỉ nạp khi có word boxes
+
+    boxes = decode_word_boxes(page.get('word_boxes'))
+    if not boxes:
+        return None
+    return {
+        "page_number": page['page_number'],
+        "word_count": len(boxes),
+        "avg_confidence": round(boxes.average_confidence),
+        "text_offset": int(page.get('ocr_text_offset') or 0),
+        "boxes": boxes.to_bytes()
+    }
+
+
+async def _extract_pages_in_threadpool(file_path: str, upload_id: Optional[str], document_service: Any,
+                                       progress_callback: Optional[Callable[[int, int], None]],
+                                       handle: Callable[[Dict[str, Any]], Any]) -> None:
+    """Chạy generator iter_file_pages trong threadpool và xử lý từng trang ngay khi có"""
+    pages = ocr_service.iter_file_pages(file_path, upload_id=upload_id, document_service=document_service,
+                                        progress_callback=progress_callback)
+    try:
+        async for page in iterate_in_threadpool(pages):
+            await handle(page)
+    finally:
+        # Đóng generator (dừng executor OCR, đóng file PDF) nếu dừng giữa chừng
+        await run_in_threadpool(pages.close)
+
+
+async def extract_file_to_db(file_id: str, file_path: str, upload_id: Optional[str] = None, document_service: Any = None,
+                             progress_callback: Optional[Callable[[int, int], None]] = None,
+                             update_data: Optional[Dict[str, Any]] = None, progress_id: Optional[str] = None) -> Dict[str, Any]:
+    """Trích xuất file theo từng trang và ghi dần vào bảng file_pages.
+
+    Mỗi INGEST_PAGE_FLUSH_SIZE trang được ghi một lần rồi giải phóng khỏi bộ nhớ;
+    files.extracted_text/char_count/word_count được ghép trong SQL sau khi xong trang cuối.
+    Với OCR_EXTRACTION_MODE=process, việc trích xuất chạy trong process pool riêng.
+    Nếu đã có file cùng nội dung được trích xuất xong (hoặc đang trích xuất), kết quả của file đó
+    được sao chép thay vì OCR lại (xem ingest_dedup_service).
+    Sự kiện 'db_write' / 'db_write_done' được phát theo progress_id (mặc định là upload_id).
+    update_data (vd. processing_status='completed') chỉ được ghi khi trích xuất thành công; không trang nào
+    trích xuất được thì file được đánh dấu 'failed' kèm lỗi.
+    Trả về {"success", "file", "pages", "processed_pages", "error"} (kèm "deduplicated_from" nếu dùng lại).
+    """
+    progress_id = progress_id or upload_id
+
+    async def extract() -> Dict[str, Any]:
+        return await _extract_file_pages_to_db(file_id, file_path, upload_id, document_service,
+                                               progress_callback, update_data, progress_id)
+
+    async def reuse(source_id: str) -> Optional[Dict[str, Any]]:
+        if upload_id and document_service and not document_service.get_upload_info(upload_id):
+            raise UploadCancelledError(f"Upload {upload_id} was cancelled before processing.")
+        return await _reuse_extraction(source_id, file_id, update_data, progress_id, progress_callback)
+
+    return await ingest_dedup.run(file_id, extract, reuse, progress_id=progress_id)
+
+
+async def _reuse_extraction(source_id: str, file_id: str, update_data: Optional[Dict[str, Any]], progress_id: Optional[str],
+                            progress_callback: Optional[Callable[[int, int], None]]) -> Optional[Dict[str, Any]]:
+    """Sao chép kết quả trích xuất của file cùng nội dung; None nếu không sao chép được"""
+    result, _ = await retry_on_deadlock(postgres_service.copy_file_extraction, source_id=source_id,
+                                        file_id=file_id, update_data=update_data)
+    if not result["success"]:
+        logger.warning(f"Không thể dùng lại kết quả trích xuất của file {source_id} cho file {file_id}: {result['error']}")
+        return None
+    total_pages, processed_pages = result["pages"], result["processed_pages"]
+    if progress_callback:
+        progress_callback(total_pages, total_pages)
+    upload_progress.emit(progress_id, 'db_write_done', pages=total_pages, processed_pages=processed_pages)
+    await vector_index_service.index_file(file_id)  # Chunk vừa được sao chép từ file nguồn
+    logger.info(f"File {file_id}: dùng lại kết quả trích xuất của file {source_id} (cùng nội dung, {total_pages} trang)")
+    return {
+        "success": processed_pages > 0 or total_pages == 0,
+        "file": result["file"],
+        "pages": total_pages,
+        "processed_pages": processed_pages,
+        "ocr_summary": ocr_service.summarize_pdf_ocr_decisions([]),
+        "error": None,
+        "deduplicated_from": source_id
+    }
+
+
+async def _extract_file_pages_to_db(file_id: str, file_path: str, upload_id: Optional[str], document_service: Any,
+                                    progress_callback: Optional[Callable[[int, int], None]],
+                                    update_data: Optional[Dict[str, Any]], progress_id: Optional[str]) -> Dict[str, Any]:
+    """Trích xuất file và ghi từng nhóm trang vào file_pages (phần thân của extract_file_to_db)"""
+    result, _ = await retry_on_deadlock(postgres_service.delete_file_pages, file_id=file_id)
+    if not result["success"]:
+        raise RuntimeError(f"Lỗi khi xóa trang cũ: {result['error']}")
+    await vector_index_service.delete_file(file_id)
+
+    batch = []
+    word_batch = []
+    chunk_batch = []
+    chunker = DocumentChunker()  # Chia chunk (dùng khi chat) ngay trong lúc nhận trang
+    decisions = []  # Chỉ giữ quyết định OCR của từng trang để thống kê
+    total_pages = 0
+    processed_pages = 0
+    first_error = None
+
+    async def flush() -> None:
+        result, _ = await retry_on_deadlock(postgres_service.upsert_file_pages, file_id=file_id, pages=list(batch))
+        if not result["success"]:
+            raise RuntimeError(f"Lỗi khi lưu trang: {result['error']}")
+        if word_batch:
+            # Sau file_pages vì file_page_words tham chiếu tới trang
+            result, _ = await retry_on_deadlock(postgres_service.upsert_file_page_words, file_id=file_id, rows=list(word_batch))
+            if not result["success"]:
+                raise RuntimeError(f"Lỗi khi lưu word boxes: {result['error']}")
+            word_batch.clear()
+        await flush_chunks()
+        upload_progress.emit(progress_id, 'db_write', pages=len(batch), last_page=batch[-1]["page_number"])
+        batch.clear()
+
+    async def flush_chunks() -> None:
+        if chunk_batch:
+            result, _ = await retry_on_deadlock(postgres_service.upsert_file_chunks, file_id=file_id, chunks=list(chunk_batch))
+            if not result["success"]:
+                raise RuntimeError(f"Lỗi khi lưu chunk: {result['error']}")
+            await vector_index_service.add_chunks(file_id, list(chunk_batch))
+            chunk_batch.clear()
+
+    async def handle(page: Dict[str, Any]) -> None:
+        nonlocal total_pages, processed_pages, first_error
+        row = _page_row(page)
+        decisions.append({'ocr_decision': page.get('ocr_decision')})
+        total_pages += 1
+        if row["success"]:
+            processed_pages += 1
+            chunk_batch.extend(chunker.add_page(row["page_number"], row["text"]))
+        elif first_error is None:
+            first_error = row["error_message"]
+        batch.append(row)
+        word_row = _word_row(page)
+        if word_row:
+            word_batch.append(word_row)
+        if len(batch) >= INGEST_PAGE_FLUSH_SIZE:
+            await flush()
+
+    if extraction_pool.enabled:
+        # Worker gửi về từng nhóm trang và sự kiện tiến độ, xử lý giống chế độ thread
+        async with aclosing(extraction_pool.iter_pages(file_path, upload_id=upload_id, document_service=document_service,
+                                                       progress_callback=progress_callback)) as pages:
+            async for page in pages:
+                await handle(page)
+    else:
+        await _extract_pages_in_threadpool(file_path, upload_id, document_service, progress_callback, handle)
+    if batch:
+        await flush()
+    chunk_batch.extend(chunker.finish())
+    await flush_chunks()
+
+    success = processed_pages > 0 or total_pages == 0
+    if not success:
+        # Không gắn trạng thái của người gọi (vd. 'completed') cho file trích xuất thất bại
+        first_error = first_error or "OCR thất bại"
+        update_data = {"processing_status": "failed", "error_message": first_error}
+    result, _ = await retry_on_deadlock(postgres_service.assemble_extracted_text, file_id=file_id, update_data=update_data)
+    if not result["success"]:
+        raise RuntimeError(f"Lỗi khi cập nhật thông tin OCR: {result['error']}")
+    upload_progress.emit(progress_id, 'db_write_done', pages=total_pages, processed_pages=processed_pages)
+
+    ocr_summary = ocr_service.summarize_pdf_ocr_decisions(decisions)
+    if ocr_summary['ocr_calls_avoided']:
+        logger.info(f"File {file_id}: tránh được {ocr_summary['ocr_calls_avoided']} lần gọi OCR ({ocr_summary})")
+
+    return {
+        "success": success,
+        "file": result["file"],
+        "pages": total_pages,
+        "processed_pages": processed_pages,
+        "ocr_summary": ocr_summary,
+        "error": first_error
+    }
+
+
+class IngestJobService:
+    """Hàng đợi job OCR lưu trong bảng ingest_jobs.
+
+    Upload trả về ngay sau khi lưu file; worker nền (asyncio task trong mỗi process)
+    nhận job bằng SELECT ... FOR UPDATE SKIP LOCKED nên nhiều worker gunicorn dùng chung
+    một hàng đợi, và job đang chạy dở khi restart sẽ được nhận lại sau INGEST_STALE_SECONDS.
+    """
+
+    def __init__(self):
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._document_service = None
+        # job_id -> (done, total), được cập nhật từ thread OCR
+        self._progress: Dict[str, tuple] = {}
+
+    # ---- DB HELPERS ----
+    async def create_job(self, file_id: str, upload_id: Optional[str] = None) -> Dict[str, Any]:
+        """Tạo job mới ở trạng thái 'queued' và đánh dấu file đang chờ xử lý"""
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    INSERT INTO ingest_jobs (file_id, upload_id, status)
+                    VALUES (:file_id, :upload_id, 'queued')
+                    RETURNING *
+                """), {"file_id": file_id, "upload_id": upload_id})
+                job = _row_to_dict(result.fetchone())
+                await session.execute(
+                    text("UPDATE files SET processing_status = 'queued' WHERE id = :file_id"),
+                    {"file_id": file_id}
+                )
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+        if self._wakeup:
+            self._wakeup.set()
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with get_session() as session:
+            result = await session.execute(text("SELECT * FROM ingest_jobs WHERE id = :job_id"), {"job_id": job_id})
+            row = result.fetchone()
+            return _row_to_dict(row) if row else None
+
+    async def _update_job(self, job_id: str, **fields: Any) -> None:
+        set_clause = ", ".join(f"{key} = :{key}" for key in fields)
+        async with get_session() as session:
+            try:
+                await session.execute(
+                    text(f"UPDATE ingest_jobs SET {set_clause}, updated_at = NOW() WHERE id = :job_id"),
+                    {**fields, "job_id": job_id}
+                )
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def _finish_job(self, job_id: str, status: str, error_message: Optional[str] = None) -> None:
+        async with get_session() as session:
+            try:
+                await session.execute(text("""
+                    UPDATE ingest_jobs
+                    SET status = :status, error_message = :error_message,
+                        finished_at = NOW(), updated_at = NOW()
+                    WHERE id = :job_id
+                """), {"status": status, "error_message": error_message, "job_id": job_id})
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def _claim_next_job(self) -> Optional[Dict[str, Any]]:
+        """Nhận một job đang chờ (hoặc job bị treo quá lâu) cho worker hiện tại"""
+        async with get_session() as session:
+            try:
+                # Job treo đã chạy lại quá số lần cho phép -> thất bại
+                await session.execute(text("""
+                    UPDATE ingest_jobs
+                    SET status = 'failed', error_message = 'Vượt quá số lần thử xử lý', finished_at = NOW(), updated_at = NOW()
+                    WHERE status = 'processing' AND attempts >= :max_attempts
+                      AND updated_at < NOW() - make_interval(secs => :stale)
+                """), {"max_attempts": INGEST_MAX_ATTEMPTS, "stale": INGEST_STALE_SECONDS})
+
+                result = await session.execute(text("""
+                    UPDATE ingest_jobs
+                    SET status = 'processing', attempts = attempts + 1,
+                        started_at = NOW(), updated_at = NOW()
+                    WHERE id = (
+                        SELECT id FROM ingest_jobs
+                        WHERE status = 'queued'
+                           OR (status = 'processing' AND attempts < :max_attempts
+                               AND updated_at < NOW() - make_interval(secs => :stale))
+                        ORDER BY created_at
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING *
+                """), {"max_attempts": INGEST_MAX_ATTEMPTS, "stale": INGEST_STALE_SECONDS})
+                row = result.fetchone()
+                await session.commit()
+                return _row_to_dict(row) if row else None
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def _set_file_status(self, file_id: str, processing_status: str, error_message: Optional[str] = None) -> None:
+        update_data = {"processing_status": processing_status}
+        if error_message is not None:
+            update_data["error_message"] = error_message
+        result, _ = await retry_on_deadlock(postgres_service.update_file_data, file_id=file_id, update_data=update_data)
+        if not result["success"]:
+            logger.error(f"Không thể cập nhật trạng thái file {file_id}: {result['error']}")
+
+    # ---- JOB EXECUTION ----
+    async def _flush_progress(self, job_id: str) -> None:
+        """Ghi tiến độ hiện tại vào DB (đồng thời là heartbeat của job)"""
+        done, total = self._progress.get(job_id, (0, None))
+        await self._update_job(job_id, pages_done=done, pages_total=total)
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        file_id = job["file_id"]
+        upload_id = job.get("upload_id")
+        document_service = self._document_service
+
+        file_result = await postgres_service.get_file_by_id(file_id)
+        if not file_result["success"]:
+            await self._finish_job(job_id, "failed", f"Không tìm thấy file: {file_result.get('error')}")
+            return
+        file_path = file_result["file"]["storage_path"]
+
+        # Nhận theo dõi upload từ registry dùng chung để nhận lệnh hủy từ mọi worker
+        if upload_id and document_service:
+            upload_row = await upload_registry.adopt(upload_id)
+            if upload_row and upload_row["status"] == "cancelled":
+                await self._finish_job(job_id, "cancelled", "Upload đã bị hủy")
+                upload_progress.emit(upload_id, 'cancelled', job_id=job_id)
+                return
+            if not upload_row:
+                upload_id = None
+        else:
+            upload_id = None
+
+        await self._set_file_status(file_id, "processing")
+        logger.info(f"Bắt đầu job OCR {job_id} cho file {file_id}")
+
+        self._progress[job_id] = (0, None)
+        ocr_task = asyncio.ensure_future(extract_file_to_db(
+            file_id=file_id,
+            file_path=file_path,
+            upload_id=upload_id,
+            document_service=document_service if upload_id else None,
+            progress_callback=lambda done, total: self._progress.__setitem__(job_id, (done, total)),
+            update_data={"processing_status": "completed"},
+            progress_id=job.get("upload_id")
+        ))
+        try:
+            while not ocr_task.done():
+                await asyncio.wait({ocr_task}, timeout=INGEST_PROGRESS_FLUSH_SECONDS)
+                try:
+                    await self._flush_progress(job_id)
+                except Exception as e:
+                    logger.warning(f"Không thể ghi tiến độ job {job_id}: {e}")
+
+            try:
+                ingest_result = ocr_task.result()
+            except UploadCancelledError:
+                logger.info(f"Job {job_id}: upload {upload_id} đã bị hủy")
+                await self._finish_job(job_id, "cancelled", "Upload đã bị hủy")
+                upload_progress.emit(job.get("upload_id"), 'cancelled', job_id=job_id)
+                return
+            except HTTPException as e:
+                await self._set_file_status(file_id, "failed", str(e.detail))
+                await self._finish_job(job_id, "failed", str(e.detail))
+                upload_progress.emit(job.get("upload_id"), 'failed', job_id=job_id, error=str(e.detail))
+                return
+
+            if not ingest_result["success"]:
+                error = ingest_result.get("error") or "OCR thất bại"
+                await self._set_file_status(file_id, "failed", error)
+                await self._finish_job(job_id, "failed", error)
+                upload_progress.emit(job.get("upload_id"), 'failed', job_id=job_id, error=error)
+                return
+
+            done, total = self._progress.get(job_id, (0, None))
+            await self._update_job(job_id, pages_done=total or done, pages_total=total or done)
+            await self._finish_job(job_id, "completed")
+            upload_progress.emit(job.get("upload_id"), 'completed', job_id=job_id, file_id=file_id,
+                                 pages=ingest_result["pages"], processed_pages=ingest_result["processed_pages"])
+            logger.info(f"Hoàn thành job OCR {job_id} cho file {file_id}")
+
+            # Xóa file tạm sau khi đã trích xuất OCR thành công
+            if document_service:
+                await document_service.cleanup_upload_file(file_path)
+                if job.get("upload_id"):
+                    await document_service.finish_upload(job["upload_id"])
+
+        except Exception as e:
+            logger.error(f"Lỗi khi chạy job OCR {job_id}: {e}", exc_info=True)
+            try:
+                await self._set_file_status(file_id, "failed", str(e))
+                await self._finish_job(job_id, "failed", str(e))
+                upload_progress.emit(job.get("upload_id"), 'failed', job_id=job_id, error=str(e))
+            except Exception:
+                logger.error(f"Không thể ghi trạng thái lỗi cho job {job_id}", exc_info=True)
+        finally:
+            self._progress.pop(job_id, None)
+
+    async def _worker_loop(self, worker_idx: int) -> None:
+        while not self._stopping:
+            try:
+                job = await self._claim_next_job()
+            except Exception as e:
+                logger.error(f"Ingest worker {worker_idx}: lỗi khi nhận job: {e}")
+                job = None
+
+            if job:
+                await self._run_job(job)
+                continue
+
+            # Không có job: chờ job mới trong process này hoặc tới lần quét tiếp theo
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=INGEST_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    # ---- LIFECYCLE ----
+    async def start(self, document_service: Any = None) -> None:
+        """Khởi động các worker nền (gọi khi ứng dụng start)"""
+        if self._workers:
+            return
+        self._stopping = False
+        self._document_service = document_service
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker_loop(i)) for i in range(INGEST_WORKERS)]
+        logger.info(f"Đã khởi động {INGEST_WORKERS} ingest worker")
+
+    async def stop(self) -> None:
+        """Dừng các worker nền (job đang chạy dở sẽ được nhận lại khi restart)"""
+        self._stopping = True
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+# Khởi tạo service
+ingest_job_service = IngestJobService()
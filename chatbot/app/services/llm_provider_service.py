@@ -0,0 +1,29 @@
+import os
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Provider dùng khi không chỉ định (chat_settings hiện chỉ lưu tên model của OpenAI)
+LLM_DEFAULT_PROVIDER = os.getenv("LLM_DEFAULT_PROVIDER", "openai").lower()
+
+
+def _create_openai(model: str, **kwargs: Any) -> Any:
+    # langchain_openai (kéo theo openai, tiktoken, langchain_core) chỉ được nạp ở lần chat đầu tiên
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model, **kwargs)
+
+
+# Tên provider -> hàm tạo chat model; mỗi hàm tự import SDK của provider đó
+_PROVIDERS: Dict[str, Callable[..., Any]] = {
+    'openai': _create_openai,
+}
+
+
+def create_chat_model(model: str, provider: Optional[str] = None, **kwargs: Any) -> Any:
+    """Tạo chat model LangChain cho provider (mặc định LLM_DEFAULT_PROVIDER)"""
+    provider = (provider or LLM_DEFAULT_PROVIDER).lower()
+    factory = _PROVIDERS.get(provider)
+    if factory is None:
+        raise ValueError(f"LLM provider không được hỗ trợ: {provider}")
+    return factory(model, **kwargs)
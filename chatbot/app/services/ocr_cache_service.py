@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình cache kết quả OCR theo nội dung ảnh
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", str(Path.cwd() / "ocr_cache"))
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "256"))
+
+
+class OCRResultCache:
+    """Cache kết quả OCR trên đĩa, khóa theo sha256(bytes ảnh) + model + ngôn ngữ.
+
+    Mỗi kết quả là một file JSON trong OCR_CACHE_DIR. Thứ tự LRU được giữ trong bộ nhớ
+    (khởi tạo lại từ mtime khi start) và file cũ nhất bị xóa khi tổng dung lượng vượt giới hạn.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = OCR_CACHE_DIR, max_bytes: int = OCR_CACHE_MAX_MB * 1024 * 1024, enabled: bool = OCR_CACHE_ENABLED):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> kích thước file
+        self._size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.enabled:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                self._load_index()
+            except OSError as e:
+                logger.warning(f"Không thể khởi tạo OCR cache tại {self.cache_dir}: {e}. Tắt cache.")
+                self.enabled = False
+
+    @staticmethod
+    def make_key(image_bytes: Union[bytes, memoryview], model: str, lang: str, variant: str = '') -> str:
+        """Tạo khóa cache từ nội dung ảnh, model, ngôn ngữ OCR và cấu hình tiền xử lý (variant)"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        key = f"{digest}_{model}_{lang}"
+        return f"{key}_{variant}" if variant else key
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _load_index(self) -> None:
+        """Đọc lại các entry đã có trên đĩa, sắp xếp theo mtime (cũ nhất trước)"""
+        found = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+                found.append((stat.st_mtime, path.stem, stat.st_size))
+            except OSError:
+                continue
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size_bytes += size
+        self._evict_if_needed()
+        logger.info(f"OCR cache: {len(self._entries)} entry, {self._size_bytes} bytes tại {self.cache_dir}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Lấy kết quả OCR đã cache, trả về None nếu chưa có"""
+        if not self.enabled:
+            return None
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            os.utime(path, None)  # Cập nhật mtime để giữ thứ tự LRU giữa các lần khởi động
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._size_bytes -= size
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Entry do worker khác ghi
+                size = path.stat().st_size
+                self._entries[key] = size
+                self._size_bytes += size
+        return result
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        """Lưu kết quả OCR thành công vào cache"""
+        if not self.enabled:
+            return
+        path = self._path_for(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Không thể ghi OCR cache {key}: {e}")
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            old_size = self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._size_bytes += len(data) - old_size
+            self._evict_if_needed()
+
+    def _evict_if_needed(self) -> None:
+        """Xóa entry ít dùng nhất tới khi tổng dung lượng nằm trong giới hạn (gọi khi đã giữ lock)"""
+        while self._entries and self._size_bytes > self.max_bytes:
+            key, size = self._entries.popitem(last=False)
+            self._size_bytes -= size
+            self.evictions += 1
+            try:
+                self._path_for(key).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Không thể xóa OCR cache {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê hit/miss và dung lượng cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self._size_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,217 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Giới hạn số request OCR đồng thời, tự điều chỉnh theo độ trễ/lỗi (AIMD)
+OCR_LIMIT_INITIAL = int(os.getenv("OCR_LIMIT_INITIAL", "4"))
+OCR_LIMIT_MIN = int(os.getenv("OCR_LIMIT_MIN", "1"))
+OCR_LIMIT_MAX = int(os.getenv("OCR_LIMIT_MAX", os.getenv("OCR_POOL_MAXSIZE", "8")))
+OCR_LIMIT_LATENCY_TARGET_MS = float(os.getenv("OCR_LIMIT_LATENCY_TARGET_MS", "5000"))  # Chậm hơn mức này coi như quá tải
+OCR_LIMIT_DECREASE_FACTOR = float(os.getenv("OCR_LIMIT_DECREASE_FACTOR", "0.5"))
+OCR_LIMIT_ACQUIRE_TIMEOUT = float(os.getenv("OCR_LIMIT_ACQUIRE_TIMEOUT", "120"))       # Chờ slot tối đa (giây)
+
+# Circuit breaker: ngắt khi backend lỗi liên tục, thử lại sau thời gian chờ
+OCR_BREAKER_FAILURES = int(os.getenv("OCR_BREAKER_FAILURES", "5"))                     # Số lỗi liên tiếp để ngắt
+OCR_BREAKER_ERROR_RATE = float(os.getenv("OCR_BREAKER_ERROR_RATE", "0.5"))             # Hoặc tỷ lệ lỗi trong cửa sổ gần nhất
+OCR_BREAKER_WINDOW = int(os.getenv("OCR_BREAKER_WINDOW", "20"))
+OCR_BREAKER_COOLDOWN_SECONDS = float(os.getenv("OCR_BREAKER_COOLDOWN_SECONDS", "30"))
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class OCRCircuitOpenError(Exception):
+    """OCR backend đang bị ngắt (circuit breaker mở), request bị từ chối ngay."""
+    pass
+
+
+class OCRLimiterTimeoutError(Exception):
+    """Chờ quá lâu mà không có slot gửi request OCR."""
+    pass
+
+
+class OCRConcurrencyLimiter:
+    """Giới hạn số request OCR đang chạy, dùng chung cho mọi thread trong process.
+
+    Giới hạn tăng thêm 1 sau mỗi `limit` request thành công nhanh hơn mục tiêu, và giảm
+    theo hệ số OCR_LIMIT_DECREASE_FACTOR khi request lỗi hoặc chậm (tối đa một lần mỗi
+    chu kỳ độ trễ mục tiêu). Circuit breaker mở khi lỗi liên tiếp hoặc tỷ lệ lỗi cao,
+    sau OCR_BREAKER_COOLDOWN_SECONDS cho một request thử (half-open) đi qua.
+    """
+
+    def __init__(self, initial: int = OCR_LIMIT_INITIAL, min_limit: int = OCR_LIMIT_MIN, max_limit: int = OCR_LIMIT_MAX,
+                 latency_target_ms: float = OCR_LIMIT_LATENCY_TARGET_MS, decrease_factor: float = OCR_LIMIT_DECREASE_FACTOR,
+                 acquire_timeout: float = OCR_LIMIT_ACQUIRE_TIMEOUT, breaker_failures: int = OCR_BREAKER_FAILURES,
+                 breaker_error_rate: float = OCR_BREAKER_ERROR_RATE, breaker_window: int = OCR_BREAKER_WINDOW,
+                 breaker_cooldown: float = OCR_BREAKER_COOLDOWN_SECONDS):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target_ms = latency_target_ms
+        self.decrease_factor = decrease_factor
+        self.acquire_timeout = acquire_timeout
+        self.breaker_failures = breaker_failures
+        self.breaker_error_rate = breaker_error_rate
+        self.breaker_cooldown = breaker_cooldown
+
+        self._cond = threading.Condition()
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self._in_flight = 0
+        self._successes_since_increase = 0
+        self._last_decrease = 0.0
+        self._latency_ewma_ms = None
+        self._outcomes = deque(maxlen=max(1, breaker_window))  # True = thành công
+
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._probe_in_flight = False
+
+        self._counters = {'requests': 0, 'failures': 0, 'rejected': 0, 'timeouts': 0, 'breaker_opened': 0,
+                          'limit_increases': 0, 'limit_decreases': 0}
+
+    # ---- ACQUIRE / RELEASE ----
+    def _check_breaker(self) -> Optional[bool]:
+        """Gọi khi đã giữ lock. True: request này là request thử (half-open); False: breaker
+        đóng; None: đang có request thử, chờ kết quả của nó."""
+        if self._state == STATE_OPEN:
+            if time.monotonic() - self._opened_at < self.breaker_cooldown:
+                self._counters['rejected'] += 1
+                raise OCRCircuitOpenError("OCR backend tạm thời không khả dụng (circuit breaker đang mở)")
+            self._state = STATE_HALF_OPEN
+            logger.info("OCR circuit breaker: half-open, gửi request thử")
+        if self._state == STATE_HALF_OPEN:
+            if self._probe_in_flight:
+                return None
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def acquire(self) -> bool:
+        """Chờ tới khi có slot. Trả về True nếu là request thử của circuit breaker."""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                # Breaker có thể đã mở / đóng lại trong lúc chờ
+                probe = self._check_breaker()
+                if probe or (probe is False and self._in_flight < int(self._limit)):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise OCRLimiterTimeoutError(f"Hết thời gian chờ slot gửi OCR ({self.acquire_timeout}s)")
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            self._counters['requests'] += 1
+            return probe
+
+    def release(self, latency_ms: float, success: bool, probe: bool = False) -> None:
+        """Trả slot và cập nhật giới hạn / trạng thái breaker theo kết quả request"""
+        with self._cond:
+            self._in_flight -= 1
+            if probe:
+                self._probe_in_flight = False
+            self._latency_ewma_ms = latency_ms if self._latency_ewma_ms is None else 0.8 * self._latency_ewma_ms + 0.2 * latency_ms
+            if not success:
+                self._counters['failures'] += 1
+
+            if probe:
+                # Chỉ request thử quyết định đóng lại / mở tiếp breaker
+                if success:
+                    logger.info("OCR circuit breaker: đóng lại, backend đã hoạt động")
+                    self._state = STATE_CLOSED
+                    self._outcomes.clear()
+                    self._consecutive_failures = 0
+                else:
+                    self._consecutive_failures += 1
+                    self._open()
+            elif self._state == STATE_CLOSED:
+                self._outcomes.append(success)
+                if success:
+                    self._consecutive_failures = 0
+                else:
+                    self._consecutive_failures += 1
+                    if self._should_open():
+                        self._open()
+            # Breaker đang mở / half-open: bỏ qua kết quả của request gửi trước khi breaker mở
+
+            if not success or latency_ms > self.latency_target_ms:
+                self._decrease()
+            else:
+                self._successes_since_increase += 1
+                if self._successes_since_increase >= int(self._limit) and self._limit < self.max_limit:
+                    self._limit = min(self.max_limit, self._limit + 1)
+                    self._successes_since_increase = 0
+                    self._counters['limit_increases'] += 1
+            self._cond.notify_all()
+
+    def _should_open(self) -> bool:
+        if self._state == STATE_OPEN:
+            return False
+        if self._consecutive_failures >= self.breaker_failures:
+            return True
+        if len(self._outcomes) >= self._outcomes.maxlen:
+            error_rate = self._outcomes.count(False) / len(self._outcomes)
+            return error_rate >= self.breaker_error_rate
+        return False
+
+    def _open(self) -> None:
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._counters['breaker_opened'] += 1
+        logger.warning(f"OCR circuit breaker: mở trong {self.breaker_cooldown}s sau {self._consecutive_failures} lỗi liên tiếp")
+
+    def _decrease(self) -> None:
+        """Giảm giới hạn theo cấp số nhân, tối đa một lần mỗi chu kỳ độ trễ mục tiêu"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target_ms / 1000:
+            return
+        new_limit = max(self.min_limit, self._limit * self.decrease_factor)
+        if new_limit < self._limit:
+            self._limit = new_limit
+            self._counters['limit_decreases'] += 1
+        self._last_decrease = now
+        self._successes_since_increase = 0
+
+    @contextmanager
+    def slot(self) -> Iterator[Dict[str, Any]]:
+        """Giữ một slot trong lúc gửi request.
+
+        Code gọi đặt outcome['success'] = False nếu backend lỗi/quá tải; exception
+        thoát khỏi block cũng được tính là lỗi.
+        """
+        probe = self.acquire()
+        outcome = {'success': True}
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException:
+            outcome['success'] = False
+            raise
+        finally:
+            self.release((time.perf_counter() - started) * 1000, outcome['success'], probe)
+
+    # ---- METRICS ----
+    @property
+    def state(self) -> str:
+        with self._cond:
+            return self._state
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            error_rate = self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+            return {
+                'limit': int(self._limit),
+                'in_flight': self._in_flight,
+                'state': self._state,
+                'latency_ewma_ms': round(self._latency_ewma_ms, 1) if self._latency_ewma_ms is not None else None,
+                'error_rate': round(error_rate, 4),
+                'consecutive_failures': self._consecutive_failures,
+                **self._counters
+            }
@@ -0,0 +1,147 @@
+import io
+import os
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình tiền xử lý ảnh trước khi gửi OCR
+OCR_PREPROCESS_ENABLED = os.getenv("OCR_PREPROCESS_ENABLED", "true").lower() == "true"
+OCR_MAX_IMAGE_EDGE = int(os.getenv("OCR_MAX_IMAGE_EDGE", "2500"))            # Cạnh dài tối đa (px), 0 = không giới hạn
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "true").lower() == "true"
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "false").lower() == "true"
+OCR_BINARIZE_THRESHOLD = int(os.getenv("OCR_BINARIZE_THRESHOLD", "0"))      # 0 = lấy theo độ sáng trung bình của ảnh
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "auto").lower()            # auto (JPEG giữ JPEG, còn lại PNG) | png | jpeg
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+
+
+class OCRImagePreprocessor:
+    """Thu nhỏ / chuyển xám / nhị phân hóa ảnh và chọn định dạng trước khi gửi OCR.
+
+    Ảnh được giữ nguyên nếu không đọc được, hoặc nếu không cần thu nhỏ mà bản xử lý
+    lại lớn hơn bản gốc.
+    """
+
+    def __init__(self, enabled: bool = OCR_PREPROCESS_ENABLED, max_edge: int = OCR_MAX_IMAGE_EDGE,
+                 grayscale: bool = OCR_GRAYSCALE, binarize: bool = OCR_BINARIZE,
+                 threshold: int = OCR_BINARIZE_THRESHOLD, image_format: str = OCR_IMAGE_FORMAT,
+                 jpeg_quality: int = OCR_JPEG_QUALITY):
+        if image_format not in ('auto', 'png', 'jpeg', 'jpg'):
+            raise ValueError(f"OCR_IMAGE_FORMAT không hợp lệ: {image_format} (auto | png | jpeg)")
+        self.enabled = enabled
+        self.max_edge = max_edge
+        self.grayscale = grayscale
+        self.binarize = binarize
+        self.threshold = threshold
+        self.image_format = 'jpeg' if image_format == 'jpg' else image_format
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+        self._stats = {'images': 0, 'resized': 0, 'kept_original': 0, 'errors': 0,
+                       'bytes_in': 0, 'bytes_out': 0}
+
+    @property
+    def signature(self) -> str:
+        """Chuỗi ngắn đại diện cấu hình, dùng trong khóa cache OCR ('' nếu tắt)"""
+        if not self.enabled:
+            return ''
+        config = f"{self.max_edge}|{self.grayscale}|{self.binarize}|{self.threshold}|{self.image_format}|{self.jpeg_quality}"
+        return hashlib.md5(config.encode('utf-8')).hexdigest()[:8]
+
+    def process(self, image_bytes: bytes) -> Tuple[bytes, str, Dict[str, Any]]:
+        """Trả về (bytes gửi đi, content type, thông tin tiền xử lý của ảnh)"""
+        original_size = len(image_bytes)
+        info = {'original_bytes': original_size, 'sent_bytes': original_size, 'bytes_saved': 0, 'preprocessed': False}
+        if not self.enabled:
+            return image_bytes, 'image/png', info
+
+        # Nạp Pillow/NumPy khi có ảnh đầu tiên cần xử lý, không phải lúc khởi động API
+        import numpy as np
+        from PIL import Image, ImageOps
+
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as source:
+                image_format = self.image_format
+                if image_format == 'auto':
+                    # Ảnh chụp (JPEG) nén lại bằng PNG sẽ lớn hơn nhiều; ảnh nhị phân thì PNG 1-bit nhỏ nhất
+                    image_format = 'jpeg' if source.format == 'JPEG' and not self.binarize else 'png'
+                img = ImageOps.exif_transpose(source)
+                original_dims = img.size
+                resized = False
+
+                # Giới hạn cạnh dài (ảnh chụp điện thoại 6000px -> OCR_MAX_IMAGE_EDGE)
+                if self.max_edge and max(img.size) > self.max_edge:
+                    scale = self.max_edge / max(img.size)
+                    img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+                    resized = True
+
+                img = self._convert_mode(img)
+
+                if self.binarize:
+                    pixels = np.asarray(img, dtype=np.uint8)
+                    threshold = self.threshold or int(pixels.mean())
+                    img = Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8), mode='L')
+                    if image_format == 'png':
+                        img = img.convert('1', dither=Image.Dither.NONE)  # PNG 1-bit nhỏ hơn nhiều
+
+                out = io.BytesIO()
+                if image_format == 'jpeg':
+                    img.save(out, 'JPEG', quality=self.jpeg_quality, optimize=True)
+                else:
+                    img.save(out, 'PNG')
+                processed = out.getvalue()
+                info['size'] = list(original_dims)
+                info['sent_size'] = list(img.size)
+        except Exception as e:
+            logger.warning(f"Không thể tiền xử lý ảnh OCR, gửi ảnh gốc: {e}")
+            self._record(original_size, original_size, error=True)
+            info['error'] = str(e)
+            return image_bytes, 'image/png', info
+
+        if not resized and len(processed) >= original_size:
+            self._record(original_size, original_size, kept_original=True)
+            info['sent_size'] = info['size']
+            return image_bytes, 'image/png', info
+
+        info.update({
+            'sent_bytes': len(processed),
+            'bytes_saved': original_size - len(processed),
+            'preprocessed': True,
+            'format': image_format
+        })
+        self._record(original_size, len(processed), resized=resized)
+        logger.debug(f"Tiền xử lý ảnh OCR: {original_size} -> {len(processed)} bytes, {info['size']} -> {info['sent_size']}")
+        return processed, f"image/{image_format}", info
+
+    def _convert_mode(self, img: 'Image.Image') -> 'Image.Image':
+        """Chuyển về L (xám) hoặc RGB; nền trong suốt được phủ trắng"""
+        from PIL import Image
+
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img)
+        if self.grayscale or self.binarize:
+            return img.convert('L')
+        return img if img.mode in ('RGB', 'L') else img.convert('RGB')
+
+    def _record(self, bytes_in: int, bytes_out: int, resized: bool = False, kept_original: bool = False, error: bool = False) -> None:
+        with self._lock:
+            self._stats['images'] += 1
+            self._stats['bytes_in'] += bytes_in
+            self._stats['bytes_out'] += bytes_out
+            self._stats['resized'] += int(resized)
+            self._stats['kept_original'] += int(kept_original)
+            self._stats['errors'] += int(error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Tổng số ảnh và số bytes tiết kiệm được"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        stats['enabled'] = self.enabled
+        return stats
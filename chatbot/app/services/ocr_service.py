@@ -1,29 +1,38 @@
 import os
 import json
-import fitz  # PyMuPDF
 # import cv2
-import numpy as np
-from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+import socket
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import base64
-import tempfile
 import logging
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple, Union, BinaryIO # MODIFIED: Added Any
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Tuple, Union, BinaryIO, Callable, Iterator # MODIFIED: Added Any
 
 # Custom exception for cancellation
 class UploadCancelledError(Exception):
     """Custom exception to indicate that the upload was cancelled."""
     pass
-from contextlib import contextmanager
+
+class OCRBatchNotSupportedError(Exception):
+    """OCR server không hỗ trợ endpoint batch."""
+    pass
 from fastapi import HTTPException
-from docx import Document  # python-docx để đọc file Word
-from pptx import Presentation  # python-pptx để đọc file PowerPoint
-import pandas as pd  # pandas để đọc file Excel
+# PyMuPDF (fitz), python-docx, python-pptx, pandas và NumPy được import trong hàm trích xuất
+# tương ứng để khởi động API / worker không phải nạp các thư viện nặng này
+if TYPE_CHECKING:
+    import pandas as pd
 import uuid
 import time
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, RetryError
 from requests.exceptions import RequestException, Timeout, ConnectionError
+from app.services.ocr_cache_service import OCRResultCache
+from app.services.ocr_preprocess_service import OCRImagePreprocessor
+from app.services.ocr_limiter_service import OCRConcurrencyLimiter, OCRCircuitOpenError
+from app.services.upload_progress_service import upload_progress
 
 # Cấu hình logging chỉ xuất ra console
 logging.basicConfig(
@@ -36,6 +45,53 @@ logger = logging.getLogger(__name__)
 # Cấu hình Paddle OCR API
 RETRY_MAX_ATTEMPTS = 3
 RETRY_BACKOFF = 2
+OCR_REQUEST_TIMEOUT = 30
+
+# Cấu hình connection pool cho OCR API (dùng chung cho mọi lần gọi)
+OCR_POOL_CONNECTIONS = int(os.getenv("OCR_POOL_CONNECTIONS", "4"))    # Số host được giữ pool
+OCR_POOL_MAXSIZE = int(os.getenv("OCR_POOL_MAXSIZE", "8"))            # Số kết nối tối đa trên mỗi host
+OCR_POOL_BLOCK = os.getenv("OCR_POOL_BLOCK", "true").lower() == "true"  # Chờ kết nối rảnh thay vì mở thêm
+OCR_TCP_KEEPALIVE = os.getenv("OCR_TCP_KEEPALIVE", "true").lower() == "true"
+
+OCR_MODEL = 'paddle'
+OCR_LANG = 'vie'
+
+# Số trang PDF được OCR song song tối đa (nên <= OCR_POOL_MAXSIZE)
+OCR_PDF_CONCURRENCY = int(os.getenv("OCR_PDF_CONCURRENCY", "4"))
+
+# Callback báo tiến độ: (số đơn vị đã xong, tổng số đơn vị) - đơn vị là trang/slide/sheet
+ProgressCallback = Callable[[int, int], None]
+
+# Số ảnh tối đa trong một request batch (chỉ dùng khi có PADDLE_OCR_BATCH_API_URL)
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+# Mã HTTP cho biết server không có endpoint batch
+OCR_BATCH_UNSUPPORTED_STATUS = {404, 405, 501}
+# Mã HTTP cho biết OCR server quá tải / lỗi: tính là lỗi cho limiter và circuit breaker
+OCR_OVERLOAD_STATUS = {429, 500, 502, 503, 504}
+
+# Quyết định OCR cho từng trang PDF dựa trên text layer
+OCR_MIN_IMAGE_AREA_RATIO = float(os.getenv("OCR_MIN_IMAGE_AREA_RATIO", "0.05"))     # Ảnh nhỏ hơn (logo, icon) được bỏ qua
+OCR_IMAGE_TEXT_COVERAGE = float(os.getenv("OCR_IMAGE_TEXT_COVERAGE", "0.15"))       # Vùng ảnh có text layer phủ >= tỷ lệ này thì không OCR
+OCR_FULL_PAGE_REGION_RATIO = 0.9  # Vùng cần OCR chiếm gần hết trang thì render cả trang
+
+# Số dòng Excel mỗi khối khi đọc dạng streaming
+EXCEL_ROW_BLOCK_SIZE = int(os.getenv("EXCEL_ROW_BLOCK_SIZE", "5000"))
+
+
+class _KeepAliveHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter bật TCP keep-alive cho các kết nối trong pool"""
+
+    def __init__(self, tcp_keepalive: bool = True, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            from urllib3.connection import HTTPConnection
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
 
 class OCRService:
     def __init__(self):
@@ -50,30 +106,133 @@ class OCRService:
         self.paddle_ocr_url = os.getenv("PADDLE_OCR_API_URL")
         if not self.paddle_ocr_url:
             raise ValueError("PADDLE_OCR_API_URL không được cấu hình trong file .env")
-        
+
+        # Endpoint batch (tùy chọn): nhiều ảnh trong một request
+        self.paddle_ocr_batch_url = os.getenv("PADDLE_OCR_BATCH_API_URL")
+        self._batch_supported = bool(self.paddle_ocr_batch_url)
+
+        # Đếm số request đã gửi tới OCR server
+        self._request_stats = {'single_requests': 0, 'batch_requests': 0, 'batched_images': 0}
+
+        # HTTP client dùng chung, giữ kết nối keep-alive tới OCR server (tạo khi gọi OCR lần đầu)
+        self._http_lock = threading.Lock()
+        self._http_session: Optional[requests.Session] = None
+
+        # Cache kết quả OCR theo hash nội dung ảnh, dùng chung cho mọi extractor
+        self.ocr_cache = OCRResultCache()
+
+        # Tiền xử lý ảnh (thu nhỏ, chuyển xám, nhị phân hóa, định dạng) trước khi gửi OCR
+        self.preprocessor = OCRImagePreprocessor()
+
+        # Giới hạn số request đồng thời (AIMD) + circuit breaker, dùng chung cho mọi thread
+        self.limiter = OCRConcurrencyLimiter()
+
+    def _create_http_session(self) -> requests.Session:
+        """Tạo requests.Session với connection pool giới hạn theo host"""
+        session = requests.Session()
+        adapter = _KeepAliveHTTPAdapter(
+            tcp_keepalive=OCR_TCP_KEEPALIVE,
+            pool_connections=OCR_POOL_CONNECTIONS,
+            pool_maxsize=OCR_POOL_MAXSIZE,
+            pool_block=OCR_POOL_BLOCK,
+            max_retries=0  # Retry do tenacity đảm nhiệm
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        session.verify = False  # Chỉ dùng trong môi trường dev, không dùng cho production
+        return session
+
+    def _get_http_session(self) -> requests.Session:
+        """Session dùng chung; tạo lại nếu chưa có hoặc đã bị close()"""
+        with self._http_lock:
+            if self._http_session is None:
+                self._http_session = self._create_http_session()
+            return self._http_session
+
+    def get_http_pool_stats(self) -> Dict[str, int]:
+        """Thống kê số kết nối đã mở mới và số lần tái sử dụng kết nối trong pool"""
+        requests_sent = 0
+        connections_opened = 0
+        with self._http_lock:
+            session = self._http_session
+            adapters = {id(a): a for a in session.adapters.values()} if session is not None else {}
+            for adapter in adapters.values():
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    requests_sent += pool.num_requests
+                    connections_opened += pool.num_connections
+        return {
+            'pool_maxsize': OCR_POOL_MAXSIZE,
+            'requests': requests_sent,
+            'connections_opened': connections_opened,
+            'connections_reused': max(requests_sent - connections_opened, 0)
+        }
+
+    def get_request_stats(self) -> Dict[str, int]:
+        """Thống kê số request single/batch đã gửi tới OCR server"""
+        with self._http_lock:
+            return {**self._request_stats, 'batch_enabled': self._batch_supported}
+
+    def _count_request(self, batch_images: int = 0) -> None:
+        with self._http_lock:
+            if batch_images:
+                self._request_stats['batch_requests'] += 1
+                self._request_stats['batched_images'] += batch_images
+            else:
+                self._request_stats['single_requests'] += 1
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Thống kê hit/miss của cache kết quả OCR"""
+        return self.ocr_cache.get_stats()
+
+    def get_preprocess_stats(self) -> Dict[str, Any]:
+        """Thống kê tiền xử lý ảnh: số ảnh, bytes trước/sau và bytes tiết kiệm được"""
+        return self.preprocessor.get_stats()
+
+    def get_limiter_stats(self) -> Dict[str, Any]:
+        """Giới hạn đồng thời hiện tại, số request đang chạy và trạng thái circuit breaker"""
+        return self.limiter.get_stats()
+
+    def close(self) -> None:
+        """Đóng toàn bộ kết nối trong pool (gọi khi tắt ứng dụng)"""
+        with self._http_lock:
+            if self._http_session is not None:
+                self._http_session.close()
+                self._http_session = None
+
     @retry(
         stop=stop_after_attempt(RETRY_MAX_ATTEMPTS),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         retry=retry_if_exception_type((RequestException, Timeout, ConnectionError)),
         reraise=True
     )
-    def _call_ocr_api_with_retry(self, files: dict, data: dict, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+    def _call_ocr_api_with_retry(self, files: Union[dict, list], data: dict, upload_id: Optional[str] = None, document_service: Optional[Any] = None, batch: bool = False) -> Dict[str, Any]:
         """Gọi OCR API với cơ chế retry và kiểm tra hủy."""
         # --- MODIFICATION: CHECK FOR CANCELLATION ---
         if upload_id and document_service and not document_service.get_upload_info(upload_id):
             raise UploadCancelledError(f"Upload {upload_id} was cancelled before calling API.")
         # --- END MODIFICATION ---
         try:
-            response = requests.post(
-                self.paddle_ocr_url,
-                files=files,
-                data=data,
-                timeout=30,
-                verify=False  # Chỉ dùng trong môi trường dev, không dùng cho production
-            )
+            # Circuit breaker đang mở -> OCRCircuitOpenError ngay, không retry
+            with self.limiter.slot() as outcome:
+                self._count_request(batch_images=len(files) if batch else 0)
+                response = self._get_http_session().post(
+                    self.paddle_ocr_batch_url if batch else self.paddle_ocr_url,
+                    files=files,
+                    data=data,
+                    timeout=OCR_REQUEST_TIMEOUT
+                )
+                # Lỗi 4xx khác (request sai, không hỗ trợ batch) không phản ánh tình trạng server
+                outcome['success'] = response.status_code not in OCR_OVERLOAD_STATUS
+            if batch and response.status_code in OCR_BATCH_UNSUPPORTED_STATUS:
+                raise OCRBatchNotSupportedError(f"OCR batch API trả về HTTP {response.status_code}")
             response.raise_for_status()
             return response.json()
-            
+
         except requests.Timeout as e:
             print(f"⏱️  Timeout khi gọi OCR API: {str(e)}")
             raise
@@ -84,47 +243,33 @@ class OCRService:
             print(f"❌ Lỗi khi gọi OCR API: {str(e)}")
             raise
 
-    def _process_ocr_result(self, api_result: Dict[str, Any]) -> Dict[str, Any]:
-        """Xử lý kết quả OCR từ API"""
+    def _process_ocr_result(self, api_result: Dict[str, Any], preprocess_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Xử lý kết quả OCR từ API.
+
+        Hộp bao / độ tin cậy được gom vào mảng NumPy (OCRWordBoxes) và trả về dạng blob
+        base64 trong 'word_boxes', tọa độ theo ảnh gốc (trước khi tiền xử lý thu nhỏ).
+        """
+        from app.services.ocr_words_service import parse_ocr_blocks
+
         try:
-            ocr_results = api_result.get('result', [])
-            full_text = []
-            words_info = []
-            
             # Xử lý format từ ocr-fullV2
-            for block in ocr_results:
-                if isinstance(block, list):
-                    for result in block:
-                        if isinstance(result, list) and len(result) >= 2:
-                            # result[0] chứa bounding box, result[1] chứa (text, confidence)
-                            bbox = result[0]
-                            text_info = result[1]
-                            
-                            if isinstance(text_info, list) and len(text_info) >= 2:
-                                text = text_info[0]
-                                confidence = float(text_info[1]) * 100  # Chuyển về phần trăm
-                                
-                                full_text.append(text)
-                                words_info.append({
-                                    'text': text,
-                                    'confidence': int(confidence),
-                                    'bbox': {
-                                        'x': int(bbox[0][0]),
-                                        'y': int(bbox[0][1]),
-                                        'width': int(bbox[2][0] - bbox[0][0]),
-                                        'height': int(bbox[2][1] - bbox[0][1])
-                                    }
-                                })
-            
+            full_text, word_boxes = parse_ocr_blocks(api_result.get('result', []))
+
+            # Ảnh đã bị thu nhỏ khi tiền xử lý: đổi tọa độ về kích thước ảnh gốc
+            if preprocess_info and preprocess_info.get('size') and preprocess_info.get('sent_size'):
+                (width, height), (sent_width, sent_height) = preprocess_info['size'], preprocess_info['sent_size']
+                if (width, height) != (sent_width, sent_height) and sent_width and sent_height:
+                    word_boxes = word_boxes.scaled(width / sent_width, height / sent_height)
+
             # In kết quả OCR ra console
             extracted_text = '\n'.join(full_text)
             
             return {
                 'success': True,
                 'text': extracted_text,
-                'words': words_info,
-                'total_words': len(words_info),
-                'average_confidence': sum(w['confidence'] for w in words_info) / len(words_info) if words_info else 0
+                'word_boxes': word_boxes.to_base64(),
+                'total_words': len(word_boxes),
+                'average_confidence': word_boxes.average_confidence
             }
             
         except Exception as e:
@@ -133,60 +278,97 @@ class OCRService:
                 'success': False,
                 'error': f'Lỗi xử lý kết quả OCR: {str(e)}',
                 'text': '',
-                'words': [],
+                'word_boxes': None,
                 'total_words': 0,
                 'average_confidence': 0
             }
 
-    @contextmanager
-    def _temp_image_file(self, image_data: Union[bytes, BinaryIO], suffix: str = '.png') -> str:
-        """Tạo file tạm từ dữ liệu ảnh và tự động xóa sau khi sử dụng"""
-        temp_file = None
+    @staticmethod
+    def _as_image_payload(image_data: Union[bytes, bytearray, memoryview, BinaryIO]) -> Union[bytes, memoryview]:
+        """Chuẩn hóa dữ liệu ảnh về bytes/memoryview mà không ghi ra đĩa"""
+        if isinstance(image_data, (bytes, memoryview)):
+            return image_data
+        if isinstance(image_data, bytearray):
+            return memoryview(image_data)
+        return image_data.read()
+
+    def _ocr_image_from_bytes(self, image_data: Union[bytes, bytearray, memoryview, BinaryIO], file_name: str = 'image.png', upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+        """Xử lý OCR từ dữ liệu ảnh trong bộ nhớ (bytes, memoryview hoặc file-like object).
+
+        Dữ liệu được đưa thẳng vào multipart request, không tạo file tạm.
+        """
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp:
-                if isinstance(image_data, bytes):
-                    temp.write(image_data)
-                else:
-                    temp.write(image_data.read())
-                temp_file = temp.name
-            yield temp_file
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.unlink(temp_file)
-                except Exception as e:
-                    logger.warning(f"Không thể xóa file tạm {temp_file}: {e}")
+            payload, cache_key, cached = self._lookup_ocr_cache(image_data)
+            if cached is not None:
+                logger.debug(f"OCR cache hit: {file_name}")
+                upload_progress.emit(upload_id, 'ocr_cache_hit', image=file_name)
+                return cached
+        except Exception as e:
+            # Ảnh đến từ file-like / blob của python-docx, openpyxl...: lỗi đọc chỉ làm hỏng ảnh này
+            logger.exception(f"Lỗi khi đọc dữ liệu ảnh hoặc tra OCR cache cho {file_name}")
+            return self._ocr_failure(f'Không đọc được dữ liệu ảnh / OCR cache: {str(e)}', retry_count=0)
 
-    def _ocr_image_from_bytes(self, image_data: Union[bytes, BinaryIO], file_name: str = 'image.png', upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
-        """Xử lý OCR từ dữ liệu ảnh dạng bytes hoặc file-like object"""
-        with self._temp_image_file(image_data) as temp_file_path:
-            return self._call_paddle_ocr_api(temp_file_path, file_name, upload_id=upload_id, document_service=document_service)
+        return self._ocr_single_request(payload, file_name, cache_key, upload_id=upload_id, document_service=document_service)
 
-    def _call_paddle_ocr_api(self, image_path: str, file_name: str = None, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
-        """Gọi Paddle OCR API để trích xuất text từ hình ảnh với cơ chế retry"""
-        if not file_name:
-            file_name = os.path.basename(image_path)
-            
+    def _lookup_ocr_cache(self, image_data: Union[bytes, bytearray, memoryview, BinaryIO]) -> Tuple[bytes, str, Optional[Dict[str, Any]]]:
+        """Chuẩn hóa ảnh thành bytes gửi đi, tính khóa cache và tra cache"""
+        image_bytes = self._as_image_payload(image_data)
+        # Ảnh trùng nội dung (logo, chữ ký, nền slide...) dùng lại kết quả đã cache
+        cache_key = self.ocr_cache.make_key(image_bytes, OCR_MODEL, OCR_LANG, self.preprocessor.signature)
+        cached = self.ocr_cache.get(cache_key)
+        # requests chỉ nhận bytes cho phần multipart; bytes gốc được truyền thẳng, không copy
+        payload = image_bytes if isinstance(image_bytes, bytes) else image_bytes.tobytes()
+        return payload, cache_key, ({**cached, 'from_cache': True} if cached is not None else None)
+
+    def _preprocess_for_ocr(self, payload: bytes, file_name: str) -> Tuple[bytes, str, str, Dict[str, Any]]:
+        """Tiền xử lý ảnh ngay trước khi gửi (chỉ chạy khi cache miss).
+
+        Trả về (bytes gửi đi, tên file, content type, thông tin tiền xử lý).
+        """
+        processed, content_type, info = self.preprocessor.process(payload)
+        if content_type == 'image/jpeg':
+            file_name = f"{os.path.splitext(file_name)[0]}.jpg"
+        return processed, file_name, content_type, info
+
+    @staticmethod
+    def _ocr_failure(error: str, retry_count: int = 0) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': error,
+            'text': '',
+            'word_boxes': None,
+            'total_words': 0,
+            'average_confidence': 0,
+            'retry_count': retry_count
+        }
+
+    def _ocr_single_request(self, payload: bytes, file_name: str, cache_key: str, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+        """Gửi một ảnh tới OCR API (không qua cache) và lưu kết quả thành công vào cache"""
         try:
+            payload, file_name, content_type, preprocess_info = self._preprocess_for_ocr(payload, file_name)
+
             # Chuẩn bị file và form data cho API
-            with open(image_path, "rb") as image_file:
-                files = {
-                    'file': (file_name, image_file, 'image/png')
-                }
-                data = {
-                    'model': 'paddle',
-                    'lang': 'vie'
-                }
-                
-                # Gọi API với endpoint đã cấu hình
-                logger.info(f"Gọi OCR API: {self.paddle_ocr_url}")
-                logger.debug(f"Dữ liệu gửi đi: {data}")
-                
-                # Gọi API với retry và kiểm tra hủy
-                api_result = self._call_ocr_api_with_retry(files, data, upload_id=upload_id, document_service=document_service)
-                
-                # Xử lý kết quả
-                return self._process_ocr_result(api_result)
+            files = {
+                'file': (file_name, payload, content_type)
+            }
+            data = {
+                'model': OCR_MODEL,
+                'lang': OCR_LANG
+            }
+            
+            # Gọi API với endpoint đã cấu hình
+            logger.info(f"Gọi OCR API: {self.paddle_ocr_url}")
+            logger.debug(f"Dữ liệu gửi đi: {data}")
+            
+            # Gọi API với retry và kiểm tra hủy
+            api_result = self._call_ocr_api_with_retry(files, data, upload_id=upload_id, document_service=document_service)
+            
+            # Xử lý kết quả
+            result = self._process_ocr_result(api_result, preprocess_info)
+            if result.get('success', False):
+                self.ocr_cache.set(cache_key, result)
+            result['preprocess'] = preprocess_info
+            return result
                 
         except (RetryError, UploadCancelledError) as e: # MODIFIED: Catch UploadCancelledError
             if isinstance(e, UploadCancelledError):
@@ -194,27 +376,118 @@ class OCRService:
                 raise # Re-raise to be caught by the calling function
 
             print(f"❌ Đã thử lại {RETRY_MAX_ATTEMPTS} lần nhưng vẫn lỗi: {str(e)}")
-            return {
-                'success': False,
-                'error': f'OCR processing failed after {RETRY_MAX_ATTEMPTS} attempts: {str(e)}',
-                'text': '',
-                'words': [],
-                'total_words': 0,
-                'average_confidence': 0,
-                'retry_count': RETRY_MAX_ATTEMPTS
-            }
+            return self._ocr_failure(f'OCR processing failed after {RETRY_MAX_ATTEMPTS} attempts: {str(e)}', retry_count=RETRY_MAX_ATTEMPTS)
+
+        except OCRCircuitOpenError as e:
+            logger.warning(str(e))
+            return self._ocr_failure(f'OCR service unavailable: {str(e)}', retry_count=0)
                 
         except Exception as e:
-            print(f"❌ Lỗi không xác định khi gọi OCR API: {str(e)}")
+            # Ảnh đến từ file-like / blob của python-docx, openpyxl...: lỗi đọc chỉ làm hỏng ảnh này
+            logger.exception(f"Lỗi khi đọc dữ liệu ảnh hoặc tra OCR cache cho {file_name}")
+            return self._ocr_failure(f'Không đọc được dữ liệu ảnh / OCR cache: {str(e)}', retry_count=0)
+
+    def _ocr_images_batch(self, images: List[Tuple[Union[bytes, bytearray, memoryview, BinaryIO], str]], upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> List[Dict[str, Any]]:
+        """OCR nhiều ảnh, trả về kết quả theo đúng thứ tự đầu vào.
+
+        Ảnh đã có trong cache được bỏ qua; các ảnh còn lại được gom thành request batch
+        (tối đa OCR_BATCH_SIZE ảnh) nếu server hỗ trợ, ngược lại gọi từng ảnh.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        pending = []  # (index, payload, file_name, cache_key)
+        for idx, (image_data, file_name) in enumerate(images):
+            try:
+                payload, cache_key, cached = self._lookup_ocr_cache(image_data)
+            except Exception as e:
+                # Giống _ocr_image_from_bytes: lỗi đọc chỉ làm hỏng ảnh này
+                logger.exception(f"Lỗi khi đọc dữ liệu ảnh hoặc tra OCR cache cho {file_name}")
+                results[idx] = self._ocr_failure(f'Không đọc được dữ liệu ảnh / OCR cache: {str(e)}', retry_count=0)
+                continue
+            if cached is not None:
+                upload_progress.emit(upload_id, 'ocr_cache_hit', image=file_name)
+                results[idx] = cached
+            else:
+                pending.append((idx, payload, file_name, cache_key))
+
+        for start in range(0, len(pending), OCR_BATCH_SIZE):
+            chunk = pending[start:start + OCR_BATCH_SIZE]
+            chunk_results = None
+            if self._batch_supported and len(chunk) > 1:
+                chunk_results = self._send_ocr_batch(chunk, upload_id=upload_id, document_service=document_service)
+            if chunk_results is None:
+                # Fallback: gọi từng ảnh
+                chunk_results = [
+                    self._ocr_single_request(payload, file_name, cache_key, upload_id=upload_id, document_service=document_service)
+                    for _, payload, file_name, cache_key in chunk
+                ]
+            for (idx, _, _, _), result in zip(chunk, chunk_results):
+                results[idx] = result
+
+        return results
+
+    def _send_ocr_batch(self, chunk: List[Tuple[int, bytes, str, str]], upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Optional[List[Dict[str, Any]]]:
+        """Gửi một nhóm ảnh tới OCR batch API. Trả về None nếu cần chuyển sang gọi từng ảnh."""
+        prepared = [self._preprocess_for_ocr(payload, file_name) for _, payload, file_name, _ in chunk]
+        files = [('files', (file_name, payload, content_type)) for payload, file_name, content_type, _ in prepared]
+        data = {
+            'model': OCR_MODEL,
+            'lang': OCR_LANG
+        }
+        try:
+            logger.info(f"Gọi OCR batch API: {self.paddle_ocr_batch_url} ({len(chunk)} ảnh)")
+            api_result = self._call_ocr_api_with_retry(files, data, upload_id=upload_id, document_service=document_service, batch=True)
+        except UploadCancelledError as e:
+            logger.info(str(e))
+            raise
+        except OCRBatchNotSupportedError as e:
+            logger.warning(f"{e}. Chuyển sang gọi OCR từng ảnh.")
+            self._batch_supported = False
+            return None
+        except OCRCircuitOpenError as e:
+            logger.warning(str(e))
+            error = self._ocr_failure(f'OCR service unavailable: {str(e)}', retry_count=0)
+            return [dict(error) for _ in chunk]
+        except Exception as e:
+            print(f"❌ Lỗi khi gọi OCR batch API: {str(e)}")
+            error = self._ocr_failure(f'OCR batch processing failed after {RETRY_MAX_ATTEMPTS} attempts: {str(e)}', retry_count=RETRY_MAX_ATTEMPTS)
+            return [dict(error) for _ in chunk]
+
+        # Tách response theo từng ảnh: {"results": [<kết quả ocr-fullV2 của ảnh 1>, ...]}
+        batch_items = api_result.get('results') if isinstance(api_result, dict) else None
+        if not isinstance(batch_items, list) or len(batch_items) != len(chunk):
+            logger.warning("Response của OCR batch API không khớp số ảnh gửi đi. Chuyển sang gọi OCR từng ảnh.")
+            return None
+
+        results = []
+        for (_, _, _, cache_key), (_, _, _, preprocess_info), item in zip(chunk, prepared, batch_items):
+            result = self._process_ocr_result(item if isinstance(item, dict) else {'result': item}, preprocess_info)
+            if result.get('success', False):
+                self.ocr_cache.set(cache_key, result)
+            result['preprocess'] = preprocess_info
+            results.append(result)
+        return results
+
+    def _call_paddle_ocr_api(self, image_path: str, file_name: str = None, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+        """Gọi Paddle OCR API cho một file ảnh trên đĩa (wrapper của _ocr_image_from_bytes)"""
+        if not file_name:
+            file_name = os.path.basename(image_path)
+
+        try:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+        except OSError as e:
+            print(f"❌ Không thể đọc file ảnh {image_path}: {str(e)}")
             return {
                 'success': False,
                 'error': f'Unexpected error during OCR processing: {str(e)}',
                 'text': '',
-                'words': [],
+                'word_boxes': None,
                 'total_words': 0,
                 'average_confidence': 0,
-                'retry_count': 0 # MODIFIED: retry_count was not defined here
+                'retry_count': 0
             }
+
+        return self._ocr_image_from_bytes(image_bytes, file_name, upload_id=upload_id, document_service=document_service)
         
     def extract_text_from_image(self, image_path: str, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
         """Trích xuất text từ hình ảnh sử dụng Paddle OCR API"""
@@ -252,124 +525,252 @@ class OCRService:
                 'success': False,
                 'error': str(e),
                 'text': '',
-                'words': [],
+                'word_boxes': None,
                 'total_words': 0,
                 'average_confidence': 0
             }
     
-    def _process_pdf_page(self, page, page_num: int, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
-        """Xử lý một trang PDF riêng lẻ"""
+    @staticmethod
+    def _report_progress(progress_callback: Optional[ProgressCallback], done: int, total: int,
+                         upload_id: Optional[str] = None, unit: str = 'page') -> None:
+        """Gọi callback tiến độ và phát sự kiện 'progress'; lỗi trong callback không làm hỏng quá trình trích xuất"""
+        upload_progress.emit(upload_id, 'progress', unit=unit, done=done, total=total)
+        if not progress_callback:
+            return
         try:
-            # --- MODIFICATION: CHECK FOR CANCELLATION ---
-            if upload_id and document_service and not document_service.get_upload_info(upload_id):
-                raise UploadCancelledError(f"Upload {upload_id} was cancelled during PDF processing.")
-            # --- END MODIFICATION ---
-
-            page_text = page.get_text()
-            images = page.get_images()
-            has_images = len(images) > 0
-            has_text = bool(page_text.strip())
-            
-            # Nếu không có hình ảnh hoặc không yêu cầu OCR, trả về text gốc
-            if not has_images or not is_image:
-                return {
-                    'page_number': page_num + 1,
-                    'text': page_text if has_text else '',
-                    'has_images': has_images,
-                    'has_text': has_text,
-                    'success': True
-                }
-            
-            # Nếu có hình ảnh và yêu cầu OCR
-            try:
-                # Tạo hình ảnh từ trang PDF
-                pix = page.get_pixmap()
-                with self._temp_image_file(pix.tobytes("png")) as temp_img_path:
-                    # Thực hiện OCR với Paddle OCR API
-                    ocr_result = self._call_paddle_ocr_api(temp_img_path, f"page_{page_num + 1}.png", upload_id=upload_id, document_service=document_service)
-                    ocr_text = ocr_result.get('text', '') if ocr_result.get('success', False) else ''
-                    
-                    # Kết hợp text gốc và text từ OCR nếu cần
-                    if has_text:
-                        combined_text = f"{page_text}\n{ocr_text}"
-                    else:
-                        combined_text = ocr_text
-                    
-                    return {
-                        'page_number': page_num + 1,
-                        'text': combined_text,
-                        'has_images': has_images,
-                        'has_text': has_text or bool(ocr_text.strip()),
-                        'ocr_raw_response': ocr_result,
-                        'ocr_extracted_text': ocr_text,
-                        'success': True
-                    }
-                    
-            except Exception as ocr_error:
-                logger.error(f"Lỗi OCR trang {page_num + 1}: {str(ocr_error)}")
-                # Nếu có lỗi OCR nhưng có text gốc, vẫn trả về text gốc
-                if has_text:
-                    return {
-                        'page_number': page_num + 1,
-                        'text': page_text,
-                        'has_images': has_images,
-                        'has_text': True,
-                        'ocr_error': str(ocr_error),
-                        'success': True
-                    }
-                raise  # Ném lỗi nếu không có text gốc
-                
+            progress_callback(done, total)
         except Exception as e:
-            logger.error(f"Lỗi khi xử lý trang {page_num + 1}: {str(e)}")
+            logger.warning(f"Lỗi trong progress callback: {e}")
+
+    def _pdf_page_error(self, page_num: int, error: str) -> Dict[str, Any]:
+        """Kết quả mặc định khi một trang PDF xử lý thất bại"""
+        return {
+            'page_number': page_num + 1,
+            'text': '',
+            'has_images': False,
+            'has_text': False,
+            'error': error,
+            'success': False
+        }
+
+    def _prepare_pdf_page(self, page, page_num: int, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+        """Giai đoạn 1: đọc text layer và render ảnh trang nếu cần OCR.
+
+        Trả về kết quả cuối cùng nếu trang không cần OCR, ngược lại trả về
+        dict có khóa 'ocr_image' chứa bytes PNG của trang.
+        """
+        # --- MODIFICATION: CHECK FOR CANCELLATION ---
+        if upload_id and document_service and not document_service.get_upload_info(upload_id):
+            raise UploadCancelledError(f"Upload {upload_id} was cancelled during PDF processing.")
+        # --- END MODIFICATION ---
+
+        page_text = page.get_text()
+        images = page.get_images()
+        has_images = len(images) > 0
+        has_text = bool(page_text.strip())
+
+        # Nếu không có hình ảnh hoặc không yêu cầu OCR, trả về text gốc
+        if not has_images or not is_image:
             return {
                 'page_number': page_num + 1,
-                'text': '',
-                'has_images': False,
-                'has_text': False,
-                'error': str(e),
-                'success': False
+                'text': page_text if has_text else '',
+                'has_images': has_images,
+                'has_text': has_text,
+                'success': True
             }
 
-    def extract_text_from_pdf(self, pdf_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
-        """Trích xuất text từ PDF với xử lý thông minh cho từng trang"""
-        doc = None
+        plan = self._plan_pdf_page_ocr(page, has_text)
+        if plan['decision'] == 'skip':
+            # Text layer đã đủ (PDF tạo từ phần mềm, chỉ có logo/ảnh nhỏ): không cần gọi OCR
+            return {
+                'page_number': page_num + 1,
+                'text': page_text if has_text else '',
+                'has_images': has_images,
+                'has_text': has_text,
+                'ocr_decision': plan,
+                'success': True
+            }
+
+        # Tạo hình ảnh từ trang PDF (PyMuPDF không thread-safe nên render ở luồng gọi)
+        # Chỉ render vùng ảnh thiếu text nếu trang đã có text layer ở phần còn lại
+        clip = plan.pop('clip') if plan['decision'] == 'region' else None
+        pix = page.get_pixmap(clip=clip) if clip is not None else page.get_pixmap()
+        ocr_image = pix.tobytes("png")
+        upload_progress.emit(upload_id, 'page_rendered', page=page_num + 1, decision=plan['decision'], bytes=len(ocr_image))
+        return {
+            'page_number': page_num + 1,
+            'page_text': page_text,
+            'has_images': has_images,
+            'has_text': has_text,
+            'ocr_decision': plan,
+            # Gốc tọa độ của ảnh OCR trên trang (ảnh render 72 dpi: 1 px = 1 pt)
+            'ocr_origin': (clip.x0, clip.y0) if clip is not None else (0, 0),
+            'ocr_image': ocr_image
+        }
+
+    @staticmethod
+    def _plan_pdf_page_ocr(page, has_text: bool) -> Dict[str, Any]:
+        """Quyết định OCR cho một trang có ảnh dựa trên độ phủ của text layer.
+
+        Trả về dict với 'decision':
+            'skip'   - không có ảnh nào đủ lớn mà thiếu text (logo, ảnh minh họa có chú thích...)
+            'region' - trang có text, chỉ OCR vùng bao các ảnh thiếu text ('clip')
+            'full'   - trang không có text layer hoặc vùng thiếu text chiếm gần hết trang
+        kèm text_coverage (tỷ lệ trang được text phủ) và image_ratio (tỷ lệ trang là ảnh).
+        """
+        import fitz  # PyMuPDF
+
+        page_rect = page.rect
+        page_area = abs(page_rect) or 1.0
+        text_rects = [fitz.Rect(block[:4]) & page_rect for block in page.get_text("blocks")
+                      if block[6] == 0 and block[4].strip()]
+        image_rects = [fitz.Rect(info['bbox']) & page_rect for info in page.get_image_info()]
+        image_rects = [rect for rect in image_rects if not rect.is_empty]
+
+        text_coverage = min(1.0, sum(abs(rect) for rect in text_rects) / page_area)
+        image_ratio = min(1.0, sum(abs(rect) for rect in image_rects) / page_area)
+
+        # Ảnh cần OCR: đủ lớn và phần lớn diện tích chưa có text layer phủ lên
+        needs_ocr = []
+        for rect in image_rects:
+            rect_area = abs(rect)
+            if rect_area / page_area < OCR_MIN_IMAGE_AREA_RATIO:
+                continue
+            covered = sum(abs(rect & text_rect) for text_rect in text_rects) / rect_area
+            if covered < OCR_IMAGE_TEXT_COVERAGE:
+                needs_ocr.append(rect)
+
+        plan = {
+            'text_coverage': round(text_coverage, 4),
+            'image_ratio': round(image_ratio, 4),
+            'images_needing_ocr': len(needs_ocr)
+        }
+        if not needs_ocr:
+            plan['decision'] = 'skip'
+            return plan
+
+        clip = fitz.Rect(needs_ocr[0])
+        for rect in needs_ocr[1:]:
+            clip |= rect
+        if not has_text or abs(clip) / page_area >= OCR_FULL_PAGE_REGION_RATIO:
+            plan['decision'] = 'full'
+        else:
+            plan['decision'] = 'region'
+            plan['clip'] = clip
+        return plan
+
+    def _merge_pdf_page_ocr(self, prepared: Dict[str, Any], ocr_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Ghép kết quả OCR của một trang với text layer gốc; OCR thất bại thì xử lý như _pdf_page_ocr_failed"""
+        if not ocr_result.get('success', False):
+            return self._pdf_page_ocr_failed(prepared, ocr_result.get('error') or 'OCR thất bại')
+        page_text = prepared['page_text']
+        has_text = prepared['has_text']
+        ocr_text = ocr_result.get('text', '')
+
+        # Kết hợp text gốc và text từ OCR nếu cần
+        if has_text:
+            combined_text = f"{page_text}\n{ocr_text}"
+        else:
+            combined_text = ocr_text
+
+        # Word boxes theo tọa độ trang; ocr_text_offset là vị trí text OCR trong text của trang
+        from app.services.ocr_words_service import decode_word_boxes
+        word_boxes = decode_word_boxes(ocr_result.get('word_boxes')) if ocr_text else None
+        if word_boxes is not None:
+            word_boxes = word_boxes.offset(*prepared.get('ocr_origin', (0, 0)))
+
+        return {
+            'page_number': prepared['page_number'],
+            'text': combined_text,
+            'has_images': prepared['has_images'],
+            'has_text': has_text or bool(ocr_text.strip()),
+            'ocr_raw_response': ocr_result,
+            'ocr_extracted_text': ocr_text,
+            'ocr_decision': prepared.get('ocr_decision'),
+            'word_boxes': word_boxes.to_base64() if word_boxes is not None and len(word_boxes) else None,
+            'ocr_text_offset': len(page_text) + 1 if has_text else 0,
+            'success': True
+        }
+
+    @staticmethod
+    def _emit_page_ocr_done(upload_id: Optional[str], prepared: Dict[str, Any], ocr_result: Dict[str, Any]) -> None:
+        """Phát sự kiện 'page_ocr_done' sau khi có kết quả OCR (gọi API hoặc từ cache) của một trang"""
+        upload_progress.emit(upload_id, 'page_ocr_done', page=prepared['page_number'],
+                             success=bool(ocr_result.get('success', False)), from_cache=bool(ocr_result.get('from_cache', False)))
+
+    def _pdf_page_ocr_failed(self, prepared: Dict[str, Any], ocr_error: Union[Exception, str]) -> Dict[str, Any]:
+        """Kết quả của trang khi OCR lỗi: giữ text gốc nếu có, ghi lỗi vào 'ocr_error' (file_pages.error_message)"""
+        page_number = prepared['page_number']
+        logger.error(f"Lỗi OCR trang {page_number}: {str(ocr_error)}")
+        # Nếu có lỗi OCR nhưng có text gốc, vẫn trả về text gốc
+        if prepared['has_text']:
+            return {
+                'page_number': page_number,
+                'text': prepared['page_text'],
+                'has_images': prepared['has_images'],
+                'has_text': True,
+                'ocr_error': str(ocr_error),
+                'ocr_decision': prepared.get('ocr_decision'),
+                'success': True
+            }
+        return self._pdf_page_error(page_number - 1, str(ocr_error))
+
+    def _ocr_pdf_page(self, prepared: Dict[str, Any], upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+        """Giai đoạn 2: gửi ảnh trang đã render tới OCR API và ghép với text gốc"""
         try:
-            doc = fitz.open(pdf_path)
-            full_text = []
-            pages_info = []
-            total_pages = len(doc)
+            # Thực hiện OCR với Paddle OCR API
+            ocr_result = self._ocr_image_from_bytes(prepared['ocr_image'], f"page_{prepared['page_number']}.png", upload_id=upload_id, document_service=document_service)
+            self._emit_page_ocr_done(upload_id, prepared, ocr_result)
+            return self._merge_pdf_page_ocr(prepared, ocr_result)
+        except UploadCancelledError:
+            raise
+        except Exception as ocr_error:
+            return self._pdf_page_ocr_failed(prepared, ocr_error)
 
-            logger.info(f"Bắt đầu trích xuất text từ PDF '{os.path.basename(pdf_path)}' với {total_pages} trang...")
+    def _ocr_pdf_pages(self, prepared_pages: List[Dict[str, Any]], upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> List[Dict[str, Any]]:
+        """Giai đoạn 2 cho một nhóm trang: OCR bằng một request batch nếu có thể"""
+        if len(prepared_pages) == 1:
+            return [self._ocr_pdf_page(prepared_pages[0], upload_id=upload_id, document_service=document_service)]
+        try:
+            ocr_results = self._ocr_images_batch(
+                [(p['ocr_image'], f"page_{p['page_number']}.png") for p in prepared_pages],
+                upload_id=upload_id,
+                document_service=document_service
+            )
+            for p, r in zip(prepared_pages, ocr_results):
+                self._emit_page_ocr_done(upload_id, p, r)
+            return [self._merge_pdf_page_ocr(p, r) for p, r in zip(prepared_pages, ocr_results)]
+        except UploadCancelledError:
+            raise
+        except Exception as ocr_error:
+            return [self._pdf_page_ocr_failed(p, ocr_error) for p in prepared_pages]
 
-            # Xử lý từng trang
-            for page_num in range(total_pages):
-                try:
-                    page = doc[page_num]
-                    page_result = self._process_pdf_page(page, page_num, is_image, upload_id=upload_id, document_service=document_service)
-                    
-                    if page_result['success']:
-                        full_text.append(page_result['text'])
-                        pages_info.append(page_result)
-                        
-                        # Log tiến độ
-                        if (page_num + 1) % 10 == 0 or (page_num + 1) == total_pages:
-                            logger.info(f"Đã xử lý {page_num + 1}/{total_pages} trang")
-                    else:
-                        logger.warning(f"Không thể xử lý trang {page_num + 1}: {page_result.get('error', 'Lỗi không xác định')}")
-                        pages_info.append(page_result)
-                        
-                except Exception as e:
-                    logger.error(f"Lỗi không xử lý được trang {page_num + 1}: {str(e)}")
-                    pages_info.append({
-                        'page_number': page_num + 1,
-                        'text': '',
-                        'has_images': False,
-                        'has_text': False,
-                        'error': str(e),
-                        'success': False
-                    })
+    def _process_pdf_page(self, page, page_num: int, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+        """Xử lý một trang PDF riêng lẻ (tuần tự: render rồi OCR)"""
+        try:
+            prepared = self._prepare_pdf_page(page, page_num, is_image, upload_id=upload_id, document_service=document_service)
+            if 'ocr_image' not in prepared:
+                return prepared
+            return self._ocr_pdf_page(prepared, upload_id=upload_id, document_service=document_service)
+        except UploadCancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Lỗi khi xử lý trang {page_num + 1}: {str(e)}")
+            return self._pdf_page_error(page_num, str(e))
 
-            # Tạo kết quả cuối cùng
+    def extract_text_from_pdf(self, pdf_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None, max_concurrency: Optional[int] = None, progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Trích xuất text từ PDF với xử lý thông minh cho từng trang.
+
+        Gom toàn bộ kết quả của iter_pdf_pages vào bộ nhớ; với file lớn nên dùng
+        iter_pdf_pages để ghi từng trang ra DB.
+        """
+        try:
+            pages_info = list(self.iter_pdf_pages(pdf_path, is_image, upload_id=upload_id, document_service=document_service,
+                                                  max_concurrency=max_concurrency, progress_callback=progress_callback))
+            total_pages = len(pages_info)
+
+            # Tạo kết quả cuối cùng theo đúng thứ tự trang
+            full_text = [p['text'] for p in pages_info if p and p.get('success', False)]
             final_text = '\n\n'.join(filter(None, full_text))
             result = {
                 'success': True,
@@ -377,12 +778,17 @@ class OCRService:
                 'pages': pages_info,
                 'total_pages': total_pages,
                 'total_words': len(final_text.split()) if final_text else 0,
-                'processed_pages': len([p for p in pages_info if p.get('success', False)])
+                'processed_pages': len([p for p in pages_info if p and p.get('success', False)]),
+                'ocr_summary': self.summarize_pdf_ocr_decisions(pages_info)
             }
             
             logger.info(f"Hoàn thành xử lý PDF. Đã xử lý thành công {result['processed_pages']}/{total_pages} trang")
+            if is_image:
+                logger.info(f"Quyết định OCR: {result['ocr_summary']}")
             return result
             
+        except UploadCancelledError:
+            raise
         except Exception as e:
             error_msg = f"Lỗi khi xử lý file PDF: {str(e)}"
             logger.error(error_msg, exc_info=True)
@@ -395,14 +801,169 @@ class OCRService:
                 'total_words': 0,
                 'processed_pages': 0
             }
-            
+
+    @staticmethod
+    def summarize_pdf_ocr_decisions(pages: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Đếm số trang OCR cả trang / theo vùng / bỏ qua và số lần gọi OCR tránh được"""
+        summary = {'ocr_full_pages': 0, 'ocr_region_pages': 0, 'ocr_skipped_pages': 0, 'ocr_calls_avoided': 0}
+        for page in pages:
+            decision = (page or {}).get('ocr_decision')
+            if not decision:
+                continue
+            if decision['decision'] == 'skip':
+                summary['ocr_skipped_pages'] += 1
+                summary['ocr_calls_avoided'] += 1
+            else:
+                summary[f"ocr_{decision['decision']}_pages"] += 1
+        return summary
+
+    def iter_pdf_pages(self, pdf_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None, max_concurrency: Optional[int] = None, progress_callback: Optional[ProgressCallback] = None) -> Iterator[Dict[str, Any]]:
+        """Trả về kết quả từng trang PDF theo thứ tự trang ngay khi trang đó xong.
+
+        Trang được render tuần tự ở luồng gọi, các trang cần OCR được gửi song song
+        (tối đa max_concurrency, mặc định OCR_PDF_CONCURRENCY). Khi OCR server hỗ trợ batch,
+        mỗi lần gửi gồm tối đa OCR_BATCH_SIZE trang. Chỉ các trang đang OCR hoặc chờ trang
+        trước đó được giữ trong bộ nhớ.
+        """
+        import fitz  # PyMuPDF
+
+        doc = None
+        executor = None
+        try:
+            doc = fitz.open(pdf_path)
+            total_pages = len(doc)
+            concurrency = max(1, max_concurrency or OCR_PDF_CONCURRENCY)
+            batch_size = OCR_BATCH_SIZE if self._batch_supported else 1
+            max_buffered = concurrency * batch_size * 2  # Số trang xong sớm được giữ chờ trang trước
+            in_flight = {}  # Future -> danh sách page_num
+            pending_pages = []  # Các trang đã render, chờ đủ một batch
+            ready: Dict[int, Dict[str, Any]] = {}  # Trang đã xong, chờ trả về theo thứ tự
+            next_page = 0
+            completed = 0
+
+            logger.info(f"Bắt đầu trích xuất text từ PDF '{os.path.basename(pdf_path)}' với {total_pages} trang (OCR song song: {concurrency})...")
+
+            def store(page_num: int, page_result: Dict[str, Any]) -> None:
+                nonlocal completed
+                ready[page_num] = page_result
+                completed += 1
+                if not page_result.get('success', False):
+                    logger.warning(f"Không thể xử lý trang {page_num + 1}: {page_result.get('error', 'Lỗi không xác định')}")
+                self._report_progress(progress_callback, completed, total_pages, upload_id)
+                # Log tiến độ
+                if completed % 10 == 0 or completed == total_pages:
+                    logger.info(f"Đã xử lý {completed}/{total_pages} trang")
+
+            def collect(return_when) -> None:
+                done, _ = wait(list(in_flight), return_when=return_when)
+                for future in done:
+                    page_nums = in_flight.pop(future)
+                    try:
+                        for page_num, page_result in zip(page_nums, future.result()):
+                            store(page_num, page_result)
+                    except UploadCancelledError:
+                        raise
+                    except Exception as e:
+                        for page_num in page_nums:
+                            logger.error(f"Lỗi không xử lý được trang {page_num + 1}: {str(e)}")
+                            store(page_num, self._pdf_page_error(page_num, str(e)))
+
+            def submit_pending() -> None:
+                nonlocal executor
+                if executor is None:
+                    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pdf-ocr")
+
+                # Giới hạn số nhóm trang đang chờ OCR để không giữ quá nhiều ảnh trong bộ nhớ
+                while len(in_flight) >= concurrency:
+                    collect(FIRST_COMPLETED)
+
+                future = executor.submit(self._ocr_pdf_pages, list(pending_pages), upload_id, document_service)
+                in_flight[future] = [p['page_number'] - 1 for p in pending_pages]
+                pending_pages.clear()
+
+            # Giai đoạn 1 (luồng hiện tại): render từng trang; giai đoạn 2 (executor): OCR
+            for page_num in range(total_pages):
+                try:
+                    prepared = self._prepare_pdf_page(doc[page_num], page_num, is_image, upload_id=upload_id, document_service=document_service)
+                except UploadCancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Lỗi không xử lý được trang {page_num + 1}: {str(e)}")
+                    prepared = self._pdf_page_error(page_num, str(e))
+
+                if 'ocr_image' not in prepared:
+                    store(page_num, prepared)
+                else:
+                    pending_pages.append(prepared)
+                    if len(pending_pages) >= batch_size:
+                        submit_pending()
+
+                # Trả về các trang liên tiếp đã xong; chờ OCR nếu có quá nhiều trang xếp hàng
+                if pending_pages and len(ready) >= max_buffered:
+                    submit_pending()
+                while in_flight and len(ready) >= max_buffered:
+                    collect(FIRST_COMPLETED)
+                while next_page in ready:
+                    yield ready.pop(next_page)
+                    next_page += 1
+
+            if pending_pages:
+                submit_pending()
+
+            while in_flight:
+                collect(FIRST_COMPLETED)
+                while next_page in ready:
+                    yield ready.pop(next_page)
+                    next_page += 1
+
+            while next_page in ready:
+                yield ready.pop(next_page)
+                next_page += 1
+
         finally:
+            if executor:
+                executor.shutdown(wait=True, cancel_futures=True)
             if doc:
                 doc.close()
 
+    def iter_file_pages(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None, progress_callback: Optional[ProgressCallback] = None) -> Iterator[Dict[str, Any]]:
+        """Chế độ streaming: trả về kết quả theo từng trang để ghi dần ra DB.
+
+        PDF được xử lý từng trang qua iter_pdf_pages; các định dạng khác được xử lý
+        bằng process_file và trả về như một trang duy nhất.
+        """
+        path = Path(file_path)
+        if path.suffix.lower() not in self.supported_pdf_extensions:
+            result = self.process_file(file_path, is_image, upload_id=upload_id, document_service=document_service, progress_callback=progress_callback)
+            yield {
+                'page_number': 1,
+                'text': result.get('text', '') if result.get('success', False) else '',
+                'has_images': bool(result.get('has_images', False)),
+                'success': result.get('success', False),
+                'error': result.get('error'),
+                'ocr_error': result.get('ocr_error'),
+                # Chỉ file ảnh có word boxes khớp với toàn bộ text
+                'word_boxes': result.get('word_boxes') if path.suffix.lower() in self.supported_image_extensions and result.get('success', False) else None,
+                'ocr_text_offset': 0
+            }
+            return
+
+        if upload_id and document_service and not document_service.get_upload_info(upload_id):
+            raise UploadCancelledError(f"Upload {upload_id} was cancelled before processing.")
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="File không tồn tại")
+
+        try:
+            yield from self.iter_pdf_pages(str(path), is_image, upload_id=upload_id, document_service=document_service, progress_callback=progress_callback)
+        except (HTTPException, UploadCancelledError):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Lỗi xử lý file: {str(e)}")
     
     def extract_text_from_docx(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
         """Trích xuất text từ file Word với xử lý thông minh text + OCR"""
+        from docx import Document  # python-docx để đọc file Word
+
         try:
             doc = Document(file_path)
             full_text = []
@@ -433,30 +994,32 @@ class OCRService:
             # Xử lý images với OCR
             image_texts = []
             has_images = False
+            ocr_error = None  # Lỗi OCR ảnh đầu tiên: text của file không đầy đủ
             try:
+                docx_images = []
                 for rel in doc.part.rels.values():
                     if "image" in rel.target_ref:
                         has_images = True
-                        try:
-                            # --- MODIFICATION: CHECK FOR CANCELLATION ---
-                            if upload_id and document_service and not document_service.get_upload_info(upload_id):
-                                raise UploadCancelledError(f"Upload {upload_id} was cancelled during DOCX processing.")
-                            # --- END MODIFICATION ---
-
-                            # Sử dụng _ocr_image_from_bytes thay vì xử lý file tạm
-                            ocr_result = self._ocr_image_from_bytes(
-                                rel.target_part.blob,
-                                f"docx_image_{len(image_texts)}.png",
-                                upload_id=upload_id, 
-                                document_service=document_service
-                            )
-                            if ocr_result.get('success', False) and ocr_result.get('text'):
-                                image_texts.append(ocr_result['text'])
-                        except Exception as img_e:
-                            logger.warning(f"Lỗi khi xử lý ảnh trong docx: {str(img_e)}")
-                            continue
+                        docx_images.append((rel.target_part.blob, f"docx_image_{len(docx_images)}.png"))
+
+                if docx_images:
+                    # --- MODIFICATION: CHECK FOR CANCELLATION ---
+                    if upload_id and document_service and not document_service.get_upload_info(upload_id):
+                        raise UploadCancelledError(f"Upload {upload_id} was cancelled during DOCX processing.")
+                    # --- END MODIFICATION ---
+
+                    # OCR tất cả ảnh của tài liệu, gom batch nếu server hỗ trợ
+                    for ocr_result in self._ocr_images_batch(docx_images, upload_id=upload_id, document_service=document_service):
+                        if ocr_result.get('success', False) and ocr_result.get('text'):
+                            image_texts.append(ocr_result['text'])
+                        elif not ocr_result.get('success', False):
+                            logger.warning(f"Lỗi khi xử lý ảnh trong docx: {ocr_result.get('error')}")
+                            ocr_error = ocr_error or ocr_result.get('error') or 'OCR thất bại'
+            except UploadCancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Lỗi khi truy cập các mối quan hệ trong docx: {str(e)}", exc_info=True)
+                ocr_error = ocr_error or f"Lỗi khi OCR ảnh trong docx: {str(e)}"
 
             # Kết hợp tất cả text
             all_texts = []
@@ -485,10 +1048,14 @@ class OCRService:
                     'image_ocr_performed': len(image_texts) > 0
                 }
             }
+            if ocr_error:
+                result['ocr_error'] = ocr_error
 
             logger.info(f"Hoàn thành xử lý file Word. Tổng số từ: {result['total_words']}")
             return result
 
+        except UploadCancelledError:
+            raise
         except Exception as e:
             error_msg = f"Lỗi khi xử lý file Word: {str(e)}"
             logger.error(error_msg, exc_info=True)
@@ -499,8 +1066,10 @@ class OCRService:
                 'total_words': 0
             }
     
-    def extract_text_from_pptx(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
+    def extract_text_from_pptx(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None, progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
         """Trích xuất text từ file PowerPoint với xử lý thông minh text + OCR"""
+        from pptx import Presentation  # python-pptx để đọc file PowerPoint
+
         try:
             logger.info(f"Bắt đầu xử lý file PowerPoint: {os.path.basename(file_path)}")
             prs = Presentation(file_path)
@@ -510,6 +1079,10 @@ class OCRService:
             
             logger.info(f"Tổng số slide cần xử lý: {total_slides}")
             
+            # Lượt 1: đọc text và gom ảnh của tất cả slide
+            slide_parts = []  # (slide_idx, slide_text_parts, has_images) hoặc thông tin lỗi
+            pptx_images = []  # (blob, file_name)
+            image_slides = []  # slide_idx tương ứng với từng ảnh trong pptx_images
             for slide_idx, slide in enumerate(prs.slides):
                 try:
                     # --- MODIFICATION: CHECK FOR CANCELLATION ---
@@ -518,8 +1091,8 @@ class OCRService:
                     # --- END MODIFICATION ---
 
                     slide_text_parts = []
-                    slide_image_texts = []
                     has_images = False
+                    slide_image_count = 0
                     
                     # Xử lý text shapes
                     for shape in slide.shapes:
@@ -527,62 +1100,41 @@ class OCRService:
                             if hasattr(shape, "text") and shape.text.strip():
                                 slide_text_parts.append(shape.text.strip())
                             
-                            # Kiểm tra và xử lý images nếu được yêu cầu
+                            # Kiểm tra và gom images nếu được yêu cầu
                             if is_image and hasattr(shape, 'image') and hasattr(shape, 'shape_type') and shape.shape_type == 13:  # Picture type
                                 has_images = True
-                                try:
-                                    # Sử dụng _ocr_image_from_bytes để xử lý ảnh
-                                    ocr_result = self._ocr_image_from_bytes(
-                                        shape.image.blob,
-                                        f"pptx_slide_{slide_idx + 1}_img_{len(slide_image_texts)}.png",
-                                        upload_id=upload_id, 
-                                        document_service=document_service
-                                    )
-                                    if ocr_result.get('success', False) and ocr_result.get('text'):
-                                        slide_image_texts.append(ocr_result['text'])
-                                        logger.debug(f"Đã xử lý ảnh {len(slide_image_texts)} trong slide {slide_idx + 1}")
-                                        
-                                except Exception as img_e:
-                                    logger.warning(f"Lỗi khi xử lý ảnh trong slide {slide_idx + 1}: {str(img_e)}")
-                                    continue
+                                pptx_images.append((shape.image.blob, f"pptx_slide_{slide_idx + 1}_img_{slide_image_count}.png"))
+                                image_slides.append(slide_idx)
+                                slide_image_count += 1
                                     
                         except Exception as shape_e:
                             logger.warning(f"Lỗi khi xử lý shape trong slide {slide_idx + 1}: {str(shape_e)}")
                             continue
-                    
-                    # Kết hợp text và OCR cho slide này
-                    slide_all_text = []
-                    if slide_text_parts:
-                        slide_all_text.extend(slide_text_parts)
-                    if slide_image_texts:
-                        slide_all_text.append("=== NỘI DUNG TỪ HÌNH ẢNH ===")
-                        slide_all_text.extend(slide_image_texts)
-                    
-                    slide_final_text = '\n'.join(slide_all_text)
-                    
-                    # Log tiến độ
-                    if (slide_idx + 1) % 5 == 0 or (slide_idx + 1) == total_slides:
-                        logger.info(f"Đã xử lý {slide_idx + 1}/{total_slides} slide")
-                    
-                    # Lưu thông tin slide
-                    slide_info = {
-                        'slide_number': slide_idx + 1,
-                        'text': slide_final_text,
-                        'has_text': len(slide_text_parts) > 0,
-                        'has_images': has_images,
-                        'text_shapes_count': len(slide_text_parts),
-                        'images_ocr_count': len(slide_image_texts),
-                        'success': True
-                    }
-                    
-                    slides_info.append(slide_info)
-                    
-                    if slide_final_text:
-                        all_slide_texts.append(slide_final_text)
-                        
+
+                    slide_parts.append((slide_idx, slide_text_parts, has_images))
+
+                except UploadCancelledError:
+                    raise
                 except Exception as slide_e:
-                    error_msg = f"Lỗi khi xử lý slide {slide_idx + 1}: {str(slide_e)}"
-                    logger.error(error_msg, exc_info=True)
+                    slide_parts.append((slide_idx, slide_e, False))
+
+            # Lượt 2: OCR toàn bộ ảnh của file (gom batch nếu server hỗ trợ)
+            slide_image_texts = {}
+            ocr_error = None  # Lỗi OCR ảnh đầu tiên: text của file không đầy đủ
+            if pptx_images:
+                ocr_results = self._ocr_images_batch(pptx_images, upload_id=upload_id, document_service=document_service)
+                for slide_idx, ocr_result in zip(image_slides, ocr_results):
+                    if ocr_result.get('success', False) and ocr_result.get('text'):
+                        slide_image_texts.setdefault(slide_idx, []).append(ocr_result['text'])
+                    elif not ocr_result.get('success', False):
+                        logger.warning(f"Lỗi khi xử lý ảnh trong slide {slide_idx + 1}: {ocr_result.get('error')}")
+                        ocr_error = ocr_error or ocr_result.get('error') or 'OCR thất bại'
+
+            # Lượt 3: ghép text và OCR cho từng slide
+            for slide_idx, slide_text_parts, has_images in slide_parts:
+                if isinstance(slide_text_parts, Exception):
+                    error_msg = f"Lỗi khi xử lý slide {slide_idx + 1}: {str(slide_text_parts)}"
+                    logger.error(error_msg)
                     slides_info.append({
                         'slide_number': slide_idx + 1,
                         'error': error_msg,
@@ -590,6 +1142,36 @@ class OCRService:
                         'has_images': False,
                         'success': False
                     })
+                    continue
+
+                image_texts = slide_image_texts.get(slide_idx, [])
+                slide_all_text = []
+                if slide_text_parts:
+                    slide_all_text.extend(slide_text_parts)
+                if image_texts:
+                    slide_all_text.append("=== NỘI DUNG TỪ HÌNH ẢNH ===")
+                    slide_all_text.extend(image_texts)
+                
+                slide_final_text = '\n'.join(slide_all_text)
+                
+                self._report_progress(progress_callback, slide_idx + 1, total_slides, upload_id, unit='slide')
+                # Log tiến độ
+                if (slide_idx + 1) % 5 == 0 or (slide_idx + 1) == total_slides:
+                    logger.info(f"Đã xử lý {slide_idx + 1}/{total_slides} slide")
+                
+                # Lưu thông tin slide
+                slides_info.append({
+                    'slide_number': slide_idx + 1,
+                    'text': slide_final_text,
+                    'has_text': len(slide_text_parts) > 0,
+                    'has_images': has_images,
+                    'text_shapes_count': len(slide_text_parts),
+                    'images_ocr_count': len(image_texts),
+                    'success': True
+                })
+                
+                if slide_final_text:
+                    all_slide_texts.append(slide_final_text)
             
             # Tạo kết quả cuối cùng
             final_text = '\n\n'.join(all_slide_texts)
@@ -607,6 +1189,8 @@ class OCRService:
                     'total_images_processed': sum(s.get('images_ocr_count', 0) for s in slides_info)
                 }
             }
+            if ocr_error:
+                result['ocr_error'] = ocr_error
             
             logger.info(
                 f"Hoàn thành xử lý PowerPoint. "
@@ -617,6 +1201,8 @@ class OCRService:
             
             return result
             
+        except UploadCancelledError:
+            raise
         except Exception as e:
             error_msg = f"Lỗi khi xử lý file PowerPoint: {str(e)}"
             logger.error(error_msg, exc_info=True)
@@ -668,123 +1254,120 @@ class OCRService:
                 'total_words': 0
             }
     
-    def extract_text_from_excel(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
-        """Trích xuất text từ file Excel với xử lý thông minh text + OCR"""
+    def extract_text_from_excel(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None, progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Trích xuất text từ file Excel với xử lý thông minh text + OCR.
+
+        Workbook chỉ được parse một lần (openpyxl read-only, đọc cell theo khối dòng);
+        phần drawing chỉ được mở cho các sheet có ảnh khi file chứa xl/media.
+        """
+        if Path(file_path).suffix.lower() == '.xls':
+            # openpyxl không đọc được định dạng .xls cũ
+            return self._extract_text_from_xls(file_path, upload_id=upload_id, document_service=document_service, progress_callback=progress_callback)
+
+        try:
+            from openpyxl import load_workbook
+            wb = load_workbook(file_path, read_only=True, data_only=True)
+            archive = zipfile.ZipFile(file_path)
+            try:
+                has_media = any(name.startswith('xl/media/') for name in archive.namelist())
+                sheet_names = wb.sheetnames
+                all_sheets_text = []
+                sheets_info = []
+                ocr_error = None  # Lỗi OCR ảnh đầu tiên: text của file không đầy đủ
+
+                for sheet_name in sheet_names:
+                    # --- MODIFICATION: CHECK FOR CANCELLATION ---
+                    if upload_id and document_service and not document_service.get_upload_info(upload_id):
+                        raise UploadCancelledError(f"Upload {upload_id} was cancelled during Excel processing.")
+                    # --- END MODIFICATION ---
+
+                    ws = wb[sheet_name]
+
+                    # Xử lý text data từ cells (tiêu đề sheet, headers, data rows)
+                    stats = {'rows_count': 0, 'columns_count': 0}
+                    sheet_text_parts = list(self._iter_worksheet_text_blocks(ws, sheet_name, stats=stats))
+
+                    # Xử lý images trong Excel (nếu có)
+                    sheet_image_texts = []
+                    has_images = False
+
+                    if has_media:
+                        try:
+                            images = self._excel_sheet_images(archive, getattr(ws, '_worksheet_path', None))
+                            if images:
+                                has_images = True
+
+                                # OCR tất cả ảnh của sheet trực tiếp từ bộ nhớ, gom batch nếu server hỗ trợ
+                                sheet_images = [
+                                    (img_data, f"excel_{sheet_name}_{img_idx}.png")
+                                    for img_idx, img_data in enumerate(images)
+                                ]
+                                for ocr_result in self._ocr_images_batch(sheet_images, upload_id=upload_id, document_service=document_service):
+                                    if ocr_result.get('success', False) and ocr_result.get('text'):
+                                        sheet_image_texts.append(ocr_result['text'])
+                                    elif not ocr_result.get('success', False):
+                                        logger.warning(f"Lỗi khi xử lý ảnh trong sheet {sheet_name}: {ocr_result.get('error')}")
+                                        ocr_error = ocr_error or ocr_result.get('error') or 'OCR thất bại'
+
+                        except UploadCancelledError:
+                            raise
+                        except Exception as e:
+                            # Nếu không thể xử lý images, tiếp tục với text
+                            logger.warning(f"Lỗi khi đọc ảnh trong sheet {sheet_name}: {str(e)}")
+                            ocr_error = ocr_error or f"Lỗi khi OCR ảnh trong sheet {sheet_name}: {str(e)}"
+
+                    sheets_info.append(self._combine_excel_sheet(sheet_name, sheet_text_parts, sheet_image_texts, all_sheets_text,
+                                                                 stats['rows_count'], stats['columns_count'], has_images))
+                    self._report_progress(progress_callback, len(sheets_info), len(sheet_names), upload_id, unit='sheet')
+            finally:
+                archive.close()
+                wb.close()
+
+            result = self._excel_result(all_sheets_text, sheets_info, len(sheet_names))
+            if ocr_error:
+                result['ocr_error'] = ocr_error
+            return result
+
+        except UploadCancelledError:
+            raise
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'text': '',
+                'sheets': [],
+                'total_words': 0
+            }
+
+    def _extract_text_from_xls(self, file_path: str, upload_id: Optional[str] = None, document_service: Optional[Any] = None, progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Trích xuất text từ file .xls (định dạng cũ) bằng pandas, không có OCR ảnh"""
+        import pandas as pd
+
         try:
-            # Đọc tất cả các sheet
             excel_file = pd.ExcelFile(file_path)
             all_sheets_text = []
             sheets_info = []
-            
+
             for sheet_name in excel_file.sheet_names:
-                # --- MODIFICATION: CHECK FOR CANCELLATION ---
                 if upload_id and document_service and not document_service.get_upload_info(upload_id):
                     raise UploadCancelledError(f"Upload {upload_id} was cancelled during Excel processing.")
-                # --- END MODIFICATION ---
 
                 df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                
-                # Xử lý text data từ cells
-                sheet_text_parts = []
-                
-                # Thêm tên sheet
-                sheet_text_parts.append(f"=== SHEET: {sheet_name} ===")
-                
-                # Xử lý headers
+                sheet_text_parts = [f"=== SHEET: {sheet_name} ==="]
                 if not df.empty:
                     headers = [str(col) for col in df.columns if str(col) != 'nan']
                     if headers:
                         sheet_text_parts.append("Headers: " + " | ".join(headers))
-                
-                # Xử lý data rows
-                for index, row in df.iterrows():
-                    row_data = []
-                    for col in df.columns:
-                        cell_value = row[col]
-                        if pd.notna(cell_value) and str(cell_value).strip():
-                            row_data.append(str(cell_value).strip())
-                    
-                    if row_data:
-                        sheet_text_parts.append(" | ".join(row_data))
-                
-                # Xử lý images trong Excel (nếu có)
-                sheet_image_texts = []
-                has_images = False
-                
-                try:
-                    # Kiểm tra images trong workbook
-                    from openpyxl import load_workbook
-                    wb = load_workbook(file_path)
-                    
-                    if sheet_name in wb.sheetnames:
-                        ws = wb[sheet_name]
-                        
-                        # Tìm images trong sheet
-                        if hasattr(ws, '_images') and ws._images:
-                            has_images = True
-                            
-                            for img_idx, img in enumerate(ws._images):
-                                try:
-                                    # Lưu image tạm thời
-                                    temp_img_path = f"temp_excel_{sheet_name}_{img_idx}.png"
-                                    
-                                    # Lưu image data
-                                    with open(temp_img_path, "wb") as f:
-                                        f.write(img._data())
-                                    
-                                    # OCR image
-                                    ocr_result = self._call_paddle_ocr_api(temp_img_path, upload_id=upload_id, document_service=document_service)
-                                    if ocr_result.get('success', False) and ocr_result.get('text'):
-                                        sheet_image_texts.append(ocr_result['text'])
-                                    
-                                    # Xóa file tạm
-                                    if os.path.exists(temp_img_path):
-                                        os.remove(temp_img_path)
-                                        
-                                except Exception:
-                                    continue
-                                    
-                except Exception:
-                    # Nếu không thể xử lý images, tiếp tục với text
-                    pass
-                
-                # Kết hợp text và OCR cho sheet này
-                sheet_all_text = []
-                if sheet_text_parts:
-                    sheet_all_text.extend(sheet_text_parts)
-                if sheet_image_texts:
-                    sheet_all_text.append("=== OCR FROM IMAGES ===")
-                    sheet_all_text.extend(sheet_image_texts)
-                
-                sheet_final_text = '\n'.join(sheet_all_text)
-                if sheet_final_text:
-                    all_sheets_text.append(sheet_final_text)
-                
-                sheets_info.append({
-                    'sheet_name': sheet_name,
-                    'text': sheet_final_text,
-                    'rows_count': len(df),
-                    'columns_count': len(df.columns),
-                    'has_images': has_images,
-                    'images_ocr_count': len(sheet_image_texts),
-                    'has_data': not df.empty
-                })
-            
-            final_text = '\n\n'.join(all_sheets_text)
-            
-            return {
-                'success': True,
-                'text': final_text,
-                'total_words': len(final_text.split()),
-                'sheets': sheets_info,
-                'processing_summary': {
-                    'total_sheets': len(excel_file.sheet_names),
-                    'sheets_with_data': len([s for s in sheets_info if s['has_data']]),
-                    'sheets_with_images': len([s for s in sheets_info if s['has_images']]),
-                    'total_images_processed': sum(s['images_ocr_count'] for s in sheets_info)
-                }
-            }
-            
+                sheet_text_parts.extend(self._flatten_excel_rows(df))
+
+                sheets_info.append(self._combine_excel_sheet(sheet_name, sheet_text_parts, [], all_sheets_text,
+                                                             len(df), len(df.columns), False))
+                self._report_progress(progress_callback, len(sheets_info), len(excel_file.sheet_names), upload_id, unit='sheet')
+
+            return self._excel_result(all_sheets_text, sheets_info, len(excel_file.sheet_names))
+
+        except UploadCancelledError:
+            raise
         except Exception as e:
             return {
                 'success': False,
@@ -794,6 +1377,144 @@ class OCRService:
                 'total_words': 0
             }
 
+    @staticmethod
+    def _combine_excel_sheet(sheet_name: str, sheet_text_parts: List[str], sheet_image_texts: List[str], all_sheets_text: List[str],
+                             rows_count: int, columns_count: int, has_images: bool) -> Dict[str, Any]:
+        """Kết hợp text và OCR của một sheet, thêm vào all_sheets_text và trả về thông tin sheet"""
+        sheet_all_text = list(sheet_text_parts)
+        if sheet_image_texts:
+            sheet_all_text.append("=== OCR FROM IMAGES ===")
+            sheet_all_text.extend(sheet_image_texts)
+
+        sheet_final_text = '\n'.join(sheet_all_text)
+        if sheet_final_text:
+            all_sheets_text.append(sheet_final_text)
+
+        return {
+            'sheet_name': sheet_name,
+            'text': sheet_final_text,
+            'rows_count': rows_count,
+            'columns_count': columns_count,
+            'has_images': has_images,
+            'images_ocr_count': len(sheet_image_texts),
+            'has_data': rows_count > 0 and columns_count > 0
+        }
+
+    @staticmethod
+    def _excel_result(all_sheets_text: List[str], sheets_info: List[Dict[str, Any]], total_sheets: int) -> Dict[str, Any]:
+        final_text = '\n\n'.join(all_sheets_text)
+        return {
+            'success': True,
+            'text': final_text,
+            'total_words': len(final_text.split()),
+            'sheets': sheets_info,
+            'processing_summary': {
+                'total_sheets': total_sheets,
+                'sheets_with_data': len([s for s in sheets_info if s['has_data']]),
+                'sheets_with_images': len([s for s in sheets_info if s['has_images']]),
+                'total_images_processed': sum(s['images_ocr_count'] for s in sheets_info)
+            }
+        }
+
+    @staticmethod
+    def _excel_sheet_images(archive: zipfile.ZipFile, worksheet_path: Optional[str]) -> List[bytes]:
+        """Đọc bytes các ảnh nhúng trong một sheet (qua quan hệ sheet -> drawing -> media)"""
+        if not worksheet_path:
+            return []
+        from openpyxl.packaging.relationship import get_dependents, get_rels_path
+        from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+        from openpyxl.reader.drawings import find_images
+
+        rels_path = get_rels_path(worksheet_path)
+        if rels_path not in archive.namelist():
+            return []
+
+        images = []
+        for rel in get_dependents(archive, rels_path).find(SpreadsheetDrawing._rel_type):
+            _, drawing_images = find_images(archive, rel.target)
+            images.extend(img._data() for img in drawing_images)
+        return images
+
+    @staticmethod
+    def _flatten_excel_rows(df: 'pd.DataFrame') -> List[str]:
+        """Ghép mỗi dòng thành 'a | b | c' (bỏ ô NaN/rỗng), xử lý theo từng cột thay vì iterrows"""
+        import numpy as np
+        import pandas as pd
+        from pandas.api.types import is_datetime64_any_dtype
+
+        if df.empty or df.shape[1] == 0:
+            return []
+
+        text = pd.Series("", index=df.index, dtype=object)
+        for col_idx in range(df.shape[1]):
+            column = df.iloc[:, col_idx]
+            if is_datetime64_any_dtype(column.dtype):
+                column = column.astype(object)  # Giữ định dạng str(Timestamp) như cách cũ
+            cells = column.astype(str).str.strip().where(column.notna(), "")
+            has_value = (cells != "").to_numpy()
+            separator = np.where((text != "").to_numpy() & has_value, " | ", "")
+            text = text + separator + cells
+        return text[text != ""].tolist()
+
+    def _iter_worksheet_text_blocks(self, ws: Any, sheet_name: str, block_size: int = EXCEL_ROW_BLOCK_SIZE,
+                                    stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """Trả về text của một worksheet theo từng khối dòng (khối đầu là tiêu đề sheet + headers).
+
+        stats (nếu có) được cập nhật 'rows_count' (số dòng dữ liệu tới dòng cuối có giá trị)
+        và 'columns_count'.
+        """
+        import pandas as pd
+
+        rows = ws.iter_rows(values_only=True)
+        header_parts = [f"=== SHEET: {sheet_name} ==="]
+        header = next(rows, None)
+        columns_count = 0
+        if header:
+            columns_count = len(header)
+            headers = [str(col).strip() for col in header if col is not None and str(col).strip()]
+            if headers:
+                header_parts.append("Headers: " + " | ".join(headers))
+        yield "\n".join(header_parts)
+
+        rows_seen = 0
+        last_data_row = 0
+        block = []
+        for row in rows:
+            rows_seen += 1
+            columns_count = max(columns_count, len(row))
+            if all(value is None for value in row):
+                continue  # Dòng trống không tạo text, bỏ qua để không ảnh hưởng kiểu dữ liệu của cột
+            last_data_row = rows_seen
+            block.append(row)
+            if len(block) >= block_size:
+                block_text = "\n".join(self._flatten_excel_rows(pd.DataFrame(block)))
+                block = []
+                if block_text:
+                    yield block_text
+        if block:
+            block_text = "\n".join(self._flatten_excel_rows(pd.DataFrame(block)))
+            if block_text:
+                yield block_text
+
+        if stats is not None:
+            stats['rows_count'] = last_data_row
+            stats['columns_count'] = columns_count
+
+    def iter_excel_text_blocks(self, file_path: str, sheet_name: Optional[str] = None, block_size: int = EXCEL_ROW_BLOCK_SIZE) -> Iterator[Tuple[str, str]]:
+        """Đọc Excel bằng openpyxl read-only và trả về (tên sheet, text) theo từng khối dòng.
+
+        Khối đầu tiên của mỗi sheet là tiêu đề sheet + headers; bộ nhớ chỉ phụ thuộc block_size
+        nên dùng được cho sheet rất lớn.
+        """
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for name in ([sheet_name] if sheet_name else wb.sheetnames):
+                for block_text in self._iter_worksheet_text_blocks(wb[name], name, block_size):
+                    yield name, block_text
+        finally:
+            wb.close()
+
     def _extract_text_from_excel_images(self, file_path: str) -> Dict[str, Any]:
         """Trích xuất text từ hình ảnh trong file Excel bằng OCR"""
         try:
@@ -802,8 +1523,6 @@ class OCRService:
             full_text = []
             sheets_data = []
             image_count = 0
-            temp_dir = Path("temp_excel_images")
-            temp_dir.mkdir(exist_ok=True)
 
             for sheet_name in workbook.sheetnames:
                 sheet = workbook[sheet_name]
@@ -826,14 +1545,9 @@ class OCRService:
                         for img in sheet._images:
                             try:
                                 image_count += 1
-                                temp_path = temp_dir / f"excel_image_{image_count}.png"
-                                
-                                # Lưu hình ảnh
-                                with open(temp_path, "wb") as f:
-                                    f.write(img._data())
-
-                                # OCR hình ảnh với Paddle OCR API
-                                ocr_result = self._call_paddle_ocr_api(str(temp_path))
+
+                                # OCR hình ảnh với Paddle OCR API (trực tiếp từ bộ nhớ)
+                                ocr_result = self._ocr_image_from_bytes(img._data(), f"excel_image_{image_count}.png")
                                 if ocr_result['success'] and ocr_result['text']:
                                     print(f"\n=== OCR HÌNH ẢNH EXCEL #{image_count} ===")
                                     print(f"Sheet: {sheet_name}")
@@ -860,12 +1574,6 @@ class OCRService:
                     full_text.append(f"Sheet: {sheet_name}")
                     full_text.extend(sheet_text)
 
-            # Xóa thư mục tạm nếu tồn tại
-            if temp_dir.exists():
-                for item in temp_dir.iterdir():
-                    item.unlink()
-                temp_dir.rmdir()
-
             text = '\n\n'.join(full_text)
             return {
                 'success': True,
@@ -887,8 +1595,11 @@ class OCRService:
                 'total_words': 0
             }
 
-    def process_file(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None) -> Dict[str, Any]:
-        """Xử lý file dựa trên extension và trả về kết quả OCR"""
+    def process_file(self, file_path: str, is_image: bool = False, upload_id: Optional[str] = None, document_service: Optional[Any] = None, progress_callback: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Xử lý file dựa trên extension và trả về kết quả OCR.
+
+        progress_callback(done, total) được gọi sau mỗi trang PDF / slide / sheet.
+        """
         # --- MODIFICATION: CHECK FOR CANCELLATION AT THE START ---
         if upload_id and document_service and not document_service.get_upload_info(upload_id):
             raise UploadCancelledError(f"Upload {upload_id} was cancelled before processing.")
@@ -904,7 +1615,7 @@ class OCRService:
         try:
             # Xử lý PDF
             if file_extension in self.supported_pdf_extensions:
-                result = self.extract_text_from_pdf(str(file_path), is_image, upload_id=upload_id, document_service=document_service)
+                result = self.extract_text_from_pdf(str(file_path), is_image, upload_id=upload_id, document_service=document_service, progress_callback=progress_callback)
                 result['file_type'] = 'pdf'
             
             # Xử lý hình ảnh
@@ -919,12 +1630,12 @@ class OCRService:
             
             # Xử lý PowerPoint
             elif file_extension in self.supported_presentation_extensions:
-                result = self.extract_text_from_pptx(str(file_path), is_image, upload_id=upload_id, document_service=document_service)
+                result = self.extract_text_from_pptx(str(file_path), is_image, upload_id=upload_id, document_service=document_service, progress_callback=progress_callback)
                 result['file_type'] = 'powerpoint'
             
             # Xử lý Excel
             elif file_extension in self.supported_excel_extensions:
-                result = self.extract_text_from_excel(str(file_path), is_image, upload_id=upload_id, document_service=document_service)
+                result = self.extract_text_from_excel(str(file_path), is_image, upload_id=upload_id, document_service=document_service, progress_callback=progress_callback)
                 result['file_type'] = 'excel'
             
             # Xử lý Text
@@ -947,9 +1658,11 @@ class OCRService:
                 )
             
             result['file_name'] = file_path.name
+            if file_extension not in (self.supported_pdf_extensions | self.supported_presentation_extensions | self.supported_excel_extensions):
+                self._report_progress(progress_callback, 1, 1, upload_id, unit='file')
             return result
             
-        except HTTPException:
+        except (HTTPException, UploadCancelledError):
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Lỗi xử lý file: {str(e)}")
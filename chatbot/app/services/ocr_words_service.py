@@ -0,0 +1,183 @@
+import base64
+import struct
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Định dạng blob: header (magic, số từ) + boxes int16[n,4] (x, y, w, h) + confidence uint8[n] + độ dài text uint16[n]
+WORD_BOXES_MAGIC = b'OWB1'
+_HEADER = struct.Struct('<4sI')
+_INT16_MAX = np.iinfo(np.int16).max
+_UINT16_MAX = np.iinfo(np.uint16).max
+
+
+class OCRWordBoxes:
+    """Hộp bao và độ tin cậy của các dòng/từ OCR trên một ảnh hoặc trang, lưu dạng mảng NumPy.
+
+    Text của từng từ không được lưu lại: từ thứ i là đoạn thứ i của text OCR (nối bằng
+    '\\n'), nên chỉ cần độ dài từng đoạn để cắt lại từ text của trang.
+    """
+
+    __slots__ = ('boxes', 'confidences', 'text_lengths')
+
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray, text_lengths: np.ndarray):
+        self.boxes = boxes
+        self.confidences = confidences
+        self.text_lengths = text_lengths
+
+    @classmethod
+    def empty(cls) -> 'OCRWordBoxes':
+        return cls(np.zeros((0, 4), dtype=np.int16), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint16))
+
+    @classmethod
+    def from_arrays(cls, corners: Any, confidences: Any, texts: List[str]) -> 'OCRWordBoxes':
+        """Tạo từ tọa độ góc [[x, y] x 4] (hoặc [n, 4, 2]), độ tin cậy 0-1 và text của từng từ"""
+        if not texts:
+            return cls.empty()
+        points = np.asarray(corners, dtype=np.float32).reshape(len(texts), -1, 2)
+        top_left = points.min(axis=1)
+        size = points.max(axis=1) - top_left
+        boxes = np.clip(np.rint(np.hstack([top_left, size])), -_INT16_MAX, _INT16_MAX).astype(np.int16)
+        conf = np.clip(np.asarray(confidences, dtype=np.float32) * 100, 0, 100).astype(np.uint8)
+        lengths = np.fromiter((min(len(t), _UINT16_MAX) for t in texts), dtype=np.uint16, count=len(texts))
+        return cls(boxes, conf, lengths)
+
+    def __len__(self) -> int:
+        return len(self.confidences)
+
+    @property
+    def average_confidence(self) -> float:
+        return float(self.confidences.mean()) if len(self) else 0.0
+
+    # ---- BIẾN ĐỔI TỌA ĐỘ ----
+    def scaled(self, scale_x: float, scale_y: float) -> 'OCRWordBoxes':
+        """Đổi tọa độ theo tỷ lệ (vd. từ ảnh đã thu nhỏ khi tiền xử lý về ảnh gốc)"""
+        if not len(self) or (scale_x == 1 and scale_y == 1):
+            return self
+        factors = np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        boxes = np.clip(np.rint(self.boxes * factors), -_INT16_MAX, _INT16_MAX).astype(np.int16)
+        return OCRWordBoxes(boxes, self.confidences, self.text_lengths)
+
+    def offset(self, dx: float, dy: float) -> 'OCRWordBoxes':
+        """Dịch tọa độ (vd. vùng ảnh được cắt từ trang PDF về tọa độ trang)"""
+        if not len(self) or (dx == 0 and dy == 0):
+            return self
+        boxes = self.boxes.astype(np.int32)
+        boxes[:, 0] += int(round(dx))
+        boxes[:, 1] += int(round(dy))
+        return OCRWordBoxes(np.clip(boxes, -_INT16_MAX, _INT16_MAX).astype(np.int16), self.confidences, self.text_lengths)
+
+    def select(self, min_confidence: int = 0) -> np.ndarray:
+        """Chỉ số các từ có độ tin cậy >= min_confidence (0-100)"""
+        return np.flatnonzero(self.confidences >= min_confidence)
+
+    # ---- ĐÓNG GÓI ----
+    def to_bytes(self) -> bytes:
+        count = len(self)
+        return b''.join((
+            _HEADER.pack(WORD_BOXES_MAGIC, count),
+            self.boxes.astype('<i2', copy=False).tobytes(),
+            self.confidences.tobytes(),
+            self.text_lengths.astype('<u2', copy=False).tobytes()
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'OCRWordBoxes':
+        magic, count = _HEADER.unpack_from(data)
+        if magic != WORD_BOXES_MAGIC:
+            raise ValueError("Dữ liệu word boxes không hợp lệ")
+        offset = _HEADER.size
+        boxes = np.frombuffer(data, dtype='<i2', count=count * 4, offset=offset).reshape(count, 4)
+        offset += count * 8
+        conf = np.frombuffer(data, dtype=np.uint8, count=count, offset=offset)
+        offset += count
+        lengths = np.frombuffer(data, dtype='<u2', count=count, offset=offset)
+        return cls(boxes, conf, lengths)
+
+    def to_base64(self) -> str:
+        """Dạng chuỗi để đi kèm kết quả OCR (cache JSON, process pool)"""
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    @classmethod
+    def from_base64(cls, data: str) -> 'OCRWordBoxes':
+        return cls.from_bytes(base64.b64decode(data))
+
+    @classmethod
+    def concat(cls, parts: Iterable['OCRWordBoxes']) -> 'OCRWordBoxes':
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.empty()
+        return cls(np.vstack([p.boxes for p in parts]), np.concatenate([p.confidences for p in parts]),
+                   np.concatenate([p.text_lengths for p in parts]))
+
+    # ---- ĐỌC LẠI ----
+    def to_words(self, text: str, text_offset: int = 0, min_confidence: int = 0) -> List[Dict[str, Any]]:
+        """Danh sách từ dạng dict (text, confidence, bbox) để hiển thị / highlight.
+
+        text là text của trang; text_offset là vị trí bắt đầu phần text OCR trong đó.
+        """
+        starts = text_offset + np.concatenate(([0], np.cumsum(self.text_lengths.astype(np.int64) + 1)[:-1])) if len(self) else []
+        words = []
+        for idx in self.select(min_confidence):
+            start = int(starts[idx])
+            x, y, w, h = (int(v) for v in self.boxes[idx])
+            words.append({
+                'text': text[start:start + int(self.text_lengths[idx])],
+                'confidence': int(self.confidences[idx]),
+                'bbox': {'x': x, 'y': y, 'width': w, 'height': h}
+            })
+        return words
+
+
+def parse_ocr_blocks(ocr_results: Any) -> Tuple[List[str], OCRWordBoxes]:
+    """Tách kết quả ocr-fullV2 ([[bbox, [text, confidence]], ...] theo block) thành text và word boxes.
+
+    Chỉ gom tọa độ/độ tin cậy vào list phẳng rồi chuyển sang NumPy một lần,
+    không tạo dict cho từng từ.
+    """
+    texts: List[str] = []
+    corners: List[Any] = []
+    confidences: List[float] = []
+    for block in ocr_results or []:
+        if not isinstance(block, list):
+            continue
+        for result in block:
+            # result[0] chứa bounding box, result[1] chứa (text, confidence)
+            if not (isinstance(result, list) and len(result) >= 2):
+                continue
+            text_info = result[1]
+            if isinstance(text_info, list) and len(text_info) >= 2:
+                texts.append(text_info[0])
+                corners.append(result[0])
+                confidences.append(text_info[1])
+    if not texts:
+        return texts, OCRWordBoxes.empty()
+    try:
+        return texts, OCRWordBoxes.from_arrays(corners, confidences, texts)
+    except (ValueError, TypeError):
+        # Bbox không đồng nhất (số điểm khác nhau): xử lý từng từ
+        boxes = [_word_box(c, conf, t) for c, conf, t in zip(corners, confidences, texts)]
+        return texts, OCRWordBoxes.concat(boxes)
+
+
+def _word_box(corners: Any, confidence: Any, word_text: str) -> OCRWordBoxes:
+    """Box của một từ; bbox / độ tin cậy lỗi thì dùng box rỗng (độ tin cậy 0) để vẫn giữ text và thứ tự từ"""
+    try:
+        return OCRWordBoxes.from_arrays([corners], [confidence], [word_text])
+    except (ValueError, TypeError):
+        logger.debug(f"Bỏ bbox không hợp lệ của từ {word_text!r}: {corners!r}")
+        return OCRWordBoxes.from_arrays([[[0, 0]] * 4], [0.0], [word_text])
+
+
+def decode_word_boxes(encoded: Optional[str]) -> Optional[OCRWordBoxes]:
+    """Giải mã word boxes dạng base64 trong kết quả OCR, None nếu không có / lỗi"""
+    if not encoded:
+        return None
+    try:
+        return OCRWordBoxes.from_base64(encoded)
+    except (ValueError, struct.error) as e:
+        logger.warning(f"Không thể giải mã word boxes: {e}")
+        return None
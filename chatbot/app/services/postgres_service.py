@@ -1,10 +1,16 @@
 from ..db.database import get_session
 from datetime import datetime
 import json
+import logging
 from uuid import UUID
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+logger = logging.getLogger(__name__)
+
+# Các cột của bảng files đã xác nhận là có (database cũ có thể chưa chạy migration)
+_files_columns = set()
+
 async def delete_file_by_id(file_id: str):
     db_session = get_session()
     async with db_session as session:
@@ -26,6 +32,26 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 class PostgresService:
+    @staticmethod
+    async def files_has_column(column: str) -> bool:
+        """Bảng files đã có cột column chưa; chỉ ghi nhớ khi đã có để migration chạy sau vẫn có hiệu lực"""
+        if column in _files_columns:
+            return True
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                result = await session.execute(text("""
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'files' AND column_name = :column
+                """), {"column": column})
+                if result.fetchone() is None:
+                    return False
+            except Exception as e:
+                logger.warning(f"Không kiểm tra được cột files.{column}: {e}")
+                return False
+        _files_columns.add(column)
+        return True
+
     @staticmethod
     async def insert_file_data(
         original_file_name: str,
@@ -55,8 +81,14 @@ class PostgresService:
         ai_extracted_data: dict = None,
         download_link: str = None,
         char_count: int = None,
-        word_count: int = None
+        word_count: int = None,
+        content_hash: str = None
     ):
+        # Database chưa chạy Tekjoy_Migration_ContentHash.sql: lưu file không kèm hash (không dùng lại kết quả trích xuất)
+        with_content_hash = content_hash is not None and await PostgresService.files_has_column("content_hash")
+        hash_column = ",\n                        content_hash" if with_content_hash else ""
+        hash_value = ",\n                        :content_hash" if with_content_hash else ""
+
         db_session = get_session()
         async with db_session as session:
             try:
@@ -80,7 +112,7 @@ class PostgresService:
                 # Ensure keywords is a list
                 keywords_array = keywords if keywords else []
                 
-                query = text("""
+                query = text(f"""
                     INSERT INTO files (
                         original_file_name, file_extension, mime_type, file_size_bytes,
                         storage_path, thumbnail_path, document_type, uploaded_by_user_id,
@@ -88,7 +120,7 @@ class PostgresService:
                         document_date, vendor_name, contract_number, total_value,
                         currency, warranty_period_months, is_template, keywords,
                         folder_id, folder_path, extracted_text, ai_summary,
-                        ai_extracted_data, download_link, char_count, word_count
+                        ai_extracted_data, download_link, char_count, word_count{hash_column}
                     ) VALUES (
                         :original_file_name, :file_extension, :mime_type, :file_size_bytes,
                         :storage_path, :thumbnail_path, :document_type, :uploaded_by_user_id,
@@ -96,7 +128,7 @@ class PostgresService:
                         :document_date, :vendor_name, :contract_number, :total_value,
                         :currency, :warranty_period_months, :is_template, :keywords,
                         :folder_id, :folder_path, :extracted_text, :ai_summary,
-                        :ai_extracted_data, :download_link, :char_count, :word_count
+                        :ai_extracted_data, :download_link, :char_count, :word_count{hash_value}
                     )
                     RETURNING *
                 """)
@@ -131,7 +163,8 @@ class PostgresService:
                         "ai_extracted_data": ai_extracted_data_json,
                         "download_link": download_link,
                         "char_count": char_count,
-                        "word_count": word_count
+                        "word_count": word_count,
+                        "content_hash": content_hash
                     }
                 )
                 
@@ -260,6 +293,297 @@ class PostgresService:
                 return {"success": False, "error": str(e)}
 
 
+    @staticmethod
+    async def delete_file_pages(file_id: str):
+        """Xóa các trang và chunk đã trích xuất của file (trước khi trích xuất lại)"""
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                await session.execute(text("DELETE FROM file_chunks WHERE file_id = :file_id"), {"file_id": file_id})
+                await session.execute(text("DELETE FROM file_pages WHERE file_id = :file_id"), {"file_id": file_id})
+                await session.commit()
+                return {"success": True}
+            except Exception as e:
+                await session.rollback()
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def upsert_file_pages(file_id: str, pages: list):
+        """Ghi một nhóm trang đã trích xuất vào file_pages (ghi đè nếu trang đã tồn tại)"""
+        if not pages:
+            return {"success": True, "count": 0}
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                query = text("""
+                    INSERT INTO file_pages (
+                        file_id, page_number, text, char_count, word_count,
+                        has_images, success, error_message
+                    ) VALUES (
+                        :file_id, :page_number, :text, :char_count, :word_count,
+                        :has_images, :success, :error_message
+                    )
+                    ON CONFLICT (file_id, page_number) DO UPDATE SET
+                        text = EXCLUDED.text,
+                        char_count = EXCLUDED.char_count,
+                        word_count = EXCLUDED.word_count,
+                        has_images = EXCLUDED.has_images,
+                        success = EXCLUDED.success,
+                        error_message = EXCLUDED.error_message
+                """)
+                await session.execute(query, [{**page, "file_id": file_id} for page in pages])
+                await session.commit()
+                return {"success": True, "count": len(pages)}
+            except Exception as e:
+                await session.rollback()
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def upsert_file_page_words(file_id: str, rows: list):
+        """Ghi word boxes OCR (blob đóng gói) của một nhóm trang vào file_page_words"""
+        if not rows:
+            return {"success": True, "count": 0}
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                query = text("""
+                    INSERT INTO file_page_words (
+                        file_id, page_number, word_count, avg_confidence, text_offset, boxes
+                    ) VALUES (
+                        :file_id, :page_number, :word_count, :avg_confidence, :text_offset, :boxes
+                    )
+                    ON CONFLICT (file_id, page_number) DO UPDATE SET
+                        word_count = EXCLUDED.word_count,
+                        avg_confidence = EXCLUDED.avg_confidence,
+                        text_offset = EXCLUDED.text_offset,
+                        boxes = EXCLUDED.boxes
+                """)
+                await session.execute(query, [{**row, "file_id": file_id} for row in rows])
+                await session.commit()
+                return {"success": True, "count": len(rows)}
+            except Exception as e:
+                await session.rollback()
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def upsert_file_chunks(file_id: str, chunks: list, replace: bool = False):
+        """Ghi các chunk (đoạn text dùng khi chat) của file vào file_chunks; replace=True xóa chunk cũ trước"""
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                if replace:
+                    await session.execute(text("DELETE FROM file_chunks WHERE file_id = :file_id"), {"file_id": file_id})
+                if chunks:
+                    query = text("""
+                        INSERT INTO file_chunks (
+                            file_id, chunk_index, page_start, page_end, heading, text, token_count, overlap_tokens
+                        ) VALUES (
+                            :file_id, :chunk_index, :page_start, :page_end, :heading, :text, :token_count, :overlap_tokens
+                        )
+                        ON CONFLICT (file_id, chunk_index) DO UPDATE SET
+                            page_start = EXCLUDED.page_start,
+                            page_end = EXCLUDED.page_end,
+                            heading = EXCLUDED.heading,
+                            text = EXCLUDED.text,
+                            token_count = EXCLUDED.token_count,
+                            overlap_tokens = EXCLUDED.overlap_tokens
+                    """)
+                    await session.execute(query, [{**chunk, "file_id": file_id} for chunk in chunks])
+                await session.commit()
+                return {"success": True, "count": len(chunks)}
+            except Exception as e:
+                await session.rollback()
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def get_file_page_words(file_id: str, page_number: int = None, min_confidence: int = None):
+        """Đọc word boxes OCR của file (hoặc một trang) kèm text trang.
+
+        min_confidence lọc theo độ tin cậy trung bình của trang (0-100).
+        """
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                conditions = ["w.file_id = :file_id"]
+                values = {"file_id": file_id}
+                if page_number is not None:
+                    conditions.append("w.page_number = :page_number")
+                    values["page_number"] = page_number
+                if min_confidence is not None:
+                    conditions.append("w.avg_confidence >= :min_confidence")
+                    values["min_confidence"] = min_confidence
+                query = text(f"""
+                    SELECT w.page_number, w.word_count, w.avg_confidence, w.text_offset, w.boxes, p.text
+                    FROM file_page_words w
+                    JOIN file_pages p ON p.file_id = w.file_id AND p.page_number = w.page_number
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY w.page_number
+                """)
+                result = await session.execute(query, values)
+                pages = [dict(row._mapping) for row in result.fetchall()]
+                return {"success": True, "pages": pages}
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def find_extraction_source(file_id: str):
+        """Tìm file đã trích xuất xong có cùng nội dung (content_hash) với file_id.
+
+        Bỏ qua file có trang lỗi hoặc OCR thất bại (file_pages.success = false / error_message) để file mới
+        được OCR lại thay vì chép text thiếu.
+        Trả về {"success", "content_hash", "file_size_bytes", "source_id"}; source_id là None nếu chưa có.
+        """
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                query = text("""
+                    SELECT f.content_hash, f.file_size_bytes, src.id AS source_id
+                    FROM files f
+                    LEFT JOIN LATERAL (
+                        SELECT s.id FROM files s
+                        WHERE s.content_hash = f.content_hash AND s.id <> f.id
+                          AND s.processing_status = 'completed' AND s.extracted_text IS NOT NULL
+                          AND NOT EXISTS (
+                              SELECT 1 FROM file_pages p
+                              WHERE p.file_id = s.id AND (NOT p.success OR p.error_message IS NOT NULL)
+                          )
+                        ORDER BY s.last_modified_timestamp DESC
+                        LIMIT 1
+                    ) src ON TRUE
+                    WHERE f.id = :file_id
+                """)
+                result = await session.execute(query, {"file_id": file_id})
+                row = result.fetchone()
+                if not row:
+                    return {"success": False, "error": "File not found"}
+                return {
+                    "success": True,
+                    "content_hash": row.content_hash,
+                    "file_size_bytes": row.file_size_bytes,
+                    "source_id": str(row.source_id) if row.source_id else None
+                }
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def copy_file_extraction(source_id: str, file_id: str, update_data: dict = None):
+        """Sao chép kết quả trích xuất (file_pages, file_page_words, file_chunks, extracted_text, ai_*) từ source_id sang file_id"""
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                values = {"file_id": file_id, "source_id": source_id}
+                await session.execute(text("DELETE FROM file_chunks WHERE file_id = :file_id"), values)
+                await session.execute(text("DELETE FROM file_pages WHERE file_id = :file_id"), values)
+                pages = await session.execute(text("""
+                    INSERT INTO file_pages (
+                        file_id, page_number, text, char_count, word_count,
+                        has_images, success, error_message
+                    )
+                    SELECT :file_id, page_number, text, char_count, word_count,
+                           has_images, success, error_message
+                    FROM file_pages WHERE file_id = :source_id
+                    RETURNING success
+                """), values)
+                page_flags = [row.success for row in pages.fetchall()]
+                await session.execute(text("""
+                    INSERT INTO file_page_words (file_id, page_number, word_count, avg_confidence, text_offset, boxes)
+                    SELECT :file_id, page_number, word_count, avg_confidence, text_offset, boxes
+                    FROM file_page_words WHERE file_id = :source_id
+                """), values)
+                await session.execute(text("""
+                    INSERT INTO file_chunks (file_id, chunk_index, page_start, page_end, heading, text, token_count, overlap_tokens)
+                    SELECT :file_id, chunk_index, page_start, page_end, heading, text, token_count, overlap_tokens
+                    FROM file_chunks WHERE file_id = :source_id
+                """), values)
+
+                extra_clause = ""
+                for key, value in (update_data or {}).items():
+                    extra_clause += f", {key} = :{key}"
+                    values[key] = value
+                result = await session.execute(text(f"""
+                    UPDATE files f
+                    SET extracted_text = s.extracted_text,
+                        char_count = s.char_count,
+                        word_count = s.word_count,
+                        ai_summary = COALESCE(f.ai_summary, s.ai_summary),
+                        ai_extracted_data = COALESCE(f.ai_extracted_data, s.ai_extracted_data){extra_clause}
+                    FROM files s
+                    WHERE f.id = :file_id AND s.id = :source_id
+                    RETURNING f.*
+                """), values)
+                updated_file = result.fetchone()
+                if not updated_file:
+                    await session.rollback()
+                    return {"success": False, "error": "File not found"}
+
+                await session.commit()
+
+                file_data = dict(updated_file._mapping)
+                for key, value in file_data.items():
+                    if isinstance(value, UUID):
+                        file_data[key] = str(value)
+                    elif isinstance(value, datetime):
+                        file_data[key] = value.isoformat()
+
+                return {
+                    "success": True,
+                    "file": file_data,
+                    "pages": len(page_flags),
+                    "processed_pages": sum(1 for flag in page_flags if flag)
+                }
+
+            except Exception as e:
+                await session.rollback()
+                return {"success": False, "error": str(e)}
+
+    @staticmethod
+    async def assemble_extracted_text(file_id: str, update_data: dict = None):
+        """Ghép files.extracted_text từ file_pages ngay trong SQL (không tải text về Python)"""
+        db_session = get_session()
+        async with db_session as session:
+            try:
+                extra_clause = ""
+                values = {"file_id": file_id}
+                for key, value in (update_data or {}).items():
+                    extra_clause += f", {key} = :{key}"
+                    values[key] = value
+
+                query = text(f"""
+                    UPDATE files f
+                    SET extracted_text = agg.extracted_text,
+                        char_count = length(agg.extracted_text),
+                        word_count = agg.word_count{extra_clause}
+                    FROM (
+                        SELECT string_agg(text, E'\\n\\n' ORDER BY page_number) AS extracted_text,
+                               SUM(word_count) AS word_count
+                        FROM file_pages
+                        WHERE file_id = :file_id AND success AND text <> ''
+                    ) agg
+                    WHERE f.id = :file_id
+                    RETURNING f.*
+                """)
+                result = await session.execute(query, values)
+                updated_file = result.fetchone()
+
+                if not updated_file:
+                    return {"success": False, "error": "File not found"}
+
+                await session.commit()
+
+                file_data = dict(updated_file._mapping)
+                for key, value in file_data.items():
+                    if isinstance(value, UUID):
+                        file_data[key] = str(value)
+                    elif isinstance(value, datetime):
+                        file_data[key] = value.isoformat()
+
+                return {"success": True, "file": file_data}
+
+            except Exception as e:
+                await session.rollback()
+                return {"success": False, "error": str(e)}
+
+
 async def run_sql_query(sql_query: str):
     db_session = get_session()
     async with db_session as session:
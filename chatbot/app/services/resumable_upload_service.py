@@ -0,0 +1,407 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from ..db.database import get_session
+from app.services.upload_progress_service import upload_progress
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình upload nhiều phần (resumable)
+RESUMABLE_UPLOAD_MAX_MB = int(os.getenv("RESUMABLE_UPLOAD_MAX_MB", "1024"))        # Kích thước file tối đa
+RESUMABLE_PART_SIZE_MB = int(os.getenv("RESUMABLE_PART_SIZE_MB", "8"))             # Kích thước phần mặc định
+RESUMABLE_MAX_PART_SIZE_MB = int(os.getenv("RESUMABLE_MAX_PART_SIZE_MB", "64"))
+RESUMABLE_UPLOAD_TTL_HOURS = int(os.getenv("RESUMABLE_UPLOAD_TTL_HOURS", "24"))    # Phiên chưa hoàn tất quá hạn sẽ bị xóa
+RESUMABLE_MIN_PART_SIZE = 1024 * 1024                                              # Trừ phần cuối
+RESUMABLE_CLEANUP_SECONDS = 600
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    data = dict(row._mapping)
+    for key, value in data.items():
+        if isinstance(value, UUID):
+            data[key] = str(value)
+        elif isinstance(value, datetime):
+            data[key] = value.isoformat()
+    if isinstance(data.get("file_metadata"), str):
+        data["file_metadata"] = json.loads(data["file_metadata"])
+    return data
+
+
+def _merge_ranges(session: Dict[str, Any], part_numbers: List[int]) -> List[List[int]]:
+    """Gộp các phần đã nhận thành các khoảng byte liên tục [start, end)"""
+    ranges: List[List[int]] = []
+    for part_number in sorted(part_numbers):
+        start, end = _part_bounds(session, part_number)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def _part_bounds(session: Dict[str, Any], part_number: int) -> Tuple[int, int]:
+    start = (part_number - 1) * session["part_size"]
+    return start, min(start + session["part_size"], session["file_size_bytes"])
+
+
+class ResumableUploadService:
+    """Upload file lớn theo nhiều phần, gửi lại được từng phần khi lỗi mạng.
+
+    Quy trình: tạo phiên (POST) -> gửi các phần đánh số từ 1 (PUT, có thể song song và theo thứ tự bất kỳ)
+    -> xem các khoảng đã nhận (GET) -> hoàn tất (POST .../complete) để đưa file vào pipeline OCR.
+    Mỗi phần được ghi dần (không giữ cả phần trong bộ nhớ) vào file riêng uploads/.resumable/{id}/{n};
+    khi hoàn tất các phần được ghép một lần thành file mới rồi xóa. Trạng thái phiên và các phần đã nhận lưu trong Postgres
+    (bảng resumable_uploads / resumable_upload_parts) để các worker dùng chung; thư mục uploads
+    phải là thư mục dùng chung giữa các worker (như với job OCR chạy nền).
+    """
+
+    def __init__(self, upload_dir: Optional[Path] = None):
+        self.parts_dir = (upload_dir or Path.cwd() / "uploads") / ".resumable"
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        self._last_cleanup = 0.0
+
+    def session_dir(self, session_id: str) -> Path:
+        return self.parts_dir / session_id
+
+    def part_path(self, session_id: str, part_number: int) -> Path:
+        return self.session_dir(session_id) / str(part_number)
+
+    def partial_path(self, session_id: str) -> Path:
+        """File đã ghép đủ các phần (tạo khi hoàn tất)"""
+        return self.parts_dir / f"{session_id}.part"
+
+    # ---- PHIÊN UPLOAD ----
+    async def create_session(self, user_id: str, filename: str, file_size: int, mime_type: Optional[str] = None,
+                             part_size: Optional[int] = None, content_sha256: Optional[str] = None,
+                             upload_id: Optional[str] = None, file_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Tạo phiên upload và thư mục chứa các phần"""
+        if file_size <= 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Kích thước file không hợp lệ")
+        if file_size > RESUMABLE_UPLOAD_MAX_MB * 1024 * 1024:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Kích thước file vượt quá giới hạn {RESUMABLE_UPLOAD_MAX_MB}MB")
+        part_size = part_size or RESUMABLE_PART_SIZE_MB * 1024 * 1024
+        if not RESUMABLE_MIN_PART_SIZE <= part_size <= RESUMABLE_MAX_PART_SIZE_MB * 1024 * 1024:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"part_size phải từ 1MB đến {RESUMABLE_MAX_PART_SIZE_MB}MB")
+        total_parts = -(-file_size // part_size)
+
+        await self._cleanup_expired()
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    INSERT INTO resumable_uploads (
+                        user_id, upload_id, original_file_name, mime_type, file_size_bytes, part_size,
+                        total_parts, content_sha256, file_metadata, expires_at
+                    ) VALUES (
+                        :user_id, :upload_id, :original_file_name, :mime_type, :file_size_bytes, :part_size,
+                        :total_parts, :content_sha256, CAST(:file_metadata AS JSONB), NOW() + make_interval(hours => :ttl_hours)
+                    )
+                    RETURNING *
+                """), {
+                    "user_id": user_id,
+                    "upload_id": upload_id,
+                    "original_file_name": filename,
+                    "mime_type": mime_type,
+                    "file_size_bytes": file_size,
+                    "part_size": part_size,
+                    "total_parts": total_parts,
+                    "content_sha256": content_sha256.lower() if content_sha256 else None,
+                    "file_metadata": json.dumps(file_metadata or {}, ensure_ascii=False, default=str),
+                    "ttl_hours": RESUMABLE_UPLOAD_TTL_HOURS
+                })
+                row = _row_to_dict(result.fetchone())
+                await run_in_threadpool(self.session_dir(row["id"]).mkdir, parents=True, exist_ok=True)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        logger.info(f"Tạo phiên upload {row['id']}: {filename}, {file_size} bytes, {total_parts} phần x {part_size} bytes")
+        return {**row, "parts": []}
+
+    async def get_session(self, session_id: str, include_parts: bool = True) -> Optional[Dict[str, Any]]:
+        """Phiên upload kèm danh sách phần đã nhận, None nếu không tồn tại"""
+        async with get_session() as session:
+            result = await session.execute(text("SELECT * FROM resumable_uploads WHERE id = :id"), {"id": session_id})
+            row = result.fetchone()
+            if not row:
+                return None
+            if not include_parts:
+                return _row_to_dict(row)
+            parts = await session.execute(text("""
+                SELECT part_number, size_bytes, sha256 FROM resumable_upload_parts
+                WHERE session_id = :id ORDER BY part_number
+            """), {"id": session_id})
+            return {**_row_to_dict(row), "parts": [dict(part._mapping) for part in parts.fetchall()]}
+
+    @staticmethod
+    def describe(upload: Dict[str, Any]) -> Dict[str, Any]:
+        """Trạng thái phiên cho client: các phần / khoảng byte đã nhận và các phần còn thiếu"""
+        received = [part["part_number"] for part in upload["parts"]]
+        received_set = set(received)
+        return {
+            "session_id": upload["id"],
+            "status": upload["status"],
+            "upload_id": upload.get("upload_id"),
+            "original_file_name": upload["original_file_name"],
+            "file_size_bytes": upload["file_size_bytes"],
+            "part_size": upload["part_size"],
+            "total_parts": upload["total_parts"],
+            "bytes_received": sum(part["size_bytes"] for part in upload["parts"]),
+            "received_parts": received,
+            "missing_parts": [n for n in range(1, upload["total_parts"] + 1) if n not in received_set],
+            "received_ranges": _merge_ranges(upload, received),
+            "file_id": upload.get("file_id"),
+            "expires_at": upload["expires_at"]
+        }
+
+    # ---- GHI TỪNG PHẦN ----
+    async def write_part(self, upload: Dict[str, Any], part_number: int, body: AsyncIterator[bytes],
+                         checksum: Optional[str] = None) -> Dict[str, Any]:
+        """Ghi phần part_number (đánh số từ 1) vào file riêng của phần đó.
+
+        Nội dung được ghi vào file tạm rồi mới thay file của phần, trong transaction giữ khóa dòng
+        của phiên khi phiên còn 'uploading'; begin_complete phải chờ khóa này nên phần gửi lại trong
+        lúc hoàn tất không thể thay đổi dữ liệu đang được ghép. Gửi lại một phần sẽ thay phần cũ.
+        Phần chỉ được ghi nhận khi nhận đủ số byte và khớp checksum (SHA-256, nếu client gửi kèm).
+        """
+        if upload["status"] != "uploading":
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Phiên upload đang ở trạng thái {upload['status']}")
+        if not 1 <= part_number <= upload["total_parts"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"part_number phải từ 1 đến {upload['total_parts']}")
+        start, end = _part_bounds(upload, part_number)
+        expected = end - start
+        hasher = hashlib.sha256()
+        received = 0
+        buffer = bytearray()
+        upload_id = upload.get("upload_id")
+
+        part_path = self.part_path(upload["id"], part_number)
+        tmp_path = part_path.with_name(f"{part_number}.{uuid4().hex}.tmp")
+        try:
+            fd = await run_in_threadpool(os.open, str(tmp_path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileNotFoundError:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Phiên upload đã hoàn tất hoặc bị hủy")
+        try:
+            try:
+                async for chunk in body:
+                    if not chunk:
+                        continue
+                    if received + len(buffer) + len(chunk) > expected:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                            detail=f"Phần {part_number} dài hơn {expected} bytes")
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        await run_in_threadpool(self._write_at, fd, bytes(buffer), received, hasher)
+                        received += len(buffer)
+                        upload_progress.emit(upload_id, 'bytes_saved', bytes=len(buffer), part_number=part_number)
+                        buffer.clear()
+                if buffer:
+                    await run_in_threadpool(self._write_at, fd, bytes(buffer), received, hasher)
+                    received += len(buffer)
+                    upload_progress.emit(upload_id, 'bytes_saved', bytes=len(buffer), part_number=part_number)
+            finally:
+                await run_in_threadpool(os.close, fd)
+
+            if received != expected:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Phần {part_number} cần {expected} bytes, đã nhận {received} bytes")
+            digest = hasher.hexdigest()
+            if checksum and checksum.lower() != digest:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Checksum phần {part_number} không khớp")
+
+            async with get_session() as session:
+                try:
+                    # Khóa dòng phiên (và kiểm tra trạng thái) trước khi thay file của phần, giữ tới khi commit
+                    result = await session.execute(text("""
+                        UPDATE resumable_uploads SET updated_at = NOW()
+                        WHERE id = :id AND status = 'uploading'
+                        RETURNING id
+                    """), {"id": upload["id"]})
+                    if result.fetchone() is None:
+                        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Phiên upload đã hoàn tất hoặc bị hủy")
+                    await run_in_threadpool(os.replace, tmp_path, part_path)
+                    await session.execute(text("""
+                        INSERT INTO resumable_upload_parts (session_id, part_number, size_bytes, sha256)
+                        VALUES (:id, :part_number, :size_bytes, :sha256)
+                        ON CONFLICT (session_id, part_number) DO UPDATE SET
+                            size_bytes = EXCLUDED.size_bytes,
+                            sha256 = EXCLUDED.sha256,
+                            received_at = NOW()
+                    """), {"id": upload["id"], "part_number": part_number, "size_bytes": received, "sha256": digest})
+                    counts = await session.execute(text("""
+                        SELECT COUNT(*) AS parts_received, COALESCE(SUM(size_bytes), 0) AS bytes_received
+                        FROM resumable_upload_parts WHERE session_id = :id
+                    """), {"id": upload["id"]})
+                    parts_received, bytes_received = counts.fetchone()
+                    await session.commit()
+                except Exception:
+                    await session.rollback()
+                    raise
+        finally:
+            await run_in_threadpool(self._remove, tmp_path)
+        return {
+            "part_number": part_number,
+            "size_bytes": received,
+            "sha256": digest,
+            "parts_received": parts_received,
+            "bytes_received": int(bytes_received),
+            "total_parts": upload["total_parts"]
+        }
+
+    # ---- HOÀN TẤT ----
+    async def begin_complete(self, session_id: str) -> Tuple[Dict[str, Any], str]:
+        """Nhận quyền hoàn tất phiên (chỉ một request thành công) khi đã đủ mọi phần.
+
+        Ghép các phần vào partial_path(session_id) và trả về (phiên, SHA-256 của toàn bộ file).
+        Sau khi phiên chuyển sang 'completing' không phần nào được thay nữa.
+        Lỗi sau bước này cần gọi release() để client thử lại.
+        """
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    UPDATE resumable_uploads u
+                    SET status = 'completing', updated_at = NOW()
+                    WHERE u.id = :id AND u.status = 'uploading'
+                      AND (SELECT COUNT(*) FROM resumable_upload_parts p WHERE p.session_id = u.id) = u.total_parts
+                    RETURNING *
+                """), {"id": session_id})
+                row = result.fetchone()
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        if not row:
+            upload = await self.get_session(session_id)
+            if not upload:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy phiên upload")
+            if upload["status"] != "uploading":
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Phiên upload đang ở trạng thái {upload['status']}")
+            missing = self.describe(upload)["missing_parts"]
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail={"message": "Chưa nhận đủ các phần của file", "missing_parts": missing})
+
+        upload = _row_to_dict(row)
+        try:
+            # Ghép theo thứ tự phần và tính hash toàn file trong cùng một lượt đọc
+            content_hash = await run_in_threadpool(self._assemble, self.session_dir(session_id),
+                                                   upload["total_parts"], self.partial_path(session_id))
+        except Exception:
+            await self.release(session_id)
+            raise
+        if upload.get("content_sha256") and upload["content_sha256"] != content_hash:
+            await self.release(session_id)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="SHA-256 của file đã ghép không khớp content_sha256 khi tạo phiên")
+        return upload, content_hash
+
+    async def release(self, session_id: str) -> None:
+        """Trả phiên về trạng thái uploading sau khi hoàn tất thất bại"""
+        await self._set_status(session_id, 'uploading', from_status='completing')
+
+    async def mark_completed(self, session_id: str, file_id: str) -> None:
+        async with get_session() as session:
+            try:
+                await session.execute(text("""
+                    UPDATE resumable_uploads SET status = 'completed', file_id = :file_id, updated_at = NOW()
+                    WHERE id = :id
+                """), {"id": session_id, "file_id": file_id})
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        await run_in_threadpool(self._remove_session_files, session_id)
+
+    async def abort(self, session_id: str) -> bool:
+        """Hủy phiên đang upload và xóa file tạm"""
+        aborted = await self._set_status(session_id, 'aborted', from_status='uploading')
+        if aborted:
+            await run_in_threadpool(self._remove_session_files, session_id)
+        return aborted
+
+    async def _set_status(self, session_id: str, new_status: str, from_status: str) -> bool:
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    UPDATE resumable_uploads SET status = :new_status, updated_at = NOW()
+                    WHERE id = :id AND status = :from_status
+                    RETURNING id
+                """), {"id": session_id, "new_status": new_status, "from_status": from_status})
+                changed = result.fetchone() is not None
+                await session.commit()
+                return changed
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def _cleanup_expired(self) -> None:
+        """Xóa các phiên quá hạn cùng file tạm (chạy tối đa mỗi RESUMABLE_CLEANUP_SECONDS)"""
+        if time.monotonic() - self._last_cleanup < RESUMABLE_CLEANUP_SECONDS:
+            return
+        self._last_cleanup = time.monotonic()
+        try:
+            async with get_session() as session:
+                result = await session.execute(text("""
+                    DELETE FROM resumable_uploads
+                    WHERE expires_at < NOW()
+                      -- Phiên đang hoàn tất chỉ bị xóa nếu treo (worker dừng giữa chừng)
+                      AND (status <> 'completing' OR updated_at < NOW() - INTERVAL '1 hour')
+                    RETURNING id
+                """))
+                expired = [str(row[0]) for row in result.fetchall()]
+                await session.commit()
+            for session_id in expired:
+                await run_in_threadpool(self._remove_session_files, session_id)
+            if expired:
+                logger.info(f"Đã xóa {len(expired)} phiên upload quá hạn")
+        except Exception as e:
+            logger.warning(f"Lỗi khi dọn phiên upload quá hạn: {e}")
+
+    # ---- FILE TẠM (chạy trong thread pool) ----
+
+    @staticmethod
+    def _write_at(fd: int, data: bytes, offset: int, hasher: Any) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        hasher.update(data)
+
+    @staticmethod
+    def _assemble(session_dir: Path, total_parts: int, target: Path) -> str:
+        """Ghép các phần 1..total_parts vào target (ghi đè), trả về SHA-256 của file đã ghép"""
+        hasher = hashlib.sha256()
+        with open(target, 'wb') as out:
+            for part_number in range(1, total_parts + 1):
+                with open(session_dir / str(part_number), 'rb') as part:
+                    for chunk in iter(lambda: part.read(WRITE_BUFFER_SIZE), b''):
+                        hasher.update(chunk)
+                        out.write(chunk)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        path.unlink(missing_ok=True)
+
+    def _remove_session_files(self, session_id: str) -> None:
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+        self._remove(self.partial_path(session_id))
+
+
+# Khởi tạo service
+resumable_upload_service = ResumableUploadService()
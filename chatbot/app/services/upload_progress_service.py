@@ -0,0 +1,237 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình kênh tiến độ upload (SSE)
+PROGRESS_HISTORY_SIZE = int(os.getenv("PROGRESS_HISTORY_SIZE", "500"))            # Số sự kiện giữ lại mỗi upload để phát lại khi kết nối lại
+PROGRESS_RETENTION_SECONDS = int(os.getenv("PROGRESS_RETENTION_SECONDS", "300"))  # Giữ kênh sau khi upload kết thúc
+PROGRESS_IDLE_SECONDS = int(os.getenv("PROGRESS_IDLE_SECONDS", "3600"))           # Xóa kênh không có sự kiện mới quá lâu
+PROGRESS_HEARTBEAT_SECONDS = float(os.getenv("PROGRESS_HEARTBEAT_SECONDS", "15"))
+PROGRESS_MAX_PENDING_PER_USER = int(os.getenv("PROGRESS_MAX_PENDING_PER_USER", "20"))  # Số kênh mở trước khi upload bắt đầu mỗi user
+
+# Sự kiện kết thúc upload, sau sự kiện này stream SSE đóng lại
+TERMINAL_EVENTS = {'completed', 'failed', 'cancelled'}
+
+# Sự kiện được cộng dồn vào 'totals' (tên sự kiện -> (khóa tổng, trường cộng thêm hoặc None = đếm 1))
+_TOTAL_COUNTERS = {
+    'bytes_saved': ('bytes_saved', 'bytes'),
+    'page_rendered': ('pages_rendered', None),
+    'page_ocr_done': ('pages_ocr', None),
+    'ocr_cache_hit': ('ocr_cache_hits', None),
+    'db_write': ('pages_written', 'pages'),
+}
+
+
+class UploadProgressForbiddenError(Exception):
+    """Upload thuộc về người dùng khác"""
+    pass
+
+
+class UploadProgressLimitError(Exception):
+    """Người dùng đã mở quá nhiều kênh cho upload chưa bắt đầu"""
+    pass
+
+
+class _ProgressChannel:
+    """Lịch sử sự kiện và các subscriber của một upload"""
+
+    def __init__(self, owner_id: Optional[str] = None, created_by: Optional[str] = None):
+        self.owner_id = owner_id
+        self.created_by = created_by  # Người subscribe tạo kênh trước khi upload bắt đầu
+        self.events: deque = deque(maxlen=PROGRESS_HISTORY_SIZE)
+        self.seq = 0
+        self.started = time.monotonic()
+        self.updated = self.started
+        self.finished_at: Optional[float] = None
+        self.totals: Dict[str, int] = {key: 0 for key, _ in _TOTAL_COUNTERS.values()}
+        self.waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+
+class UploadProgressService:
+    """Kênh sự kiện tiến độ theo upload_id, phát cho client qua Server-Sent Events.
+
+    emit() được gọi từ thread OCR hoặc event loop; mỗi sự kiện có số thứ tự tăng dần
+    (dùng làm id SSE để client kết nối lại với Last-Event-ID), thời gian từ lúc bắt đầu
+    upload và các bộ đếm cộng dồn. Kênh chỉ tồn tại trong process hiện tại.
+    Sự kiện chỉ được gửi cho subscriber là người upload (ghi nhận khi open()) hoặc admin.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _ProgressChannel] = {}
+        self._forward: Optional[Callable[[str, str, Dict[str, Any]], None]] = None
+
+    def forward_to(self, sink: Optional[Callable[[str, str, Dict[str, Any]], None]]) -> None:
+        """Chuyển mọi sự kiện cho sink(upload_id, event, data) thay vì lưu trong process này.
+
+        Dùng trong worker trích xuất (OCR_EXTRACTION_MODE=process) để gửi sự kiện về process API.
+        """
+        self._forward = sink
+
+    def _get_channel(self, upload_id: str) -> _ProgressChannel:
+        """Lấy hoặc tạo kênh (gọi khi đã giữ lock)"""
+        channel = self._channels.get(upload_id)
+        if channel is None:
+            channel = self._channels[upload_id] = _ProgressChannel()
+        return channel
+
+    def _purge_expired(self) -> None:
+        """Xóa kênh đã kết thúc quá PROGRESS_RETENTION_SECONDS hoặc không hoạt động (gọi khi đã giữ lock)"""
+        now = time.monotonic()
+        expired = [
+            upload_id for upload_id, channel in self._channels.items()
+            if not channel.waiters and (
+                (channel.finished_at is not None and now - channel.finished_at > PROGRESS_RETENTION_SECONDS)
+                or now - channel.updated > PROGRESS_IDLE_SECONDS
+            )
+        ]
+        for upload_id in expired:
+            self._channels.pop(upload_id, None)
+
+    def attach(self, upload_id: str, subscriber_id: Optional[str] = None) -> None:
+        """Kiểm tra quyền trước khi subscribe; tạo kênh nếu upload chưa bắt đầu.
+
+        subscriber_id None (admin) được xem mọi upload. Raise UploadProgressForbiddenError nếu
+        upload thuộc người khác, UploadProgressLimitError nếu đã tạo quá PROGRESS_MAX_PENDING_PER_USER
+        kênh chưa có upload.
+        """
+        with self._lock:
+            self._purge_expired()
+            channel = self._channels.get(upload_id)
+            if channel is not None:
+                if subscriber_id and channel.owner_id and channel.owner_id != subscriber_id:
+                    raise UploadProgressForbiddenError(upload_id)
+                return
+            if subscriber_id:
+                pending = sum(1 for channel in self._channels.values()
+                              if channel.owner_id is None and channel.created_by == subscriber_id)
+                if pending >= PROGRESS_MAX_PENDING_PER_USER:
+                    raise UploadProgressLimitError(upload_id)
+            self._channels[upload_id] = _ProgressChannel(created_by=subscriber_id)
+
+    def open(self, upload_id: str, owner_id: Optional[str] = None) -> None:
+        """Bắt đầu (hoặc bắt đầu lại) kênh cho một upload và ghi nhận người upload"""
+        with self._lock:
+            self._purge_expired()
+            channel = self._channels.get(upload_id)
+            if channel is None or channel.finished_at is not None:
+                # upload_id dùng lại sau khi upload trước đã kết thúc
+                previous = channel
+                channel = self._channels[upload_id] = _ProgressChannel(owner_id)
+                if previous:
+                    # Giữ subscriber đang chờ và tiếp tục đánh số để Last-Event-ID vẫn đúng
+                    channel.waiters = previous.waiters
+                    channel.seq = previous.seq
+            else:
+                channel.owner_id = owner_id
+            waiters = list(channel.waiters)
+        # Subscriber không phải người upload nhận ra ngay và dừng stream
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                pass
+
+    def emit(self, upload_id: Optional[str], event: str, **data: Any) -> None:
+        """Ghi một sự kiện tiến độ; bỏ qua nếu không có upload_id. Không bao giờ raise."""
+        if not upload_id:
+            return
+        try:
+            if self._forward is not None:
+                self._forward(upload_id, event, data)
+                return
+            with self._lock:
+                channel = self._get_channel(upload_id)
+                if channel.finished_at is not None:
+                    return  # Upload đã kết thúc; lần upload mới với cùng upload_id phải gọi open()
+                now = time.monotonic()
+                counter = _TOTAL_COUNTERS.get(event)
+                if counter:
+                    key, field = counter
+                    channel.totals[key] += int(data.get(field, 0)) if field else 1
+                channel.seq += 1
+                channel.updated = now
+                if event in TERMINAL_EVENTS:
+                    channel.finished_at = now
+                channel.events.append({
+                    'id': channel.seq,
+                    'event': event,
+                    'elapsed_ms': round((now - channel.started) * 1000),
+                    'data': data,
+                    'totals': dict(channel.totals)
+                })
+                waiters = list(channel.waiters)
+            for loop, waiter in waiters:
+                loop.call_soon_threadsafe(waiter.set)
+        except RuntimeError:
+            pass  # Event loop của subscriber đã đóng
+        except Exception as e:
+            logger.warning(f"Không thể ghi sự kiện tiến độ {event} cho upload {upload_id}: {e}")
+
+    def get_owner(self, upload_id: str) -> Optional[str]:
+        with self._lock:
+            channel = self._channels.get(upload_id)
+            return channel.owner_id if channel else None
+
+    def get_events(self, upload_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        """Các sự kiện có id > after_id còn trong lịch sử"""
+        with self._lock:
+            channel = self._channels.get(upload_id)
+            if channel is None:
+                return []
+            return [event for event in channel.events if event['id'] > after_id]
+
+    async def subscribe(self, upload_id: str, last_event_id: int = 0,
+                        heartbeat_seconds: float = PROGRESS_HEARTBEAT_SECONDS,
+                        subscriber_id: Optional[str] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Phát lại sự kiện sau last_event_id rồi chờ sự kiện mới cho tới sự kiện kết thúc.
+
+        Trả về None mỗi heartbeat_seconds khi không có sự kiện (để gửi keep-alive).
+        Client có thể subscribe trước khi bắt đầu upload (upload_id do client tạo, gọi attach() trước);
+        sự kiện chỉ được gửi khi đã biết người upload là subscriber_id (None = admin, xem mọi upload),
+        upload của người khác thì stream dừng.
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._purge_expired()
+            self._get_channel(upload_id).waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                with self._lock:
+                    channel = self._get_channel(upload_id)
+                    channel.waiters.add(waiter)
+                    if subscriber_id and channel.owner_id and channel.owner_id != subscriber_id:
+                        return
+                    if subscriber_id and channel.owner_id is None:
+                        events, finished = [], False  # Chưa biết người upload: chưa gửi sự kiện nào
+                    else:
+                        events = [event for event in channel.events if event['id'] > last_event_id]
+                        finished = channel.finished_at is not None
+                for event in events:
+                    last_event_id = event['id']
+                    yield event
+                    if event['event'] in TERMINAL_EVENTS:
+                        return
+                if events:
+                    continue
+                if finished:
+                    return  # Đã nhận hết sự kiện của upload đã kết thúc
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for channel in self._channels.values():
+                    channel.waiters.discard(waiter)
+
+
+# Khởi tạo service
+upload_progress = UploadProgressService()
@@ -0,0 +1,243 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import bindparam, text
+
+from ..db.database import get_session
+from app.core.config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Registry upload dùng chung giữa các worker (bảng upload_sessions + LISTEN/NOTIFY)
+UPLOAD_CANCEL_CHANNEL = "upload_cancel"
+UPLOAD_REGISTRY_POLL_SECONDS = float(os.getenv("UPLOAD_REGISTRY_POLL_SECONDS", "2"))   # Độ trễ hủy tối đa khi mất NOTIFY
+UPLOAD_REGISTRY_STALE_HOURS = int(os.getenv("UPLOAD_REGISTRY_STALE_HOURS", "24"))      # Xóa upload treo quá lâu
+UPLOAD_REGISTRY_CLEANUP_SECONDS = 600
+
+# Trạng thái còn xử lý được (chưa hủy)
+ACTIVE_UPLOAD_STATUSES = ('uploading', 'processing', 'queued')
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    data = dict(row._mapping)
+    for key, value in data.items():
+        if isinstance(value, UUID):
+            data[key] = str(value)
+        elif isinstance(value, datetime):
+            data[key] = value.isoformat()
+    return data
+
+
+class UploadRegistry:
+    """Danh sách upload đang diễn ra, lưu trong bảng upload_sessions.
+
+    Mỗi process giữ bản sao cục bộ của các upload nó đang xử lý để thread OCR kiểm tra
+    hủy mà không cần truy vấn DB. Khi một worker hủy upload, trạng thái được ghi vào DB
+    và phát NOTIFY upload_cancel; worker đang OCR nhận thông báo qua LISTEN và bỏ upload
+    khỏi bản sao cục bộ. Nếu mất kết nối LISTEN, vòng quét mỗi UPLOAD_REGISTRY_POLL_SECONDS
+    bảo đảm việc hủy vẫn có hiệu lực trong thời gian giới hạn.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._local: Dict[str, Dict[str, Any]] = {}
+        self._listener = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._last_cleanup = 0.0
+        self._stats = {'cancel_notifications': 0, 'cancel_polled': 0, 'listener_reconnects': 0}
+
+    # ---- TRA CỨU CỤC BỘ (gọi được từ thread OCR) ----
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Thông tin upload nếu còn đang xử lý trong process này, None nếu đã hủy / kết thúc"""
+        with self._lock:
+            info = self._local.get(upload_id)
+            return dict(info) if info is not None else None
+
+    def _drop_local(self, upload_id: str) -> bool:
+        with self._lock:
+            return self._local.pop(upload_id, None) is not None
+
+    def forget(self, upload_id: str) -> None:
+        """Ngừng theo dõi upload trong process này (upload được giao cho worker khác, vd. job nền)"""
+        self._drop_local(upload_id)
+
+    # ---- DB ----
+    async def register(self, upload_id: str, info: Dict[str, Any], user_id: Optional[str] = None) -> None:
+        """Đăng ký hoặc cập nhật upload (status, storage_path, file_id) trong DB và bản sao cục bộ"""
+        with self._lock:
+            merged = {**self._local.get(upload_id, {}), **info}
+            self._local[upload_id] = merged
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    INSERT INTO upload_sessions (upload_id, user_id, status, file_id, storage_path, worker_id)
+                    VALUES (:upload_id, :user_id, :status, :file_id, :storage_path, :worker_id)
+                    ON CONFLICT (upload_id) DO UPDATE SET
+                        user_id = COALESCE(EXCLUDED.user_id, upload_sessions.user_id),
+                        status = EXCLUDED.status,
+                        file_id = COALESCE(EXCLUDED.file_id, upload_sessions.file_id),
+                        storage_path = COALESCE(EXCLUDED.storage_path, upload_sessions.storage_path),
+                        worker_id = EXCLUDED.worker_id,
+                        updated_at = NOW()
+                    -- Không ghi đè trạng thái hủy (trừ khi upload_id được dùng lại cho upload mới)
+                    WHERE upload_sessions.status <> 'cancelled' OR EXCLUDED.status = 'uploading'
+                    RETURNING status
+                """), {
+                    "upload_id": upload_id,
+                    "user_id": user_id,
+                    "status": merged.get("status", "uploading"),
+                    "file_id": merged.get("file_id"),
+                    "storage_path": merged.get("storage_path"),
+                    "worker_id": self.worker_id
+                })
+                registered = result.fetchone() is not None
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        if not registered:
+            # Upload đã bị hủy ở worker khác trong lúc đang lưu file
+            self._drop_local(upload_id)
+
+    async def lookup(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        async with get_session() as session:
+            result = await session.execute(
+                text("SELECT * FROM upload_sessions WHERE upload_id = :upload_id"), {"upload_id": upload_id}
+            )
+            row = result.fetchone()
+            return _row_to_dict(row) if row else None
+
+    async def adopt(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Nhận theo dõi một upload được đăng ký ở worker khác (vd. job OCR chạy nền).
+
+        Trả về bản ghi trong DB (kể cả khi đã hủy) hoặc None nếu không tồn tại.
+        """
+        row = await self.lookup(upload_id)
+        if row and row["status"] in ACTIVE_UPLOAD_STATUSES:
+            with self._lock:
+                self._local[upload_id] = {
+                    "status": row["status"], "file_id": row.get("file_id"), "storage_path": row.get("storage_path")
+                }
+        return row
+
+    async def cancel(self, upload_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Đánh dấu upload bị hủy và báo cho mọi worker. Trả về bản ghi upload hoặc None nếu không còn hoạt động.
+
+        Có user_id thì chỉ hủy upload của người dùng đó.
+        """
+        async with get_session() as session:
+            try:
+                result = await session.execute(text("""
+                    UPDATE upload_sessions
+                    SET status = 'cancelled', updated_at = NOW()
+                    WHERE upload_id = :upload_id AND status IN :statuses
+                      AND (CAST(:user_id AS UUID) IS NULL OR user_id = CAST(:user_id AS UUID))
+                    RETURNING *
+                """).bindparams(bindparam("statuses", expanding=True)),
+                    {"upload_id": upload_id, "statuses": list(ACTIVE_UPLOAD_STATUSES), "user_id": user_id})
+                row = result.fetchone()
+                if row:
+                    # NOTIFY chỉ được gửi khi transaction commit
+                    await session.execute(text("SELECT pg_notify(:channel, :upload_id)"),
+                                          {"channel": UPLOAD_CANCEL_CHANNEL, "upload_id": upload_id})
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        if not row:
+            # Không hủy được (đã xong hoặc thuộc người khác): upload vẫn tiếp tục ở process này
+            return None
+        self._drop_local(upload_id)
+        return _row_to_dict(row)
+
+    async def finish(self, upload_id: str) -> None:
+        """Xóa upload đã xử lý xong khỏi registry"""
+        self._drop_local(upload_id)
+        async with get_session() as session:
+            try:
+                await session.execute(text("DELETE FROM upload_sessions WHERE upload_id = :upload_id"), {"upload_id": upload_id})
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    # ---- NHẬN THÔNG BÁO HỦY ----
+    def _on_cancel_notification(self, connection, pid, channel, payload) -> None:
+        if self._drop_local(payload):
+            self._stats['cancel_notifications'] += 1
+            logger.info(f"Upload {payload} bị hủy (thông báo từ worker khác)")
+
+    async def _connect_listener(self) -> None:
+        import asyncpg
+        dsn = DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        self._listener = await asyncpg.connect(dsn)
+        await self._listener.add_listener(UPLOAD_CANCEL_CHANNEL, self._on_cancel_notification)
+
+    async def _sync_cancelled(self) -> None:
+        """Quét DB các upload cục bộ đã bị hủy (phòng trường hợp lỡ NOTIFY) và dọn upload treo"""
+        with self._lock:
+            upload_ids: List[str] = list(self._local)
+        async with get_session() as session:
+            if upload_ids:
+                result = await session.execute(text("""
+                    SELECT upload_id FROM upload_sessions
+                    WHERE upload_id IN :upload_ids AND status = 'cancelled'
+                """).bindparams(bindparam("upload_ids", expanding=True)), {"upload_ids": upload_ids})
+                for (upload_id,) in result.fetchall():
+                    if self._drop_local(upload_id):
+                        self._stats['cancel_polled'] += 1
+                        logger.info(f"Upload {upload_id} bị hủy (phát hiện khi quét registry)")
+            if time.monotonic() - self._last_cleanup > UPLOAD_REGISTRY_CLEANUP_SECONDS:
+                await session.execute(text("""
+                    DELETE FROM upload_sessions
+                    WHERE updated_at < NOW() - make_interval(hours => :hours)
+                """), {"hours": UPLOAD_REGISTRY_STALE_HOURS})
+                self._last_cleanup = time.monotonic()
+            await session.commit()
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                if self._listener is None or self._listener.is_closed():
+                    if self._listener is not None:
+                        self._stats['listener_reconnects'] += 1
+                    await self._connect_listener()
+            except Exception as e:
+                self._listener = None
+                logger.warning(f"Không thể LISTEN {UPLOAD_CANCEL_CHANNEL}, chỉ dùng quét định kỳ: {e}")
+            try:
+                await self._sync_cancelled()
+            except Exception as e:
+                logger.warning(f"Lỗi khi quét registry upload: {e}")
+            await asyncio.sleep(UPLOAD_REGISTRY_POLL_SECONDS)
+
+    async def start(self) -> None:
+        """Bắt đầu nhận thông báo hủy (gọi khi ứng dụng start)"""
+        if self._poll_task is None:
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            local_uploads = len(self._local)
+        return {**self._stats, 'local_uploads': local_uploads, 'listening': bool(self._listener and not self._listener.is_closed())}
+
+
+# Khởi tạo service
+upload_registry = UploadRegistry()
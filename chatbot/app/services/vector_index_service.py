@@ -0,0 +1,514 @@
+import os
+import re
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from ..db.database import get_session
+from app.services.embedding_service import create_embedder
+
+try:
+    import fcntl  # Khóa file giữa các worker (không có trên Windows)
+except ImportError:
+    fcntl = None
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình vector index cục bộ cho chunk tài liệu
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "true").lower() == "true"
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32").lower()          # float32 | int8 (nhỏ hơn 4 lần)
+VECTOR_SEARCH_BLOCK_ROWS = int(os.getenv("VECTOR_SEARCH_BLOCK_ROWS", "65536"))    # Số dòng mỗi lần nhân ma trận
+VECTOR_INDEX_HNSW_ENABLED = os.getenv("VECTOR_INDEX_HNSW_ENABLED", "false").lower() == "true"
+VECTOR_INDEX_HNSW_MIN_ROWS = int(os.getenv("VECTOR_INDEX_HNSW_MIN_ROWS", "50000"))
+VECTOR_INDEX_HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "16"))
+VECTOR_INDEX_HNSW_EF = int(os.getenv("VECTOR_INDEX_HNSW_EF", "64"))
+VECTOR_INDEX_COMPACT_RATIO = 0.25   # Gom lại file khi số dòng đã xóa vượt tỷ lệ này
+_INITIAL_CAPACITY = 1024
+_MANIFEST_FORMAT = 1
+
+
+class VectorIndex:
+    """Ma trận embedding lưu trên đĩa (np.memmap), tìm kiếm bằng tích vô hướng theo khối.
+
+    - Vector đã chuẩn hóa L2, lưu float32 hoặc int8 (kèm hệ số scale từng dòng).
+    - Mỗi file chiếm một hoặc nhiều đoạn dòng liên tiếp; xóa file chỉ đánh dấu dòng đã chết,
+      khi số dòng chết vượt VECTOR_INDEX_COMPACT_RATIO thì ghi lại sang thế hệ (generation) file mới.
+    - manifest.json (ghi nguyên tử) giữ số dòng, dung lượng và các đoạn dòng của từng file. Các worker
+      trên cùng máy dùng chung thư mục: ghi được khóa bằng flock, đọc tự nạp lại khi manifest đổi.
+    - Tìm trong một số file được chọn chỉ duyệt các dòng của các file đó (luôn tìm chính xác). HNSW chỉ dùng
+      khi tìm trên toàn bộ index lớn (file_ids=None, >= VECTOR_INDEX_HNSW_MIN_ROWS dòng) nếu bật và đã cài hnswlib;
+      chat luôn giới hạn theo file nên không đi qua HNSW.
+    """
+
+    def __init__(self, directory: Path, dim: int, dtype: str = VECTOR_INDEX_DTYPE):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"VECTOR_INDEX_DTYPE không hợp lệ: {dtype}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._manifest: Dict[str, Any] = {}
+        self._manifest_key: Optional[Tuple[int, int]] = None  # (inode, mtime) của manifest đã nạp
+        self._arrays: Dict[str, Any] = {}
+        self._ranges: Optional[Tuple[Any, Any, List[str]]] = None  # (start, end, file_id) sắp theo start
+        self._hnsw = None
+        self._hnsw_key: Optional[Tuple[int, int]] = None  # (generation, số dòng đã thêm vào đồ thị)
+        self._hnsw_unavailable = False
+        self._stats = {'searches': 0, 'rows_scanned': 0, 'hnsw_searches': 0, 'compactions': 0}
+
+    # ---- FILE TRÊN ĐĨA ----
+    @property
+    def _manifest_path(self) -> Path:
+        return self.directory / "manifest.json"
+
+    def _array_specs(self, generation: int) -> Dict[str, Tuple[Path, str, Tuple[int, ...]]]:
+        """Tên mảng -> (đường dẫn, dtype, kích thước mỗi dòng)"""
+        specs = {
+            "vectors": (self.directory / f"vectors-{generation}.{'i8' if self.dtype == 'int8' else 'f32'}",
+                        self.dtype, (self.dim,)),
+            "chunk_index": (self.directory / f"chunk_index-{generation}.i32", "int32", ()),
+            "alive": (self.directory / f"alive-{generation}.u8", "uint8", ()),
+        }
+        if self.dtype == "int8":
+            specs["scales"] = (self.directory / f"scales-{generation}.f32", "float32", ())
+        return specs
+
+    def _empty_manifest(self, generation: int = 0) -> Dict[str, Any]:
+        return {"format": _MANIFEST_FORMAT, "dim": self.dim, "dtype": self.dtype, "generation": generation,
+                "version": 0, "count": 0, "capacity": 0, "dead": 0, "files": {}}
+
+    def _open_arrays(self) -> None:
+        import numpy as np
+        self._arrays = {}
+        capacity = self._manifest["capacity"]
+        if capacity:
+            for name, (path, dtype, row_shape) in self._array_specs(self._manifest["generation"]).items():
+                self._arrays[name] = np.memmap(path, dtype=dtype, mode="r+", shape=(capacity, *row_shape))
+        self._ranges = None
+
+    def _stat_manifest(self) -> Optional[Tuple[int, int]]:
+        # os.replace luôn tạo inode mới, nên hai lần ghi liền nhau vẫn phân biệt được
+        try:
+            stat = self._manifest_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _refresh(self) -> None:
+        """Nạp lại manifest nếu worker khác vừa ghi"""
+        key = self._stat_manifest()
+        if key == self._manifest_key and self._manifest:
+            return
+        manifest = None
+        if key is not None:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if (manifest.get("format"), manifest.get("dim"), manifest.get("dtype")) != (_MANIFEST_FORMAT, self.dim, self.dtype):
+                logger.warning(f"Vector index {self.directory} khác cấu hình hiện tại, tạo lại index")
+                manifest = self._empty_manifest(manifest.get("generation", 0) + 1)
+        self._manifest = manifest or self._empty_manifest()
+        self._manifest_key = key
+        self._open_arrays()
+
+    def _save_manifest(self) -> None:
+        for array in self._arrays.values():
+            array.flush()
+        self._manifest["version"] += 1
+        tmp_path = self._manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+        self._manifest_key = self._stat_manifest()
+        self._ranges = None
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        with self._lock:
+            lock_file = open(self.directory / ".lock", "a+b")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _ensure_capacity(self, extra_rows: int) -> None:
+        needed = self._manifest["count"] + extra_rows
+        capacity = self._manifest["capacity"]
+        if needed <= capacity:
+            return
+        new_capacity = max(capacity * 2, needed, _INITIAL_CAPACITY)
+        import numpy as np
+        self._arrays = {}  # Bỏ memmap cũ trước khi mở rộng file
+        for path, dtype, row_shape in self._array_specs(self._manifest["generation"]).values():
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape, dtype=np.int64))
+            with open(path, "a+b") as f:
+                f.truncate(new_capacity * row_bytes)  # Phần mở rộng được điền 0 (alive = 0)
+        self._manifest["capacity"] = new_capacity
+        self._open_arrays()
+
+    # ---- GHI ----
+    def add(self, file_id: str, chunk_indexes: Sequence[int], vectors: "np.ndarray") -> int:
+        """Thêm các vector (đã chuẩn hóa) của file; trả về số dòng đã thêm"""
+        import numpy as np
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        count = len(vectors)
+        if count == 0:
+            return 0
+        with self._write_lock():
+            self._ensure_capacity(count)
+            start = self._manifest["count"]
+            end = start + count
+            if self.dtype == "int8":
+                scales = np.abs(vectors).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                self._arrays["vectors"][start:end] = np.round(vectors / scales[:, None]).astype(np.int8)
+                self._arrays["scales"][start:end] = scales
+            else:
+                self._arrays["vectors"][start:end] = vectors
+            self._arrays["chunk_index"][start:end] = np.asarray(chunk_indexes, dtype=np.int32)
+            self._arrays["alive"][start:end] = 1
+            self._manifest["files"].setdefault(file_id, []).append([start, count])
+            self._manifest["count"] = end
+            self._save_manifest()
+        return count
+
+    def delete(self, file_id: str) -> int:
+        """Đánh dấu xóa các dòng của file; trả về số dòng đã xóa"""
+        with self._write_lock():
+            ranges = self._manifest["files"].pop(file_id, None)
+            if not ranges:
+                return 0
+            removed = 0
+            for start, length in ranges:
+                self._arrays["alive"][start:start + length] = 0
+                removed += length
+            self._manifest["dead"] += removed
+            if self._manifest["dead"] > VECTOR_INDEX_COMPACT_RATIO * self._manifest["count"]:
+                self._compact()
+            self._save_manifest()
+        return removed
+
+    def _compact(self) -> None:
+        """Ghi các dòng còn sống sang thế hệ file mới (gọi khi đang giữ write lock)"""
+        old_generation = self._manifest["generation"]
+        old_arrays = self._arrays
+        old_files = self._manifest["files"]
+        alive_rows = self._manifest["count"] - self._manifest["dead"]
+        new_manifest = self._empty_manifest(old_generation + 1)
+        new_manifest["version"] = self._manifest["version"]
+        self._manifest = new_manifest
+        self._ensure_capacity(max(alive_rows, 1))
+        position = 0
+        # Giữ thứ tự thêm vào để các dòng của một file nằm liền nhau
+        for file_id, ranges in sorted(old_files.items(), key=lambda item: item[1][0][0]):
+            file_start = position
+            for start, length in ranges:
+                for name, array in self._arrays.items():
+                    array[position:position + length] = old_arrays[name][start:start + length]
+                position += length
+            new_manifest["files"][file_id] = [[file_start, position - file_start]]
+        new_manifest["count"] = position
+        del old_arrays
+        for path, _, _ in self._array_specs(old_generation).values():
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                pass  # Windows: file còn được mở ở worker khác
+        self._hnsw = None
+        self._stats['compactions'] += 1
+        logger.info(f"Đã gom vector index {self.directory}: {alive_rows} dòng còn lại")
+
+    # ---- ĐỌC ----
+    def has_file(self, file_id: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return file_id in self._manifest["files"]
+
+    def _row_owners(self) -> Tuple[Any, Any, List[str]]:
+        import numpy as np
+        if self._ranges is None:
+            items = sorted((start, length, file_id)
+                           for file_id, ranges in self._manifest["files"].items() for start, length in ranges)
+            starts = np.array([item[0] for item in items], dtype=np.int64)
+            ends = starts + np.array([item[1] for item in items], dtype=np.int64)
+            self._ranges = (starts, ends, [item[2] for item in items])
+        return self._ranges
+
+    def _dequantize(self, arrays: Dict[str, Any], rows: Any) -> "np.ndarray":
+        import numpy as np
+        block = np.asarray(arrays["vectors"][rows], dtype=np.float32)
+        if "scales" in arrays:
+            block *= np.asarray(arrays["scales"][rows], dtype=np.float32)[:, None]
+        return block
+
+    def search(self, queries: "np.ndarray", top_k: int,
+               file_ids: Optional[Sequence[str]] = None) -> List[List[Tuple[str, int, float]]]:
+        """Tìm top_k dòng gần nhất cho từng query (một hoặc nhiều vector), trả về [(file_id, chunk_index, score)].
+
+        Có file_ids thì duyệt tuần tự các dòng của các file đó; HNSW chỉ áp dụng khi file_ids là None.
+        """
+        import numpy as np
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._refresh()
+            # Giữ tham chiếu: worker khác mở rộng/gom index không làm hỏng lần tìm đang chạy
+            arrays, manifest, owners = self._arrays, self._manifest, self._row_owners()
+            count = manifest["count"]
+            if not arrays or count == 0 or top_k <= 0:
+                return [[] for _ in range(len(queries))]
+            self._stats['searches'] += 1
+            if file_ids is None and self._use_hnsw(count - manifest["dead"]):
+                rows, scores = self._hnsw_search(queries, top_k)
+                return self._to_results(rows, scores, arrays, owners)
+
+        if file_ids is not None:
+            segments = [(start, start + length) for file_id in dict.fromkeys(file_ids)
+                        for start, length in manifest["files"].get(file_id, [])]
+            if not segments:
+                return [[] for _ in range(len(queries))]
+            rows_all = np.concatenate([np.arange(start, end) for start, end in sorted(segments)])
+            blocks = ((rows_all[i:i + VECTOR_SEARCH_BLOCK_ROWS], False)
+                      for i in range(0, len(rows_all), VECTOR_SEARCH_BLOCK_ROWS))
+        else:
+            blocks = ((slice(start, min(start + VECTOR_SEARCH_BLOCK_ROWS, count)), True)
+                      for start in range(0, count, VECTOR_SEARCH_BLOCK_ROWS))
+
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        scanned = 0
+        for rows, check_alive in blocks:
+            block_rows = np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows
+            scores = self._dequantize(arrays, rows) @ queries.T  # (số dòng, số query)
+            if check_alive:
+                scores[np.asarray(arrays["alive"][rows]) == 0] = -np.inf
+            scanned += len(block_rows)
+            k = min(top_k, len(block_rows))
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=0).T], axis=1)
+            best_rows = np.concatenate([best_rows, block_rows[top].T], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        self._stats['rows_scanned'] += scanned
+        return self._to_results(best_rows, best_scores, arrays, owners)
+
+    @staticmethod
+    def _to_results(rows: "np.ndarray", scores: "np.ndarray", arrays: Dict[str, Any],
+                    owners: Tuple[Any, Any, List[str]]) -> List[List[Tuple[str, int, float]]]:
+        import numpy as np
+        starts, ends, file_ids = owners
+        results = []
+        for query_rows, query_scores in zip(rows, scores):
+            order = np.argsort(-query_scores, kind="stable")
+            matches = []
+            for row, score in zip(query_rows[order], query_scores[order]):
+                if not np.isfinite(score):
+                    continue
+                position = int(np.searchsorted(starts, row, side="right")) - 1
+                if position < 0 or row >= ends[position]:
+                    continue  # Dòng của file vừa bị xóa
+                matches.append((file_ids[position], int(arrays["chunk_index"][row]), float(score)))
+            results.append(matches)
+        return results
+
+    # ---- HNSW (TÙY CHỌN) ----
+    def _use_hnsw(self, alive_rows: int) -> bool:
+        if not VECTOR_INDEX_HNSW_ENABLED or self._hnsw_unavailable or alive_rows < VECTOR_INDEX_HNSW_MIN_ROWS:
+            return False
+        try:
+            import hnswlib  # noqa: F401
+        except ImportError:
+            logger.warning("VECTOR_INDEX_HNSW_ENABLED=true nhưng chưa cài hnswlib, dùng tìm kiếm tuần tự")
+            self._hnsw_unavailable = True
+            return False
+        return True
+
+    def _hnsw_search(self, queries: "np.ndarray", top_k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Tìm gần đúng trên đồ thị HNSW trong bộ nhớ; đồ thị được bổ sung dần theo các dòng mới"""
+        import hnswlib
+        import numpy as np
+        generation, count, capacity = self._manifest["generation"], self._manifest["count"], self._manifest["capacity"]
+        if self._hnsw is None or self._hnsw_key[0] != generation:
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self._hnsw.init_index(max_elements=capacity, ef_construction=200, M=VECTOR_INDEX_HNSW_M)
+            self._hnsw_key = (generation, 0)
+        added = self._hnsw_key[1]
+        if count > added:
+            if self._hnsw.get_max_elements() < capacity:
+                self._hnsw.resize_index(capacity)
+            for start in range(added, count, VECTOR_SEARCH_BLOCK_ROWS):
+                end = min(start + VECTOR_SEARCH_BLOCK_ROWS, count)
+                self._hnsw.add_items(self._dequantize(self._arrays, slice(start, end)), np.arange(start, end))
+            self._hnsw_key = (generation, count)
+        # Lấy dư để bù các dòng đã xóa (tối đa VECTOR_INDEX_COMPACT_RATIO trước khi gom)
+        fetch = min(count, top_k * 2 + 10)
+        self._hnsw.set_ef(max(VECTOR_INDEX_HNSW_EF, fetch))
+        labels, distances = self._hnsw.knn_query(queries, k=fetch)
+        scores = (1.0 - distances).astype(np.float32)
+        scores[np.asarray(self._arrays["alive"][labels.ravel()]).reshape(labels.shape) == 0] = -np.inf
+        self._stats['hnsw_searches'] += 1
+        return labels.astype(np.int64), scores
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            stats = dict(self._stats)
+            stats.update({
+                'rows': self._manifest["count"] - self._manifest["dead"],
+                'dead_rows': self._manifest["dead"],
+                'capacity': self._manifest["capacity"],
+                'files': len(self._manifest["files"]),
+                'dtype': self.dtype,
+                'dim': self.dim,
+                'hnsw': self._hnsw is not None,
+            })
+            return stats
+
+
+class VectorIndexService:
+    """Vector index cho file_chunks, cập nhật khi file được trích xuất / xóa.
+
+    Index là bộ đệm cục bộ trên từng máy, dựng lại được từ bảng file_chunks: file chưa có trong index
+    (trích xuất trước khi bật, dùng lại kết quả của file trùng, hoặc index bị xóa) được thêm khi tìm kiếm.
+    Lỗi của index chỉ được ghi log, không làm hỏng việc trích xuất hay xóa file.
+    """
+
+    def __init__(self, enabled: bool = VECTOR_INDEX_ENABLED, directory: str = VECTOR_INDEX_DIR):
+        self.enabled = enabled
+        self.directory = Path(directory)
+        self.embedder = create_embedder() if enabled else None
+        self._index: Optional[VectorIndex] = None
+        self._index_lock = threading.Lock()
+        self._stats = {'chunks_indexed': 0, 'files_deleted': 0, 'searches': 0, 'errors': 0}
+
+    def _get_index(self, dim: Optional[int] = None) -> Optional[VectorIndex]:
+        """Mỗi embedder có thư mục riêng; số chiều của embedder LangChain chỉ biết sau lần embed đầu"""
+        with self._index_lock:
+            if self._index is None:
+                directory = self.directory / re.sub(r"[^A-Za-z0-9_.-]+", "_", self.embedder.name)
+                dim = dim or getattr(self.embedder, "dim", None)
+                if dim is None and (directory / "manifest.json").exists():
+                    with open(directory / "manifest.json", "r", encoding="utf-8") as f:
+                        dim = json.load(f).get("dim")
+                if dim is None:
+                    return None
+                self._index = VectorIndex(directory, dim)
+            return self._index
+
+    @staticmethod
+    def _chunk_text(chunk: Dict[str, Any]) -> str:
+        heading = chunk.get("heading")
+        return f"{heading}\n{chunk['text']}" if heading else chunk["text"]
+
+    def _add_chunks_sync(self, file_id: str, chunks: List[Dict[str, Any]], replace: bool) -> int:
+        vectors = self.embedder.embed_documents([self._chunk_text(chunk) for chunk in chunks])
+        index = self._get_index(vectors.shape[1])
+        if replace:
+            index.delete(file_id)
+        added = index.add(file_id, [chunk["chunk_index"] for chunk in chunks], vectors)
+        self._stats['chunks_indexed'] += added
+        return added
+
+    async def add_chunks(self, file_id: str, chunks: List[Dict[str, Any]], replace: bool = False) -> int:
+        """Embed và thêm chunk của file vào index; trả về số chunk đã thêm"""
+        if not self.enabled or not chunks:
+            return 0
+        try:
+            return await run_in_threadpool(self._add_chunks_sync, str(file_id), chunks, replace)
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.warning(f"Lỗi khi thêm chunk của file {file_id} vào vector index: {e}")
+            return 0
+
+    async def delete_file(self, file_id: str) -> int:
+        """Xóa các vector của file khỏi index"""
+        if not self.enabled:
+            return 0
+        try:
+            index = self._get_index()
+            if index is None:
+                return 0
+            removed = await run_in_threadpool(index.delete, str(file_id))
+            if removed:
+                self._stats['files_deleted'] += 1
+            return removed
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.warning(f"Lỗi khi xóa file {file_id} khỏi vector index: {e}")
+            return 0
+
+    async def index_file(self, file_id: str) -> int:
+        """Index lại toàn bộ chunk của file từ bảng file_chunks"""
+        if not self.enabled:
+            return 0
+        try:
+            async with get_session() as session:
+                result = await session.execute(text("""
+                    SELECT chunk_index, heading, text FROM file_chunks
+                    WHERE file_id = :file_id ORDER BY chunk_index
+                """), {"file_id": file_id})
+                chunks = [dict(row._mapping) for row in result.fetchall()]
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.warning(f"Lỗi khi đọc chunk của file {file_id} để index: {e}")
+            return 0
+        return await self.add_chunks(file_id, chunks, replace=True)
+
+    async def ensure_indexed(self, file_ids: List[str]) -> int:
+        """Thêm vào index các file đã có chunk nhưng chưa được index trên máy này"""
+        index = self._get_index()
+        file_ids = [str(file_id) for file_id in file_ids]
+        missing = [file_id for file_id in file_ids if index is None or not index.has_file(file_id)]
+        indexed = 0
+        for file_id in missing:
+            indexed += await self.index_file(file_id)
+        return indexed
+
+    def _search_sync(self, query: str, top_k: int, file_ids: Optional[List[str]]) -> List[Dict[str, Any]]:
+        vector = self.embedder.embed_query(query)
+        index = self._get_index(vector.shape[0])
+        return [{"file_id": file_id, "chunk_index": chunk_index, "score": score}
+                for file_id, chunk_index, score in index.search(vector, top_k, file_ids)[0]]
+
+    async def search(self, query: str, top_k: int = 10, file_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Top_k chunk gần nghĩa nhất với câu hỏi, giới hạn trong file_ids nếu có.
+
+        Trả về [{"file_id", "chunk_index", "score"}] theo score giảm dần (cosine).
+        """
+        if not self.enabled or not query.strip():
+            return []
+        if file_ids is not None:
+            file_ids = [str(file_id) for file_id in file_ids]
+            await self.ensure_indexed(file_ids)
+        self._stats['searches'] += 1
+        return await run_in_threadpool(self._search_sync, query, top_k, file_ids)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        if self.enabled:
+            stats['embedder'] = self.embedder.name
+            index = self._get_index()
+            if index is not None:
+                stats['index'] = index.get_stats()
+        return stats
+
+
+# Khởi tạo service
+vector_index_service = VectorIndexService()
@@ -10,3 +10,13 @@ CREATE INDEX idx_files_upload_timestamp ON files(upload_timestamp DESC);
 CREATE INDEX idx_files_uploaded_by_user_id ON files(uploaded_by_user_id);
 --Index trên các bảng Group liên quan:
 CREATE INDEX idx_user_group_user_id ON user_groups(user_id); 
+--Index cho hàng đợi job OCR chạy nền:
+CREATE INDEX idx_ingest_jobs_status_created_at ON ingest_jobs(status, created_at);
+CREATE INDEX idx_ingest_jobs_file_id ON ingest_jobs(file_id);
+--Index cho registry upload (dọn upload treo, tra upload bị hủy):
+CREATE INDEX idx_upload_sessions_status_updated_at ON upload_sessions(status, updated_at);
+--Index cho dùng lại kết quả trích xuất của file trùng nội dung:
+CREATE INDEX idx_files_content_hash ON files(content_hash) WHERE content_hash IS NOT NULL;
+--Index cho dọn phiên upload nhiều phần quá hạn:
+CREATE INDEX idx_resumable_uploads_expires_at ON resumable_uploads(expires_at);
+--Index tìm kiếm toàn văn (search_vector) và trigram tên file: xem Tekjoy_Migration_FullTextSearch.sql
@@ -78,13 +78,18 @@ CREATE TABLE files (
     ai_extracted_data JSONB,
     download_link VARCHAR(255),
     char_count INTEGER,
-    word_count INTEGER
+    word_count INTEGER,
+    content_hash CHAR(64), -- SHA-256 nội dung file, dùng lại kết quả trích xuất của file trùng nội dung
+    search_vector tsvector -- Tìm kiếm toàn văn, trigger trong Tekjoy_Migration_FullTextSearch.sql cập nhật
 );
 
 -- Function và Trigger để tự động cập nhật `last_modified_timestamp`
 CREATE OR REPLACE FUNCTION update_files_last_modified_timestamp()
 RETURNS TRIGGER AS $$
 BEGIN
+    IF current_setting('tekjoy.skip_modified_timestamp', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
     NEW.last_modified_timestamp = NOW();
     RETURN NEW;
 END;
@@ -221,4 +226,148 @@ CREATE TABLE system_config (
     description TEXT,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_by_user_id UUID REFERENCES users(id) ON DELETE SET NULL
-);
\ No newline at end of file
+);
+
+---
+-- TABLE: INGEST JOBS
+---
+
+-- Job OCR chạy nền cho file upload với async_processing=true
+CREATE TABLE ingest_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    upload_id VARCHAR(255),
+    status VARCHAR(50) NOT NULL DEFAULT 'queued', -- queued | processing | completed | failed | cancelled
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error_message TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+
+---
+-- TABLE: FILE PAGES
+---
+
+-- Text trích xuất theo từng trang, ghi dần trong lúc OCR; files.extracted_text được ghép từ bảng này
+CREATE TABLE file_pages (
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    text TEXT,
+    char_count INTEGER,
+    word_count INTEGER,
+    has_images BOOLEAN DEFAULT FALSE,
+    success BOOLEAN DEFAULT TRUE,
+    error_message TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_id, page_number)
+);
+
+
+---
+-- TABLE: FILE PAGE WORDS
+---
+
+-- Hộp bao + độ tin cậy OCR của từng trang, đóng gói nhị phân (header 'OWB1' + int16[n,4] x,y,w,h + uint8[n] confidence 0-100 + uint16[n] độ dài text)
+-- Text của từng từ cắt lại từ file_pages.text bắt đầu tại text_offset
+CREATE TABLE file_page_words (
+    file_id UUID NOT NULL,
+    page_number INTEGER NOT NULL,
+    word_count INTEGER NOT NULL,
+    avg_confidence SMALLINT,
+    text_offset INTEGER NOT NULL DEFAULT 0,
+    boxes BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_id, page_number),
+    FOREIGN KEY (file_id, page_number) REFERENCES file_pages(file_id, page_number) ON DELETE CASCADE
+);
+
+
+---
+-- TABLE: FILE CHUNKS
+---
+
+-- Chunk text dùng khi chat (chỉ đưa các chunk liên quan vào prompt), tạo trong lúc trích xuất
+-- Chunk có overlap_tokens token đầu lặp lại từ cuối chunk trước
+CREATE TABLE file_chunks (
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    page_start INTEGER,
+    page_end INTEGER,
+    heading TEXT,
+    text TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    overlap_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_id, chunk_index)
+);
+
+
+---
+-- TABLE: UPLOAD SESSIONS
+---
+
+-- Upload đang diễn ra, dùng chung giữa các worker (hủy upload được báo qua NOTIFY upload_cancel)
+CREATE TABLE upload_sessions (
+    upload_id VARCHAR(255) PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(50) NOT NULL DEFAULT 'uploading', -- uploading | processing | queued | cancelled
+    file_id UUID,
+    storage_path TEXT,
+    worker_id VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+
+---
+-- TABLE: INGEST INFLIGHT
+---
+
+-- Nội dung file đang được trích xuất: upload cùng nội dung ở worker khác chờ rồi dùng lại kết quả thay vì OCR lại
+-- Worker cập nhật heartbeat_at trong lúc trích xuất; dòng không còn heartbeat (worker chết) được worker khác lấy lại
+CREATE TABLE ingest_inflight (
+    content_hash CHAR(64) PRIMARY KEY,
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    worker_id VARCHAR(255),
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+
+---
+-- TABLE: RESUMABLE UPLOADS
+---
+
+-- Phiên upload nhiều phần: mỗi phần được ghi vào file tạm uploads/.resumable/{id}/{part_number}, ghép lại khi hoàn tất
+CREATE TABLE resumable_uploads (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    upload_id VARCHAR(255),
+    original_file_name VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(255),
+    file_size_bytes BIGINT NOT NULL,
+    part_size INTEGER NOT NULL,
+    total_parts INTEGER NOT NULL,
+    content_sha256 CHAR(64),
+    file_metadata JSONB NOT NULL DEFAULT '{}'::jsonb, -- folder_id, is_template, project_code, project_name, document_type
+    status VARCHAR(50) NOT NULL DEFAULT 'uploading', -- uploading | completing | completed | aborted
+    file_id UUID REFERENCES files(id) ON DELETE SET NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Các phần đã nhận đủ của một phiên (phần n gồm các byte [(n-1)*part_size, n*part_size))
+CREATE TABLE resumable_upload_parts (
+    session_id UUID NOT NULL REFERENCES resumable_uploads(id) ON DELETE CASCADE,
+    part_number INTEGER NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (session_id, part_number)
+);
@@ -0,0 +1,21 @@
+-- Dùng lại kết quả trích xuất của file trùng nội dung (cột content_hash = SHA-256 nội dung file, bảng ingest_inflight)
+-- cho database đã tạo trước đó
+--
+-- Chạy bằng psql ở chế độ autocommit (mặc định), KHÔNG bọc trong BEGIN/COMMIT: CREATE INDEX CONCURRENTLY không chạy được trong transaction.
+--     psql -h <host> -U <user> -d Tekjoy -f sql_onProduction/Tekjoy_Migration_ContentHash.sql
+-- Chạy lại nhiều lần không lỗi. File đã upload trước đó không có hash nên không được dùng lại.
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+--Index cho dùng lại kết quả trích xuất của file trùng nội dung:
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_files_content_hash ON files(content_hash) WHERE content_hash IS NOT NULL;
+
+-- Nội dung file đang được trích xuất: upload cùng nội dung ở worker khác chờ rồi dùng lại kết quả thay vì OCR lại
+-- Worker cập nhật heartbeat_at trong lúc trích xuất; dòng không còn heartbeat (worker chết) được worker khác lấy lại
+CREATE TABLE IF NOT EXISTS ingest_inflight (
+    content_hash CHAR(64) PRIMARY KEY,
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    worker_id VARCHAR(255),
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
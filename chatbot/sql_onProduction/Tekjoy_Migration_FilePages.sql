@@ -0,0 +1,65 @@
+-- Bảng text theo từng trang (file_pages) và các bảng phụ thuộc cho database đã tạo trước đó
+--
+-- Database mới tạo bằng Tekjoy_CreateTable.sql đã có sẵn các bảng này; chạy lại nhiều lần không lỗi.
+--     psql -h <host> -U <user> -d Tekjoy -f sql_onProduction/Tekjoy_Migration_FilePages.sql
+
+BEGIN;
+
+---
+-- TABLE: FILE PAGES
+---
+
+-- Text trích xuất theo từng trang, ghi dần trong lúc OCR; files.extracted_text được ghép từ bảng này
+CREATE TABLE IF NOT EXISTS file_pages (
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    text TEXT,
+    char_count INTEGER,
+    word_count INTEGER,
+    has_images BOOLEAN DEFAULT FALSE,
+    success BOOLEAN DEFAULT TRUE,
+    error_message TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_id, page_number)
+);
+
+
+---
+-- TABLE: FILE PAGE WORDS
+---
+
+-- Hộp bao + độ tin cậy OCR của từng trang, đóng gói nhị phân (header 'OWB1' + int16[n,4] x,y,w,h + uint8[n] confidence 0-100 + uint16[n] độ dài text)
+-- Text của từng từ cắt lại từ file_pages.text bắt đầu tại text_offset
+CREATE TABLE IF NOT EXISTS file_page_words (
+    file_id UUID NOT NULL,
+    page_number INTEGER NOT NULL,
+    word_count INTEGER NOT NULL,
+    avg_confidence SMALLINT,
+    text_offset INTEGER NOT NULL DEFAULT 0,
+    boxes BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_id, page_number),
+    FOREIGN KEY (file_id, page_number) REFERENCES file_pages(file_id, page_number) ON DELETE CASCADE
+);
+
+
+---
+-- TABLE: FILE CHUNKS
+---
+
+-- Chunk text dùng khi chat (chỉ đưa các chunk liên quan vào prompt), tạo trong lúc trích xuất
+-- Chunk có overlap_tokens token đầu lặp lại từ cuối chunk trước
+CREATE TABLE IF NOT EXISTS file_chunks (
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    page_start INTEGER,
+    page_end INTEGER,
+    heading TEXT,
+    text TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    overlap_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_id, chunk_index)
+);
+
+COMMIT;
@@ -0,0 +1,100 @@
+-- Tìm kiếm toàn văn không phân biệt dấu cho files (GET /api/file/files/search/scr)
+--
+-- Chạy bằng psql ở chế độ autocommit (mặc định), KHÔNG bọc trong BEGIN/COMMIT:
+-- CALL backfill_files_search_vector tự COMMIT sau mỗi batch và CREATE INDEX CONCURRENTLY không chạy được trong transaction.
+--     psql -h <host> -U <user> -d Tekjoy -f sql_onProduction/Tekjoy_Migration_FullTextSearch.sql
+-- Chạy lại nhiều lần không lỗi (chỉ cập nhật các file chưa có search_vector).
+--
+-- search_vector là cột thường được trigger cập nhật (thay vì GENERATED ... STORED) để cập nhật dữ liệu cũ theo batch:
+-- thêm cột GENERATED sẽ ghi lại toàn bộ bảng files trong một transaction và khóa bảng suốt thời gian đó.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Cấu hình text search: bỏ dấu (kể cả đ -> d) rồi chuyển chữ thường, không stemming
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'tekjoy_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION tekjoy_unaccent (COPY = simple);
+        ALTER TEXT SEARCH CONFIGURATION tekjoy_unaccent
+            ALTER MAPPING FOR hword, hword_part, word, numword, numhword, hword_numpart WITH unaccent, simple;
+    END IF;
+END $$;
+
+-- unaccent() không IMMUTABLE nên không dùng trực tiếp trong index được
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS
+$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+-- Tên file (trọng số A) + nội dung (trọng số B)
+CREATE OR REPLACE FUNCTION files_search_document(file_name TEXT, content TEXT) RETURNS tsvector
+LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE AS $$
+BEGIN
+    RETURN setweight(to_tsvector('tekjoy_unaccent', coalesce(file_name, '')), 'A') ||
+           setweight(to_tsvector('tekjoy_unaccent', left(coalesce(content, ''), 1000000)), 'B');
+EXCEPTION WHEN program_limit_exceeded THEN
+    -- tsvector tối đa 1MB: văn bản quá nhiều từ khác nhau thì chỉ index phần đầu
+    RETURN setweight(to_tsvector('tekjoy_unaccent', coalesce(file_name, '')), 'A') ||
+           setweight(to_tsvector('tekjoy_unaccent', left(coalesce(content, ''), 100000)), 'B');
+END;
+$$;
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION update_files_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector = files_search_document(NEW.original_file_name, NEW.extracted_text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS files_search_vector ON files;
+CREATE TRIGGER files_search_vector
+BEFORE INSERT OR UPDATE OF original_file_name, extracted_text ON files
+FOR EACH ROW
+EXECUTE FUNCTION update_files_search_vector();
+
+-- Backfill không được làm thay đổi last_modified_timestamp của file
+CREATE OR REPLACE FUNCTION update_files_last_modified_timestamp()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('tekjoy.skip_modified_timestamp', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    NEW.last_modified_timestamp = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cập nhật search_vector cho file cũ, mỗi batch một transaction (không khóa lâu, dừng giữa chừng vẫn giữ phần đã xong)
+CREATE OR REPLACE PROCEDURE backfill_files_search_vector(batch_size INTEGER DEFAULT 200)
+LANGUAGE plpgsql AS $$
+DECLARE
+    updated INTEGER;
+    total INTEGER := 0;
+BEGIN
+    LOOP
+        PERFORM set_config('tekjoy.skip_modified_timestamp', 'on', true);
+        UPDATE files f
+        SET search_vector = files_search_document(f.original_file_name, f.extracted_text)
+        WHERE f.id IN (
+            SELECT id FROM files
+            WHERE search_vector IS NULL
+            LIMIT batch_size
+            FOR UPDATE SKIP LOCKED
+        );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+        total := total + updated;
+        RAISE NOTICE 'search_vector: đã cập nhật % file', total;
+        COMMIT;
+    END LOOP;
+END;
+$$;
+
+CALL backfill_files_search_vector(200);
+
+-- Index cho tìm theo nội dung (@@) và tìm chuỗi con trong tên file (LIKE '%...%')
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_files_search_vector ON files USING gin (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_files_name_trgm ON files USING gin (lower(f_unaccent(original_file_name)) gin_trgm_ops);
@@ -0,0 +1,87 @@
+-- Bảng job OCR chạy nền, registry upload và upload nhiều phần cho database đã tạo trước đó
+--
+-- Database mới tạo bằng Tekjoy_CreateTable.sql + TekJoy_CreateIndex.sql đã có sẵn; chạy lại nhiều lần không lỗi.
+--     psql -h <host> -U <user> -d Tekjoy -f sql_onProduction/Tekjoy_Migration_UploadTables.sql
+
+BEGIN;
+
+---
+-- TABLE: INGEST JOBS
+---
+
+-- Job OCR chạy nền cho file upload với async_processing=true
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    upload_id VARCHAR(255),
+    status VARCHAR(50) NOT NULL DEFAULT 'queued', -- queued | processing | completed | failed | cancelled
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error_message TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+
+---
+-- TABLE: UPLOAD SESSIONS
+---
+
+-- Upload đang diễn ra, dùng chung giữa các worker (hủy upload được báo qua NOTIFY upload_cancel)
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    upload_id VARCHAR(255) PRIMARY KEY,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(50) NOT NULL DEFAULT 'uploading', -- uploading | processing | queued | cancelled
+    file_id UUID,
+    storage_path TEXT,
+    worker_id VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+
+---
+-- TABLE: RESUMABLE UPLOADS
+---
+
+-- Phiên upload nhiều phần: mỗi phần được ghi vào file tạm uploads/.resumable/{id}/{part_number}, ghép lại khi hoàn tất
+CREATE TABLE IF NOT EXISTS resumable_uploads (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    upload_id VARCHAR(255),
+    original_file_name VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(255),
+    file_size_bytes BIGINT NOT NULL,
+    part_size INTEGER NOT NULL,
+    total_parts INTEGER NOT NULL,
+    content_sha256 CHAR(64),
+    file_metadata JSONB NOT NULL DEFAULT '{}'::jsonb, -- folder_id, is_template, project_code, project_name, document_type
+    status VARCHAR(50) NOT NULL DEFAULT 'uploading', -- uploading | completing | completed | aborted
+    file_id UUID REFERENCES files(id) ON DELETE SET NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Các phần đã nhận đủ của một phiên (phần n gồm các byte [(n-1)*part_size, n*part_size))
+CREATE TABLE IF NOT EXISTS resumable_upload_parts (
+    session_id UUID NOT NULL REFERENCES resumable_uploads(id) ON DELETE CASCADE,
+    part_number INTEGER NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (session_id, part_number)
+);
+
+--Index cho hàng đợi job OCR chạy nền:
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status_created_at ON ingest_jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_file_id ON ingest_jobs(file_id);
+--Index cho registry upload (dọn upload treo, tra upload bị hủy):
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_status_updated_at ON upload_sessions(status, updated_at);
+--Index cho dọn phiên upload nhiều phần quá hạn:
+CREATE INDEX IF NOT EXISTS idx_resumable_uploads_expires_at ON resumable_uploads(expires_at);
+
+COMMIT;
@@ -0,0 +1,72 @@
+import os
+
+# Cấu hình cho kiểm thử: ocr_service cần URL OCR khi import (không gọi tới server), không ghi OCR cache ra đĩa
+os.environ.setdefault("PADDLE_OCR_API_URL", "http://ocr.test/ocr-fullV2")
+os.environ.setdefault("OCR_CACHE_ENABLED", "false")
+
+
+import pytest
+
+
+class FakeRow(tuple):
+    """Row kết quả SQL giả: truy cập theo vị trí, theo tên cột và qua _mapping"""
+
+    def __new__(cls, **columns):
+        row = super().__new__(cls, columns.values())
+        row._mapping = columns
+        return row
+
+    def __getattr__(self, name):
+        try:
+            return self._mapping[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = list(rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def scalar(self):
+        return self._rows[0][0] if self._rows else None
+
+
+class FakeSession:
+    """AsyncSession giả: ghi lại câu SQL đã chạy, trả kết quả theo thứ tự trong results (mặc định không có dòng)"""
+
+    def __init__(self, results=None):
+        self.results = list(results or [])
+        self.executed = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, params=None):
+        self.executed.append((" ".join(str(statement).split()), params or {}))
+        result = self.results.pop(0) if self.results else []
+        if isinstance(result, Exception):
+            raise result
+        return FakeResult(result)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def fake_session():
+    """Tạo FakeSession; dùng với monkeypatch.setattr(module, "get_session", lambda: session)"""
+    return FakeSession
@@ -0,0 +1,63 @@
+import pytest
+
+from app.services import context_packer_service
+from app.services.context_packer_service import ContextPacker, TokenCounter
+
+
+@pytest.fixture(autouse=True)
+def no_tokenizer(monkeypatch):
+    # Đếm token bằng ước lượng để không phụ thuộc tiktoken / mạng
+    monkeypatch.setattr(context_packer_service, "_load_encoding", lambda model: None)
+
+
+def _chunks(count):
+    return [{
+        "file_id": "f1",
+        "original_file_name": "hop_dong.pdf",
+        "chunk_index": i,
+        "page_start": i + 1,
+        "page_end": i + 1,
+        "heading": None,
+        "text": f"Nội dung điều khoản {i} " * 40,
+        "overlap_tokens": 0,
+        "rank": count - i,
+    } for i in range(count)]
+
+
+@pytest.mark.parametrize("max_tokens", [300, 800, 2000, 6000])
+def test_pack_stays_within_budget(max_tokens):
+    packer = ContextPacker()
+    history = [f"User: câu hỏi số {i} " * 10 for i in range(30)]
+    result = packer.pack("gpt-4o-mini", max_tokens, "Bạn là trợ lý pháp lý. " * 50,
+                         "Điều khoản thanh toán là gì?", chunks=_chunks(20), history=history)
+
+    stats = result["stats"]
+    assert stats["budget"] == max_tokens - packer.safety_margin
+    assert TokenCounter("gpt-4o-mini").count(result["prompt"]) == stats["prompt_tokens"]
+    assert stats["prompt_tokens"] <= stats["budget"]
+    assert "Điều khoản thanh toán là gì?" in result["prompt"]
+
+
+def test_pack_keeps_most_relevant_chunks():
+    result = ContextPacker().pack("gpt-4o-mini", 1200, "", "Câu hỏi", chunks=_chunks(10))
+
+    documents = result["stats"]["documents"]
+    assert documents["truncated"]
+    assert 0 < documents["chunks_kept"] < 10
+    # rank nhỏ nhất là chunk cuối: phải được giữ trước
+    assert "Nội dung điều khoản 9" in result["prompt"]
+    assert "Nội dung điều khoản 0 " not in result["prompt"]
+
+
+def test_pack_keeps_everything_when_it_fits():
+    result = ContextPacker().pack("gpt-4o", None, "Hệ thống", "Xin chào", chunks=_chunks(2), history=["User: hi"])
+
+    stats = result["stats"]
+    assert not stats["documents"]["truncated"]
+    assert not stats["history"]["truncated"]
+    assert not stats["message"]["truncated"]
+
+
+def test_pack_rejects_tiny_budget():
+    with pytest.raises(ValueError):
+        ContextPacker().pack("gpt-4o", 10, "", "Xin chào")
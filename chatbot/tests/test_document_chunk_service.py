@@ -0,0 +1,67 @@
+from app.services.document_chunk_service import (
+    DocumentChunker, DocumentChunkService, _TOKEN_RE, _skip_tokens, estimate_tokens,
+)
+
+
+def _pages():
+    sentence = "Bên bán cam kết giao hàng đúng hạn theo điều khoản số {n} của hợp đồng này."
+    return [
+        (1, "HỢP ĐỒNG MUA BÁN\n\n" + " ".join(sentence.format(n=n) for n in range(40))),
+        (2, "Điều 2 Thanh toán\n\n" + "\n\n".join(sentence.format(n=n) for n in range(40, 90))),
+        (3, "Một dòng bảng OCR rất dài không có dấu câu " * 60),
+    ]
+
+
+def _chunk(pages, chunk_tokens=80, overlap_tokens=20):
+    chunker = DocumentChunker(chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
+    chunks = []
+    for page_number, page_text in pages:
+        chunks.extend(chunker.add_page(page_number, page_text))
+    return chunks + chunker.finish()
+
+
+def test_chunks_respect_size_and_indexes():
+    chunks = _chunk(_pages())
+
+    assert len(chunks) > 5
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert chunk["token_count"] == estimate_tokens(chunk["text"])
+        assert chunk["token_count"] <= 80 + 20
+        assert chunk["page_start"] <= chunk["page_end"]
+
+
+def test_overlap_round_trip():
+    pages = _pages()
+    chunks = _chunk(pages)
+
+    # Bỏ phần lặp ở đầu mỗi chunk rồi ghép lại phải ra đúng chuỗi token của tài liệu gốc
+    rebuilt = []
+    for chunk in chunks:
+        rebuilt.extend(_TOKEN_RE.findall(_skip_tokens(chunk["text"], chunk["overlap_tokens"])))
+    original = [token for _, page_text in pages for token in _TOKEN_RE.findall(page_text)]
+    assert rebuilt == original
+
+    overlapping = [chunk for chunk in chunks if chunk["overlap_tokens"]]
+    assert overlapping
+    for chunk in overlapping:
+        previous = chunks[chunk["chunk_index"] - 1]
+        head = _TOKEN_RE.findall(chunk["text"])[:chunk["overlap_tokens"]]
+        assert _TOKEN_RE.findall(previous["text"])[-chunk["overlap_tokens"]:] == head
+
+
+def test_heading_starts_new_chunk():
+    chunks = _chunk(_pages())
+
+    assert chunks[0]["heading"] == "HỢP ĐỒNG MUA BÁN"
+    second_section = next(chunk for chunk in chunks if chunk["heading"] == "Điều 2 Thanh toán")
+    assert second_section["text"].startswith("Điều 2 Thanh toán")
+    assert second_section["overlap_tokens"] == 0
+
+
+def test_fuse_reciprocal_rank():
+    assert DocumentChunkService.fuse([[1, 2, 3], [3, 1, 4]], k=60) == [1, 3, 2, 4]
+    # Hòa điểm giữ thứ tự danh sách đầu
+    assert DocumentChunkService.fuse([[5, 6], [6, 5]], k=60) == [5, 6]
+    assert DocumentChunkService.fuse([[7, 8, 9]]) == [7, 8, 9]
+    assert DocumentChunkService.fuse([]) == []
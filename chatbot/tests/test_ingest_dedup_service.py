@@ -0,0 +1,236 @@
+import asyncio
+
+import pytest
+
+from app.services import ingest_dedup_service
+from app.services.ingest_dedup_service import IngestDeduplicator
+from tests.conftest import FakeRow
+
+
+class FakePostgres:
+    """postgres_service giả: file nguồn dùng lại được là source_id (None nếu chưa có)"""
+
+    def __init__(self, content_hash="a" * 64, source_id=None, has_column=True):
+        self.content_hash = content_hash
+        self.source_id = source_id
+        self.has_column = has_column
+        self.lookups = 0
+
+    async def files_has_column(self, column):
+        return self.has_column
+
+    async def find_extraction_source(self, file_id):
+        self.lookups += 1
+        return {"success": True, "content_hash": self.content_hash, "file_size_bytes": 100, "source_id": self.source_id}
+
+
+class Claims:
+    """_claim / _release giả cho bảng ingest_inflight: kết quả _claim lấy lần lượt từ answers, hết thì là default"""
+
+    def __init__(self):
+        self.answers = []
+        self.default = True
+        self.before_claim = None
+        self.claimed = []
+        self.released = []
+
+    async def claim(self, content_hash, file_id):
+        answer = self.answers.pop(0) if self.answers else self.default
+        if answer is True and self.before_claim:
+            self.before_claim()
+        if isinstance(answer, Exception):
+            raise answer
+        if answer:
+            self.claimed.append(file_id)
+        return answer
+
+    async def release(self, content_hash, file_id):
+        self.released.append(file_id)
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    postgres = FakePostgres()
+    monkeypatch.setattr(ingest_dedup_service, "postgres_service", postgres)
+    return postgres
+
+
+@pytest.fixture
+def claims(monkeypatch):
+    claims = Claims()
+    monkeypatch.setattr(IngestDeduplicator, "_claim", staticmethod(claims.claim))
+    monkeypatch.setattr(IngestDeduplicator, "_release", staticmethod(claims.release))
+    monkeypatch.setattr(ingest_dedup_service, "INGEST_DEDUP_POLL_SECONDS", 0)
+    return claims
+
+
+class Calls:
+    def __init__(self):
+        self.extracted = []
+        self.reused = []
+
+    def extract(self, file_id, result=None, gate=None):
+        async def run():
+            if gate is not None:
+                await gate.wait()
+            self.extracted.append(file_id)
+            return result or {"success": True, "pages": 3, "file_id": file_id}
+        return run
+
+    def reuse(self, file_id, ok=True):
+        async def run(source_id):
+            self.reused.append((file_id, source_id))
+            return {"success": True, "pages": 3, "deduplicated_from": source_id} if ok else None
+        return run
+
+
+def test_extracts_when_content_hash_column_missing(postgres, claims):
+    postgres.has_column = False
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1")))
+
+    assert calls.extracted == ["f1"] and postgres.lookups == 0 and not claims.claimed
+
+
+def test_extracts_file_without_hash(postgres, claims):
+    postgres.content_hash = None
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1")))
+
+    assert calls.extracted == ["f1"] and not claims.claimed
+    assert dedup.get_stats()['lookups'] == 0
+
+
+def test_reuses_completed_source(postgres, claims):
+    postgres.source_id = "src"
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    result = asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1")))
+
+    assert result["deduplicated_from"] == "src"
+    assert calls.extracted == [] and calls.reused == [("f1", "src")]
+    stats = dedup.get_stats()
+    assert stats['hits'] == 1 and stats['pages_reused'] == 3 and stats['bytes_skipped'] == 100
+    assert stats['hit_rate'] == 1.0
+
+
+def test_extracts_when_reuse_fails(postgres, claims):
+    postgres.source_id = "src"
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1", ok=False)))
+
+    assert calls.extracted == ["f1"]
+    assert claims.claimed == ["f1"] and claims.released == ["f1"]
+    assert dedup.get_stats()['misses'] == 1
+
+
+def test_concurrent_uploads_extract_once(postgres, claims):
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    async def scenario():
+        gate = asyncio.Event()
+        first = asyncio.create_task(dedup.run("f1", calls.extract("f1", gate=gate), calls.reuse("f1")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(dedup.run("f2", calls.extract("f2"), calls.reuse("f2")))
+        await asyncio.sleep(0.01)
+        assert dedup.get_stats()['inflight'] == 1
+        postgres.source_id = "f1"  # Lần trích xuất đầu đã ghi kết quả
+        gate.set()
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(scenario())
+
+    assert calls.extracted == ["f1"]
+    assert second["deduplicated_from"] == "f1"
+    assert dedup.get_stats()['joined'] == 1
+    assert dedup.get_stats()['inflight'] == 0
+
+
+def test_waiting_upload_extracts_when_first_fails(postgres, claims):
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    async def scenario():
+        gate = asyncio.Event()
+        first = asyncio.create_task(dedup.run("f1", calls.extract("f1", {"success": False}, gate), calls.reuse("f1")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(dedup.run("f2", calls.extract("f2"), calls.reuse("f2")))
+        await asyncio.sleep(0.01)
+        gate.set()  # Thất bại: không có file nguồn để dùng lại
+        return await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+
+    assert calls.extracted == ["f1", "f2"]
+    assert calls.reused == []
+
+
+def test_waits_for_other_worker_then_reuses(postgres, claims):
+    claims.answers = [False, False]  # Worker khác đang giữ dòng ingest_inflight
+
+    def finish_elsewhere():
+        postgres.source_id = "remote"  # Worker khác xong trước lần thử thứ ba
+
+    claims.before_claim = finish_elsewhere
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    result = asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1")))
+
+    assert result["deduplicated_from"] == "remote"
+    assert calls.extracted == []
+    stats = dedup.get_stats()
+    assert stats['waited'] == 1 and stats['joined'] == 1
+    assert claims.released == ["f1"]  # Dòng đã đánh dấu được bỏ khi xong
+
+
+def test_extracts_after_waiting_too_long(postgres, claims):
+    claims.default = False
+    calls, dedup = Calls(), IngestDeduplicator(wait_seconds=0.01)
+
+    asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1")))
+
+    assert calls.extracted == ["f1"]
+    assert claims.released == []  # Không đánh dấu được thì không xóa dòng của worker khác
+
+
+def test_claim_error_does_not_block_extraction(postgres, claims):
+    claims.answers = [RuntimeError('relation "ingest_inflight" does not exist')]
+    calls, dedup = Calls(), IngestDeduplicator()
+
+    asyncio.run(dedup.run("f1", calls.extract("f1"), calls.reuse("f1")))
+
+    assert calls.extracted == ["f1"] and claims.released == []
+
+
+def test_claim_takes_over_stale_rows_only(monkeypatch, fake_session):
+    session = fake_session([[FakeRow(file_id="f1")], []])
+    monkeypatch.setattr(ingest_dedup_service, "get_session", lambda: session)
+
+    assert asyncio.run(IngestDeduplicator._claim("h", "f1")) is True
+    assert asyncio.run(IngestDeduplicator._claim("h", "f2")) is False
+
+    sql, params = session.executed[0]
+    assert "ON CONFLICT (content_hash) DO UPDATE" in sql
+    assert "WHERE ingest_inflight.heartbeat_at < NOW() - make_interval(secs => :stale_seconds)" in sql
+    assert params["stale_seconds"] == ingest_dedup_service.INGEST_DEDUP_STALE_SECONDS
+    assert session.commits == 2
+
+
+def test_heartbeat_runs_while_extracting(postgres, monkeypatch, fake_session):
+    session = fake_session([[FakeRow(file_id="f1")]])
+    monkeypatch.setattr(ingest_dedup_service, "get_session", lambda: session)
+    monkeypatch.setattr(ingest_dedup_service, "INGEST_DEDUP_HEARTBEAT_SECONDS", 0.005)
+    dedup = IngestDeduplicator()
+
+    async def extract():
+        await asyncio.sleep(0.05)
+        return {"success": True}
+
+    asyncio.run(dedup.run("f1", extract, Calls().reuse("f1")))
+    statements = [sql for sql, _ in session.executed]
+
+    assert statements[0].startswith("INSERT INTO ingest_inflight")
+    assert sum(sql.startswith("UPDATE ingest_inflight SET heartbeat_at") for sql in statements) >= 2
+    assert statements[-1].startswith("DELETE FROM ingest_inflight")  # Heartbeat dừng trước khi bỏ đánh dấu
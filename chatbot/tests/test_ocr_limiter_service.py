@@ -0,0 +1,164 @@
+import pytest
+
+from app.services import ocr_limiter_service
+from app.services.ocr_limiter_service import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, OCRCircuitOpenError, OCRConcurrencyLimiter, OCRLimiterTimeoutError,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ocr_limiter_service, "time", clock)
+    return clock
+
+
+def _limiter(**kwargs):
+    options = dict(initial=2, min_limit=1, max_limit=4, latency_target_ms=1000, decrease_factor=0.5,
+                   acquire_timeout=0, breaker_failures=3, breaker_error_rate=1.0, breaker_window=100,
+                   breaker_cooldown=30)
+    options.update(kwargs)
+    return OCRConcurrencyLimiter(**options)
+
+
+def _request(limiter, success=True, latency_ms=10):
+    probe = limiter.acquire()
+    limiter.release(latency_ms, success, probe)
+    return probe
+
+
+def test_limit_increases_after_fast_successes(clock):
+    limiter = _limiter()
+
+    _request(limiter)
+    assert limiter.get_stats()['limit'] == 2
+    _request(limiter)
+    assert limiter.get_stats()['limit'] == 3
+    for _ in range(10):
+        _request(limiter)
+    assert limiter.get_stats()['limit'] == 4  # Không vượt max_limit
+
+
+def test_limit_decreases_once_per_latency_window(clock):
+    limiter = _limiter(initial=4, breaker_failures=100)
+
+    _request(limiter, success=False)
+    assert limiter.get_stats()['limit'] == 2
+    _request(limiter, latency_ms=5000)  # Chậm hơn mục tiêu, nhưng vẫn trong cùng chu kỳ
+    assert limiter.get_stats()['limit'] == 2
+    clock.advance(1.0)
+    _request(limiter, latency_ms=5000)
+    assert limiter.get_stats()['limit'] == 1
+    clock.advance(1.0)
+    _request(limiter, success=False)
+    assert limiter.get_stats()['limit'] == 1  # Không dưới min_limit
+    assert limiter.get_stats()['limit_decreases'] == 2
+
+
+def test_acquire_times_out_when_limit_reached(clock):
+    limiter = _limiter(initial=1, max_limit=1)
+
+    limiter.acquire()
+    with pytest.raises(OCRLimiterTimeoutError):
+        limiter.acquire()
+    limiter.release(10, True)
+    assert limiter.acquire() is False
+    assert limiter.get_stats()['timeouts'] == 1
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    limiter = _limiter(initial=4)
+
+    for _ in range(3):
+        _request(limiter, success=False)
+    assert limiter.state == STATE_OPEN
+    with pytest.raises(OCRCircuitOpenError):
+        limiter.acquire()
+    assert limiter.get_stats()['rejected'] == 1
+
+
+def test_breaker_opens_on_error_rate(clock):
+    limiter = _limiter(initial=4, breaker_failures=100, breaker_window=4, breaker_error_rate=0.5)
+
+    for success in (True, False, True):
+        _request(limiter, success=success)
+    assert limiter.state == STATE_CLOSED
+    _request(limiter, success=False)
+    assert limiter.state == STATE_OPEN
+
+
+def test_half_open_allows_one_probe(clock):
+    limiter = _limiter(initial=4)
+    for _ in range(3):
+        _request(limiter, success=False)
+
+    clock.advance(30)
+    assert limiter.acquire() is True
+    assert limiter.state == STATE_HALF_OPEN
+    with pytest.raises(OCRLimiterTimeoutError):
+        limiter.acquire()  # Request thứ hai chờ kết quả của request thử
+    limiter.release(10, True, probe=True)
+    assert limiter.state == STATE_CLOSED
+    assert limiter.get_stats()['consecutive_failures'] == 0
+
+
+def test_failed_probe_reopens_breaker(clock):
+    limiter = _limiter(initial=4)
+    for _ in range(3):
+        _request(limiter, success=False)
+
+    clock.advance(30)
+    assert _request(limiter, success=False) is True
+    assert limiter.state == STATE_OPEN
+    clock.advance(29)
+    with pytest.raises(OCRCircuitOpenError):
+        limiter.acquire()
+    clock.advance(1)
+    assert limiter.acquire() is True
+
+
+def test_only_probe_closes_breaker(clock):
+    limiter = _limiter(initial=8, max_limit=8)
+    late = [limiter.acquire(), limiter.acquire()]  # Gửi trước khi breaker mở
+    for _ in range(3):
+        _request(limiter, success=False)
+    assert limiter.state == STATE_OPEN
+
+    limiter.release(10, True, late[0])
+    assert limiter.state == STATE_OPEN
+    clock.advance(30)
+    probe = limiter.acquire()
+    limiter.release(10, True, late[1])  # Request cũ thành công khi đang half-open: không đóng breaker
+    assert limiter.state == STATE_HALF_OPEN
+    limiter.release(10, True, probe)
+    assert limiter.state == STATE_CLOSED
+    assert limiter.get_stats()['in_flight'] == 0
+
+
+def test_slot_counts_exception_as_failure(clock):
+    limiter = _limiter(initial=4)
+
+    with pytest.raises(RuntimeError):
+        with limiter.slot():
+            raise RuntimeError("lỗi kết nối")
+    with limiter.slot() as outcome:
+        outcome['success'] = False
+
+    stats = limiter.get_stats()
+    assert stats['failures'] == 2
+    assert stats['consecutive_failures'] == 2
+    assert stats['in_flight'] == 0
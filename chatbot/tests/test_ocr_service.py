@@ -0,0 +1,130 @@
+import threading
+import time
+
+import fitz
+import pytest
+
+from app.services.ocr_service import OCRService, UploadCancelledError
+
+
+def _pdf(tmp_path, pages):
+    path = tmp_path / "doc.pdf"
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page()
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+class _Pipeline:
+    """Thay giai đoạn render / OCR của OCRService để đo số trang đang giữ trong bộ nhớ"""
+
+    def __init__(self, service, monkeypatch, ocr_pages=lambda page_num: True, fail_pages=()):
+        self.lock = threading.Lock()
+        self.rendered = 0
+        self.consumed = 0
+        self.max_outstanding = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.ocr_calls = 0
+        self.fail_pages = set(fail_pages)
+
+        def prepare(page, page_num, is_image=False, upload_id=None, document_service=None):
+            with self.lock:
+                self.rendered += 1
+                self.max_outstanding = max(self.max_outstanding, self.rendered - self.consumed)
+            prepared = {'page_number': page_num + 1, 'page_text': '', 'has_text': False, 'has_images': True}
+            if ocr_pages(page_num):
+                prepared['ocr_image'] = b'png'
+                return prepared
+            return dict(prepared, text=f"text {page_num + 1}", success=True)
+
+        def ocr(prepared_pages, upload_id=None, document_service=None):
+            with self.lock:
+                self.ocr_calls += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                # Trang số chẵn xong sau: kết quả về không theo thứ tự
+                time.sleep(0.004 if prepared_pages[0]['page_number'] % 2 == 0 else 0.001)
+                if self.fail_pages & {p['page_number'] for p in prepared_pages}:
+                    raise RuntimeError("OCR server lỗi")
+                return [dict(p, text=f"ocr {p['page_number']}", success=True) for p in prepared_pages]
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+        monkeypatch.setattr(service, "_prepare_pdf_page", prepare)
+        monkeypatch.setattr(service, "_ocr_pdf_pages", ocr)
+
+    def consume(self, pages):
+        results = []
+        for page in pages:
+            with self.lock:
+                self.consumed += 1
+            results.append(page)
+        return results
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.delenv("PADDLE_OCR_BATCH_API_URL", raising=False)
+    return OCRService()
+
+
+def test_pages_are_yielded_in_order(service, monkeypatch, tmp_path):
+    pipeline = _Pipeline(service, monkeypatch, ocr_pages=lambda page_num: page_num % 3 != 0)
+    progress = []
+
+    pages = pipeline.consume(service.iter_pdf_pages(_pdf(tmp_path, 30), is_image=True, max_concurrency=3,
+                                                    progress_callback=lambda done, total: progress.append((done, total))))
+
+    assert [page['page_number'] for page in pages] == list(range(1, 31))
+    assert pages[0]['text'] == "text 1" and pages[1]['text'] == "ocr 2"
+    assert progress[-1] == (30, 30) and len(progress) == 30
+
+
+def test_in_flight_pages_are_bounded(service, monkeypatch, tmp_path):
+    pipeline = _Pipeline(service, monkeypatch)
+
+    pages = pipeline.consume(service.iter_pdf_pages(_pdf(tmp_path, 60), is_image=True, max_concurrency=2))
+
+    assert len(pages) == 60
+    assert pipeline.max_in_flight <= 2
+    # Tối đa: 2 * max_concurrency trang xong chờ trả về + max_concurrency trang đang OCR + 1 trang vừa render
+    assert pipeline.max_outstanding <= 2 * 2 + 2 + 1
+
+
+def test_failed_ocr_request_marks_pages_failed(service, monkeypatch, tmp_path):
+    _Pipeline(service, monkeypatch, fail_pages={4})
+
+    pages = list(service.iter_pdf_pages(_pdf(tmp_path, 6), is_image=True, max_concurrency=2))
+
+    assert [page['page_number'] for page in pages] == list(range(1, 7))
+    assert [page['success'] for page in pages] == [True, True, True, False, True, True]
+    assert "OCR server lỗi" in pages[3]['error']
+
+
+def test_closing_early_stops_ocr(service, monkeypatch, tmp_path):
+    pipeline = _Pipeline(service, monkeypatch)
+
+    pages = service.iter_pdf_pages(_pdf(tmp_path, 100), is_image=True, max_concurrency=2)
+    assert next(pages)['page_number'] == 1
+    pages.close()
+
+    calls = pipeline.ocr_calls
+    assert calls < 100
+    time.sleep(0.02)
+    assert pipeline.ocr_calls == calls
+    assert pipeline.in_flight == 0
+
+
+def test_cancelled_upload_raises(service, tmp_path):
+    class Cancelled:
+        @staticmethod
+        def get_upload_info(upload_id):
+            return None
+
+    with pytest.raises(UploadCancelledError):
+        list(service.iter_pdf_pages(_pdf(tmp_path, 3), is_image=True, upload_id="u1", document_service=Cancelled()))
@@ -0,0 +1,46 @@
+from app.services.ocr_words_service import OCRWordBoxes, decode_word_boxes, parse_ocr_blocks
+
+
+def _word(corners, text, confidence=0.9):
+    return [corners, [text, confidence]]
+
+
+def test_parse_blocks_to_text_and_boxes():
+    blocks = [
+        [_word([[0, 0], [10, 0], [10, 5], [0, 5]], "Hợp"), _word([[12, 0], [30, 0], [30, 5], [12, 5]], "đồng", 0.5)],
+        "không phải block",
+        [["thiếu text"]],
+    ]
+    texts, boxes = parse_ocr_blocks(blocks)
+
+    assert texts == ["Hợp", "đồng"]
+    assert boxes.boxes.tolist() == [[0, 0, 10, 5], [12, 0, 18, 5]]
+    assert boxes.confidences.tolist() == [90, 50]
+    words = boxes.to_words(" ".join(texts))
+    assert [word["text"] for word in words] == texts
+
+
+def test_malformed_bbox_keeps_text():
+    blocks = [[
+        _word([[0, 0], [10, 0], [10, 5], [0, 5]], "abc"),
+        _word([[1, 1], [3, 4]], "de"),          # Bbox 2 điểm: batch lỗi, xử lý từng từ
+        _word([1, 2, 3], "x"),                   # Không ghép được thành điểm
+        _word(None, "y", "không phải số"),
+    ]]
+    texts, boxes = parse_ocr_blocks(blocks)
+
+    assert texts == ["abc", "de", "x", "y"]
+    assert len(boxes) == 4
+    assert boxes.boxes.tolist() == [[0, 0, 10, 5], [1, 1, 2, 3], [0, 0, 0, 0], [0, 0, 0, 0]]
+    assert boxes.confidences.tolist() == [90, 90, 0, 0]
+    # Thứ tự từ vẫn khớp với text của trang
+    assert [word["text"] for word in boxes.to_words(" ".join(texts))] == texts
+
+
+def test_blob_round_trip():
+    _, boxes = parse_ocr_blocks([[_word([[5, 6], [15, 6], [15, 9], [5, 9]], "từ")]])
+
+    decoded = OCRWordBoxes.from_bytes(boxes.to_bytes())
+    assert decoded.boxes.tolist() == boxes.boxes.tolist()
+    assert decode_word_boxes(boxes.to_base64()).text_lengths.tolist() == [2]
+    assert decode_word_boxes("không phải base64") is None
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import resumable_upload_service as resumable
+from app.services.resumable_upload_service import ResumableUploadService, _merge_ranges, _part_bounds
+from tests.conftest import FakeRow
+
+MB = 1024 * 1024
+
+
+def _upload(file_size=10 * MB + 5, part_size=4 * MB, **extra):
+    return {"id": "s1", "status": "uploading", "upload_id": None, "original_file_name": "a.pdf",
+            "file_size_bytes": file_size, "part_size": part_size, "total_parts": -(-file_size // part_size),
+            "expires_at": None, "parts": [], **extra}
+
+
+async def _body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_part_bounds_clamps_last_part():
+    upload = _upload()
+
+    assert _part_bounds(upload, 1) == (0, 4 * MB)
+    assert _part_bounds(upload, 2) == (4 * MB, 8 * MB)
+    assert _part_bounds(upload, 3) == (8 * MB, 10 * MB + 5)
+
+
+def test_merge_ranges_joins_adjacent_parts_in_any_order():
+    upload = _upload(file_size=20 * MB, part_size=2 * MB)
+
+    assert _merge_ranges(upload, []) == []
+    assert _merge_ranges(upload, [5, 1, 2, 9, 4]) == [[0, 4 * MB], [6 * MB, 10 * MB], [16 * MB, 18 * MB]]
+    assert _merge_ranges(upload, list(range(10, 0, -1))) == [[0, 20 * MB]]
+
+
+def test_describe_lists_missing_parts():
+    upload = _upload(parts=[{"part_number": 3, "size_bytes": 2 * MB + 5}, {"part_number": 1, "size_bytes": 4 * MB}])
+
+    state = ResumableUploadService.describe(upload)
+
+    assert state["received_parts"] == [3, 1]
+    assert state["missing_parts"] == [2]
+    assert state["received_ranges"] == [[0, 4 * MB], [8 * MB, 10 * MB + 5]]
+    assert state["bytes_received"] == 6 * MB + 5
+
+
+def test_assemble_concatenates_parts_in_order(tmp_path):
+    parts = [b"a" * 10, b"b" * 10, b"c" * 3]
+    session_dir = tmp_path / "s1"
+    session_dir.mkdir()
+    # Ghi theo thứ tự ngược để chắc việc ghép theo số phần, không theo thứ tự nhận
+    for part_number in (3, 1, 2):
+        (session_dir / str(part_number)).write_bytes(parts[part_number - 1])
+    target = tmp_path / "s1.part"
+    target.write_bytes(b"old content longer than the new file" * 4)
+
+    digest = ResumableUploadService._assemble(session_dir, 3, target)
+
+    assert target.read_bytes() == b"".join(parts)
+    assert digest == hashlib.sha256(b"".join(parts)).hexdigest()
+
+
+def test_assemble_fails_on_missing_part(tmp_path):
+    session_dir = tmp_path / "s1"
+    session_dir.mkdir()
+    (session_dir / "1").write_bytes(b"x")
+
+    with pytest.raises(FileNotFoundError):
+        ResumableUploadService._assemble(session_dir, 2, tmp_path / "s1.part")
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = ResumableUploadService(upload_dir=tmp_path)
+    service.session_dir("s1").mkdir()
+    return service
+
+
+def test_write_part_records_part(service, monkeypatch, fake_session):
+    session = fake_session([[FakeRow(id="s1")], [], [FakeRow(parts_received=1, bytes_received=3)]])
+    monkeypatch.setattr(resumable, "get_session", lambda: session)
+    monkeypatch.setattr(resumable, "WRITE_BUFFER_SIZE", 2)
+    upload = _upload(file_size=7, part_size=4)
+
+    result = asyncio.run(service.write_part(upload, 2, _body(b"x", b"yz"), checksum=hashlib.sha256(b"xyz").hexdigest().upper()))
+
+    assert service.part_path("s1", 2).read_bytes() == b"xyz"
+    assert result["size_bytes"] == 3 and result["parts_received"] == 1
+    assert session.executed[1][1] == {"id": "s1", "part_number": 2, "size_bytes": 3, "sha256": hashlib.sha256(b"xyz").hexdigest()}
+    assert list(service.session_dir("s1").glob("*.tmp")) == []
+
+
+@pytest.mark.parametrize("chunks, checksum, detail", [
+    ((b"xy",), None, "cần 3 bytes"),
+    ((b"xy", b"zw"), None, "dài hơn 3 bytes"),
+    ((b"xyz",), "0" * 64, "Checksum"),
+])
+def test_write_part_rejects_bad_part(service, monkeypatch, fake_session, chunks, checksum, detail):
+    session = fake_session()
+    monkeypatch.setattr(resumable, "get_session", lambda: session)
+    upload = _upload(file_size=7, part_size=4)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(service.write_part(upload, 2, _body(*chunks), checksum=checksum))
+
+    assert exc_info.value.status_code == 400 and detail in exc_info.value.detail
+    assert session.executed == []  # Phần lỗi không được ghi nhận
+    assert list(service.session_dir("s1").iterdir()) == []
+
+
+def test_write_part_keeps_old_part_when_session_completing(service, monkeypatch, fake_session):
+    service.part_path("s1", 1).write_bytes(b"old!")
+    session = fake_session([[]])  # Phiên không còn 'uploading'
+    monkeypatch.setattr(resumable, "get_session", lambda: session)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(service.write_part(_upload(file_size=7, part_size=4), 1, _body(b"new!")))
+
+    assert exc_info.value.status_code == 409
+    assert service.part_path("s1", 1).read_bytes() == b"old!"
+    assert session.rollbacks == 1
+    assert [p.name for p in service.session_dir("s1").iterdir()] == ["1"]
+
+
+def test_write_part_rejects_out_of_range_part(service):
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(service.write_part(_upload(file_size=7, part_size=4), 3, _body(b"x")))
+
+    assert exc_info.value.status_code == 400
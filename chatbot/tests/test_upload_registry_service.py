@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from app.services import upload_registry_service
+from app.services.upload_registry_service import UploadRegistry
+from tests.conftest import FakeRow
+
+
+@pytest.fixture
+def registry():
+    return UploadRegistry()
+
+
+def _use(monkeypatch, session):
+    monkeypatch.setattr(upload_registry_service, "get_session", lambda: session)
+    return session
+
+
+def test_register_tracks_upload_locally(registry, monkeypatch, fake_session):
+    session = _use(monkeypatch, fake_session([[FakeRow(status="uploading")], [FakeRow(status="processing")]]))
+
+    asyncio.run(registry.register("u1", {"status": "uploading"}, user_id="user-a"))
+    asyncio.run(registry.register("u1", {"status": "processing", "file_id": "f1"}))
+
+    assert registry.get("u1") == {"status": "processing", "file_id": "f1"}
+    sql, params = session.executed[0]
+    assert "ON CONFLICT (upload_id)" in sql
+    assert params["user_id"] == "user-a" and params["worker_id"] == registry.worker_id
+
+
+def test_register_after_remote_cancel_drops_upload(registry, monkeypatch, fake_session):
+    # Không có dòng RETURNING: upload đã bị hủy ở worker khác
+    _use(monkeypatch, fake_session([[]]))
+
+    asyncio.run(registry.register("u1", {"status": "processing"}))
+
+    assert registry.get("u1") is None
+
+
+def test_cancel_notification_drops_local_upload(registry, monkeypatch, fake_session):
+    _use(monkeypatch, fake_session([[FakeRow(status="processing")]]))
+    asyncio.run(registry.register("u1", {"status": "processing"}))
+
+    registry._on_cancel_notification(None, 0, upload_registry_service.UPLOAD_CANCEL_CHANNEL, "u1")
+    registry._on_cancel_notification(None, 0, upload_registry_service.UPLOAD_CANCEL_CHANNEL, "khác")
+
+    assert registry.get("u1") is None
+    assert registry.get_stats()['cancel_notifications'] == 1
+
+
+def test_adopt_tracks_only_active_uploads(registry, monkeypatch, fake_session):
+    _use(monkeypatch, fake_session([
+        [FakeRow(upload_id="u1", status="queued", file_id="f1", storage_path="uploads/a.pdf")],
+        [FakeRow(upload_id="u2", status="cancelled", file_id="f2", storage_path="uploads/b.pdf")],
+        [],
+    ]))
+
+    assert asyncio.run(registry.adopt("u1"))["status"] == "queued"
+    assert asyncio.run(registry.adopt("u2"))["status"] == "cancelled"
+    assert asyncio.run(registry.adopt("u3")) is None
+
+    assert registry.get("u1") == {"status": "queued", "file_id": "f1", "storage_path": "uploads/a.pdf"}
+    assert registry.get("u2") is None
+
+
+def test_cancel_by_owner_notifies_workers(registry, monkeypatch, fake_session):
+    session = _use(monkeypatch, fake_session([
+        [FakeRow(status="processing")],
+        [FakeRow(upload_id="u1", user_id="user-a", status="cancelled", storage_path="uploads/a.pdf")],
+        [],
+    ]))
+    asyncio.run(registry.register("u1", {"status": "processing"}, user_id="user-a"))
+
+    row = asyncio.run(registry.cancel("u1", user_id="user-a"))
+
+    assert row["status"] == "cancelled"
+    assert registry.get("u1") is None
+    update_sql, params = session.executed[1]
+    assert "user_id = CAST(:user_id AS UUID)" in update_sql and params["user_id"] == "user-a"
+    assert session.executed[2][1] == {"channel": upload_registry_service.UPLOAD_CANCEL_CHANNEL, "upload_id": "u1"}
+
+
+def test_cancel_by_other_user_keeps_upload_running(registry, monkeypatch, fake_session):
+    # UPDATE không khớp dòng nào vì user_id khác người upload
+    session = _use(monkeypatch, fake_session([[FakeRow(status="processing")], []]))
+    asyncio.run(registry.register("u1", {"status": "processing"}, user_id="user-a"))
+
+    assert asyncio.run(registry.cancel("u1", user_id="user-b")) is None
+
+    assert registry.get("u1") == {"status": "processing"}
+    assert not any("pg_notify" in sql for sql, _ in session.executed)
+
+
+def test_admin_cancel_has_no_owner_filter(registry, monkeypatch, fake_session):
+    session = _use(monkeypatch, fake_session([[FakeRow(upload_id="u1", status="cancelled")], []]))
+
+    assert asyncio.run(registry.cancel("u1"))["status"] == "cancelled"
+    assert session.executed[0][1]["user_id"] is None
+
+
+def test_poll_drops_uploads_cancelled_elsewhere(registry, monkeypatch, fake_session):
+    _use(monkeypatch, fake_session([[FakeRow(status="processing")], [FakeRow(status="processing")]]))
+    asyncio.run(registry.register("u1", {"status": "processing"}))
+    asyncio.run(registry.register("u2", {"status": "processing"}))
+
+    _use(monkeypatch, fake_session([[("u2",)], []]))
+    asyncio.run(registry._sync_cancelled())
+
+    assert registry.get("u1") is not None
+    assert registry.get("u2") is None
+    assert registry.get_stats()['cancel_polled'] == 1
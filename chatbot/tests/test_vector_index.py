@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from app.services.embedding_service import HashingEmbedder
+from app.services.vector_index_service import VectorIndex
+
+
+DIM = 64
+
+
+def _vectors(count: int, seed: int) -> np.ndarray:
+    matrix = np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.fixture(params=["float32", "int8"])
+def index(request, tmp_path):
+    return VectorIndex(tmp_path / request.param, DIM, dtype=request.param)
+
+
+def test_search_returns_nearest_rows(index):
+    vectors_a, vectors_b = _vectors(5, 1), _vectors(7, 2)
+    assert index.add("a", range(5), vectors_a) == 5
+    assert index.add("b", range(7), vectors_b) == 7
+
+    matches = index.search(vectors_b[3], top_k=3)[0]
+    assert len(matches) == 3
+    assert matches[0][:2] == ("b", 3)
+    assert matches[0][2] == pytest.approx(1.0, abs=0.02)
+    assert [score for _, _, score in matches] == sorted((score for _, _, score in matches), reverse=True)
+
+
+def test_search_batches_queries(index):
+    vectors = _vectors(6, 3)
+    index.add("a", range(6), vectors)
+
+    results = index.search(vectors[[1, 4]], top_k=1)
+    assert [result[0][:2] for result in results] == [("a", 1), ("a", 4)]
+
+
+def test_search_limited_to_file_ids(index):
+    vectors_a, vectors_b = _vectors(4, 4), _vectors(4, 5)
+    index.add("a", range(4), vectors_a)
+    index.add("b", range(4), vectors_b)
+
+    matches = index.search(vectors_a[0], top_k=10, file_ids=["b"])[0]
+    assert {file_id for file_id, _, _ in matches} == {"b"}
+    assert len(matches) == 4
+    assert index.search(vectors_a[0], top_k=10, file_ids=["missing"]) == [[]]
+
+
+def test_delete_hides_rows(index):
+    vectors_a, vectors_b = _vectors(10, 6), _vectors(40, 7)
+    index.add("a", range(10), vectors_a)
+    index.add("b", range(40), vectors_b)
+
+    assert index.delete("a") == 10
+    assert index.delete("a") == 0
+    assert not index.has_file("a")
+    matches = index.search(vectors_a[0], top_k=50)[0]
+    assert {file_id for file_id, _, _ in matches} == {"b"}
+    assert index.get_stats()['compactions'] == 0
+
+
+def test_compaction_keeps_live_rows(index):
+    vectors_a, vectors_b = _vectors(20, 8), _vectors(10, 9)
+    index.add("a", range(20), vectors_a)
+    index.add("b", range(10), vectors_b)
+
+    index.delete("a")  # 20/30 dòng đã xóa, vượt VECTOR_INDEX_COMPACT_RATIO
+    stats = index.get_stats()
+    assert stats['compactions'] == 1
+    assert stats['rows'] == 10
+    assert stats['dead_rows'] == 0
+    assert index.search(vectors_b[7], top_k=1)[0][0][:2] == ("b", 7)
+
+    # Index mở lại từ đĩa thấy cùng dữ liệu sau khi gom
+    reopened = VectorIndex(index.directory, DIM, dtype=index.dtype)
+    assert reopened.has_file("b") and not reopened.has_file("a")
+    assert reopened.search(vectors_b[2], top_k=1)[0][0][:2] == ("b", 2)
+
+
+def test_int8_scores_close_to_float32(tmp_path):
+    vectors = _vectors(50, 10)
+    exact = VectorIndex(tmp_path / "float32", DIM, dtype="float32")
+    quantized = VectorIndex(tmp_path / "int8", DIM, dtype="int8")
+    exact.add("a", range(50), vectors)
+    quantized.add("a", range(50), vectors)
+
+    query = _vectors(1, 11)[0]
+    exact_scores = {chunk: score for _, chunk, score in exact.search(query, top_k=50)[0]}
+    quantized_scores = {chunk: score for _, chunk, score in quantized.search(query, top_k=50)[0]}
+    assert exact_scores.keys() == quantized_scores.keys()
+    for chunk, score in exact_scores.items():
+        assert quantized_scores[chunk] == pytest.approx(score, abs=0.02)
+
+
+def test_invalid_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        VectorIndex(tmp_path, DIM, dtype="float16")
+
+
+def test_hashing_embedder_is_deterministic():
+    texts = ["Hợp đồng mua bán nhà đất", "Biên bản nghiệm thu công trình", ""]
+    first = HashingEmbedder(dim=128).embed_documents(texts)
+    second = HashingEmbedder(dim=128).embed_documents(texts)
+
+    assert first.shape == (3, 128)
+    assert first.dtype == np.float32
+    assert np.array_equal(first, second)
+    assert np.linalg.norm(first[0]) == pytest.approx(1.0)
+    assert not first[2].any()
+
+
+def test_hashing_embedder_ignores_accents_and_case():
+    embedder = HashingEmbedder(dim=128)
+    query = embedder.embed_query("HỢP ĐỒNG mua bán")
+
+    assert np.allclose(query, embedder.embed_query("hop dong mua ban"))
+    related, unrelated = embedder.embed_documents(["Hợp đồng mua bán căn hộ", "Báo cáo tài chính quý 3"])
+    assert query @ related > query @ unrelated
@@ -0,0 +1,140 @@
+"""
+Đo thời gian import khi khởi động API (python -X importtime) và báo lỗi nếu vượt ngân sách.
+
+Mỗi lần đo chạy một process Python mới (không dùng lại module đã nạp), lấy kết quả nhỏ
+nhất trong --repeat lần để giảm nhiễu. Ngoài tổng thời gian, kiểm tra các thư viện nặng
+(PyMuPDF, pandas, NumPy, Pillow, python-docx/pptx, langchain_openai...) không bị nạp lúc
+khởi động: chúng phải được import trong hàm trích xuất / provider LLM tương ứng.
+
+Chạy (từ thư mục chatbot):
+    python tools/import_time_benchmark.py
+    python tools/import_time_benchmark.py --module app.services.ocr_service --budget-ms 600 --top 15
+    IMPORT_TIME_BUDGET_MS=2000 python tools/import_time_benchmark.py --json
+
+Mã thoát: 0 = đạt, 1 = vượt ngân sách hoặc nạp thư viện bị cấm, 2 = không import được module.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_MODULES = ["app.main"]
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+# Thư viện không được nạp khi import app (chỉ nạp khi xử lý file / gọi LLM lần đầu)
+DEFAULT_FORBIDDEN = ["fitz", "pymupdf", "pandas", "numpy", "PIL", "docx", "pptx", "openpyxl",
+                     "langchain_openai", "langchain_core", "openai", "tiktoken", "langchain_huggingface", "hnswlib"]
+
+# "import time: self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """Tách output -X importtime thành [(module, self_us, cumulative_us, độ sâu)]"""
+    rows = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def run_once(modules: List[str]) -> Dict:
+    """Import các module trong một process mới và trả về thời gian theo module"""
+    env = dict(os.environ)
+    # ocr_service khởi tạo singleton lúc import và yêu cầu URL OCR; không gọi tới URL này khi đo
+    env.setdefault("PADDLE_OCR_API_URL", "http://127.0.0.1:9/ocr-fullV2")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    code = "; ".join(f"import {module}" for module in modules)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=PROJECT_ROOT, env=env,
+                          capture_output=True, text=True)
+    rows = parse_importtime(proc.stderr)
+    error = None
+    if proc.returncode != 0:
+        error = next((line for line in reversed(proc.stderr.splitlines()) if line and not line.startswith("import time:")),
+                     f"exit code {proc.returncode}")
+    return {"rows": rows, "error": error}
+
+
+def summarize(rows: List[Tuple[str, int, int, int]], modules: List[str], forbidden: List[str], top: int) -> Dict:
+    cumulative = {name: cumulative_us for name, _, cumulative_us, depth in rows if depth == 0}
+    loaded = {name for name, _, _, _ in rows}
+    packages: Dict[str, int] = {}
+    for name, self_us, _, _ in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return {
+        "total_ms": round(sum(cumulative.get(module, 0) for module in modules) / 1000, 1),
+        "modules_ms": {module: round(cumulative.get(module, 0) / 1000, 1) for module in modules},
+        "modules_loaded": len(loaded),
+        "forbidden_loaded": sorted(module for module in forbidden
+                                   if module in loaded or any(name.startswith(module + ".") for name in loaded)),
+        "top_packages_ms": [
+            {"package": package, "ms": round(self_us / 1000, 1)}
+            for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        ]
+    }
+
+
+def benchmark(modules: List[str], repeat: int = 3, forbidden: Optional[List[str]] = None, top: int = 10) -> Dict:
+    """Đo repeat lần, giữ lần nhanh nhất"""
+    best = None
+    runs_ms = []
+    for _ in range(max(1, repeat)):
+        run = run_once(modules)
+        if run["error"]:
+            return {"error": run["error"], "modules": modules}
+        summary = summarize(run["rows"], modules, forbidden or [], top)
+        runs_ms.append(summary["total_ms"])
+        if best is None or summary["total_ms"] < best["total_ms"]:
+            best = summary
+    return {"modules": modules, "runs_ms": runs_ms, **best}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian import khi khởi động API")
+    parser.add_argument("--module", action="append", dest="modules", help="Module cần đo (lặp lại được), mặc định app.main")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Ngân sách tổng thời gian import (ms)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần đo, lấy lần nhanh nhất")
+    parser.add_argument("--top", type=int, default=10, help="Số package nặng nhất được liệt kê")
+    parser.add_argument("--allow", action="append", default=[], help="Bỏ một thư viện khỏi danh sách cấm nạp lúc khởi động")
+    parser.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+    args = parser.parse_args()
+
+    modules = args.modules or DEFAULT_MODULES
+    forbidden = [module for module in DEFAULT_FORBIDDEN if module not in args.allow]
+    result = benchmark(modules, args.repeat, forbidden, args.top)
+
+    if "error" in result:
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            print(f"❌ Không import được {', '.join(modules)}: {result['error']}")
+        sys.exit(2)
+
+    result["budget_ms"] = args.budget_ms
+    result["passed"] = result["total_ms"] <= args.budget_ms and not result["forbidden_loaded"]
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f"Import {', '.join(modules)}: {result['total_ms']} ms (ngân sách {args.budget_ms} ms, "
+              f"các lần đo {result['runs_ms']}, {result['modules_loaded']} module)")
+        for item in result["top_packages_ms"]:
+            print(f"  {item['package']:<30} {item['ms']:>8} ms")
+        if result["forbidden_loaded"]:
+            print(f"❌ Thư viện nặng bị nạp lúc khởi động: {', '.join(result['forbidden_loaded'])}")
+        if result["total_ms"] > args.budget_ms:
+            print(f"❌ Vượt ngân sách {result['total_ms'] - args.budget_ms:.1f} ms")
+        if result["passed"]:
+            print("✅ Đạt")
+    sys.exit(0 if result["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Benchmark trích xuất file (OCRService.process_file) trên Test_document_tekjoy, không cần OCR server thật.
+
+Script chạy OCR server giả lập (tools/ocr_stub_server.py) trong process, rồi xử lý từng
+file trong một process Python riêng để đo đúng bộ nhớ đỉnh (peak RSS) của file đó.
+Ngoài các file mẫu, có thể sinh thêm file lớn: PDF nhiều trang (ghép lại các trang scan
+mẫu) và XLSX nhiều dòng.
+
+Mỗi file ghi lại: thời gian xử lý, số request OCR (single/batch), số ảnh OCR, số bytes gửi
+tới OCR server, số trang và peak RSS. Kết quả được tổng hợp theo loại file và ghi ra JSON;
+dùng --compare để so với một lần chạy trước.
+
+Chạy (từ thư mục chatbot):
+    python tools/ingest_benchmark.py --latency-ms 200 --output bench/ingest.json
+    python tools/ingest_benchmark.py --pdf-pages 500 --xlsx-rows 50000 --compare bench/ingest.json
+    python tools/ingest_benchmark.py --no-synthetic --files "Test_document_tekjoy/*.pdf"
+
+Cache OCR bị tắt mặc định (mỗi lần chạy đều gọi OCR); dùng --use-cache để đo cả cache.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+TOOLS_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = TOOLS_DIR.parent
+DEFAULT_SAMPLES = PROJECT_ROOT / "Test_document_tekjoy"
+
+# Cấu hình OCRService được ghi vào kết quả để so sánh giữa các lần chạy
+RECORDED_ENV = ["OCR_PDF_CONCURRENCY", "OCR_BATCH_SIZE", "OCR_PREPROCESS_ENABLED", "OCR_MAX_IMAGE_EDGE",
+                "OCR_GRAYSCALE", "OCR_IMAGE_FORMAT", "OCR_LIMIT_INITIAL", "OCR_LIMIT_MAX", "EXCEL_ROW_BLOCK_SIZE"]
+
+# ru_maxrss: KB trên Linux, bytes trên macOS
+_RSS_UNIT = 1024 * 1024 if sys.platform == "darwin" else 1024
+
+# Chỉ số so sánh trong --compare
+COMPARE_METRICS = ["wall_s", "ocr_requests", "ocr_images", "bytes_sent", "peak_rss_mb"]
+
+
+# ---- FILE TỔNG HỢP ----
+def make_scaled_pdf(sources: List[Path], pages: int, output: Path) -> Path:
+    """Ghép lặp lại các trang của các PDF mẫu cho tới đủ số trang"""
+    import fitz  # PyMuPDF
+
+    sources_docs = [fitz.open(str(path)) for path in sources]
+    try:
+        doc = fitz.open()
+        while len(doc) < pages:
+            for source in sources_docs:
+                remaining = pages - len(doc)
+                if remaining <= 0:
+                    break
+                doc.insert_pdf(source, to_page=min(len(source), remaining) - 1)
+        doc.save(str(output), garbage=3, deflate=True)
+        doc.close()
+    finally:
+        for source in sources_docs:
+            source.close()
+    return output
+
+
+def make_large_xlsx(rows: int, output: Path, columns: int = 8) -> Path:
+    """XLSX một sheet với rows dòng dữ liệu (text, số, ngày, ô trống)"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    sheet.append([f"Cột {idx + 1}" for idx in range(columns)])
+    base_date = datetime(2024, 1, 1)
+    for row in range(rows):
+        values = []
+        for col in range(columns):
+            kind = col % 4
+            if kind == 0:
+                values.append(f"Nhân viên {row} - phòng ban {col}")
+            elif kind == 1:
+                values.append(row * columns + col)
+            elif kind == 2:
+                values.append(base_date.replace(day=1 + row % 28))
+            else:
+                values.append(None if row % 3 == 0 else round(row / (col + 1), 3))
+        sheet.append(values)
+    workbook.save(str(output))
+    return output
+
+
+def prepare_synthetic(work_dir: Path, pdf_pages: int, xlsx_rows: int) -> List[Path]:
+    """Sinh (hoặc dùng lại nếu đã có) các file lớn trong work_dir"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    pdf_sources = sorted(DEFAULT_SAMPLES.glob("*.pdf"))
+    if pdf_pages and pdf_sources:
+        path = work_dir / f"synthetic_{pdf_pages}_pages.pdf"
+        if not path.exists():
+            print(f"Sinh {path.name}...")
+            make_scaled_pdf(pdf_sources, pdf_pages, path)
+        files.append(path)
+    if xlsx_rows:
+        path = work_dir / f"synthetic_{xlsx_rows}_rows.xlsx"
+        if not path.exists():
+            print(f"Sinh {path.name}...")
+            make_large_xlsx(xlsx_rows, path)
+        files.append(path)
+    return files
+
+
+# ---- PROCESS ĐO TỪNG FILE ----
+def peak_rss_mb() -> float:
+    """Bộ nhớ đỉnh của process hiện tại (MB).
+
+    Trên Linux đọc VmHWM vì ru_maxrss giữ lại giá trị của process cha qua fork + exec.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / _RSS_UNIT
+
+
+def run_worker(file_path: str, output: str, ocr_images: bool) -> None:
+    """Chạy trong process con: xử lý một file và ghi số đo ra output"""
+    sys.path.insert(0, str(PROJECT_ROOT))
+    import logging
+    logging.disable(logging.INFO)
+
+    from app.services.ocr_service import ocr_service
+
+    rss_after_import_mb = peak_rss_mb()
+    started = time.perf_counter()
+    error = None
+    pages = 0
+    rows = 0
+    chars = 0
+    try:
+        result = ocr_service.process_file(file_path, is_image=ocr_images)
+        # Trang PDF / sheet Excel / slide PowerPoint
+        pages = result.get('total_pages') or len(result.get('pages') or result.get('sheets') or result.get('slides') or []) or 1
+        rows = sum(sheet.get('rows_count', 0) for sheet in result.get('sheets') or [])
+        chars = len(result.get('text') or '')
+        if not result.get('success', True):
+            error = result.get('error')
+    except Exception as e:
+        error = getattr(e, 'detail', None) or str(e)
+    wall_s = time.perf_counter() - started
+
+    requests_stats = ocr_service.get_request_stats()
+    preprocess = ocr_service.get_preprocess_stats()
+    measurement = {
+        "wall_s": round(wall_s, 3),
+        "pages": pages,
+        "rows": rows,
+        "chars": chars,
+        "single_requests": requests_stats.get('single_requests', 0),
+        "batch_requests": requests_stats.get('batch_requests', 0),
+        "image_bytes_sent": preprocess.get('bytes_out', 0),
+        "rss_after_import_mb": round(rss_after_import_mb, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "error": error
+    }
+    Path(output).write_text(json.dumps(measurement), encoding='utf-8')
+
+
+def measure_file(path: Path, server, ocr_images: bool, env: Dict[str, str], timeout: float) -> Dict[str, Any]:
+    """Xử lý một file trong process con; số request/ảnh/bytes lấy từ chênh lệch thống kê của stub"""
+    with server.stats_lock:
+        before = dict(server.stats)
+    fd, output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    command = [sys.executable, str(Path(__file__).resolve()), "--worker", str(path), "--worker-output", output]
+    if not ocr_images:
+        command.append("--no-ocr-images")
+    try:
+        proc = subprocess.run(command, cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True, timeout=timeout)
+        raw = Path(output).read_text(encoding='utf-8')
+        if raw:
+            measurement = json.loads(raw)
+        else:
+            # Process con chết trước khi ghi kết quả (vd. hết bộ nhớ)
+            stderr_lines = (proc.stderr or "").strip().splitlines()
+            measurement = {"error": stderr_lines[-1] if stderr_lines else f"exit code {proc.returncode}"}
+    except subprocess.TimeoutExpired:
+        measurement = {"error": f"Quá thời gian {timeout}s"}
+    finally:
+        os.unlink(output)
+    with server.stats_lock:
+        after = dict(server.stats)
+
+    delta = {key: after[key] - before[key] for key in ("single_requests", "batch_requests", "batched_images", "bytes_received", "errors")}
+    return {
+        "file": path.name,
+        "file_type": path.suffix.lower().lstrip("."),
+        "file_bytes": path.stat().st_size,
+        "synthetic": path.name.startswith("synthetic_"),
+        **measurement,
+        "ocr_requests": delta["single_requests"] + delta["batch_requests"],
+        "ocr_images": delta["single_requests"] + delta["batched_images"],
+        "ocr_errors": delta["errors"],
+        "bytes_sent": delta["bytes_received"]
+    }
+
+
+# ---- TỔNG HỢP / SO SÁNH ----
+def summarize_by_type(files: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    summary: Dict[str, Dict[str, Any]] = {}
+    for item in files:
+        entry = summary.setdefault(item["file_type"], {
+            "files": 0, "errors": 0, "pages": 0, "rows": 0, "wall_s": 0.0, "ocr_requests": 0,
+            "ocr_images": 0, "bytes_sent": 0, "peak_rss_mb": 0.0
+        })
+        entry["files"] += 1
+        entry["errors"] += 1 if item.get("error") else 0
+        entry["pages"] += item.get("pages") or 0
+        entry["rows"] += item.get("rows") or 0
+        entry["wall_s"] = round(entry["wall_s"] + (item.get("wall_s") or 0), 3)
+        entry["ocr_requests"] += item["ocr_requests"]
+        entry["ocr_images"] += item["ocr_images"]
+        entry["bytes_sent"] += item["bytes_sent"]
+        entry["peak_rss_mb"] = max(entry["peak_rss_mb"], item.get("peak_rss_mb") or 0)
+    for entry in summary.values():
+        entry["pages_per_s"] = round(entry["pages"] / entry["wall_s"], 2) if entry["wall_s"] else None
+    return summary
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Chênh lệch theo loại file giữa hai lần chạy (giá trị mới, cũ, % thay đổi)"""
+    result = {}
+    for file_type, entry in current["by_type"].items():
+        old = previous.get("by_type", {}).get(file_type)
+        if not old:
+            continue
+        result[file_type] = {}
+        for metric in COMPARE_METRICS:
+            new_value, old_value = entry.get(metric), old.get(metric)
+            change = round((new_value - old_value) / old_value * 100, 1) if old_value else None
+            result[file_type][metric] = {"old": old_value, "new": new_value, "change_pct": change}
+    return result
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{'loại':<6} {'file':>4} {'lỗi':>4} {'trang':>6} {'giây':>9} {'trang/s':>8} {'req OCR':>8} {'ảnh OCR':>8} {'MB gửi':>8} {'peak RSS':>9}")
+    for file_type, entry in sorted(report["by_type"].items()):
+        print(f"{file_type:<6} {entry['files']:>4} {entry['errors']:>4} {entry['pages']:>6} {entry['wall_s']:>9.2f} "
+              f"{entry['pages_per_s'] or 0:>8} {entry['ocr_requests']:>8} {entry['ocr_images']:>8} "
+              f"{entry['bytes_sent'] / 1024 / 1024:>8.2f} {entry['peak_rss_mb']:>8.1f}M")
+    for file_type, metrics in sorted(report.get("comparison", {}).items()):
+        changes = ", ".join(f"{metric} {values['change_pct']:+}%" for metric, values in metrics.items()
+                            if values["change_pct"] is not None)
+        print(f"  so với lần trước [{file_type}]: {changes}")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark trích xuất file với OCR server giả lập")
+    parser.add_argument("--files", action="append", help="Glob file cần đo (lặp lại được), mặc định Test_document_tekjoy/*")
+    parser.add_argument("--pdf-pages", type=int, default=500, help="Số trang PDF tổng hợp, 0 = không sinh")
+    parser.add_argument("--xlsx-rows", type=int, default=50000, help="Số dòng XLSX tổng hợp, 0 = không sinh")
+    parser.add_argument("--no-synthetic", action="store_true", help="Chỉ đo file mẫu")
+    parser.add_argument("--work-dir", default=str(Path(tempfile.gettempdir()) / "tekjoy_ingest_benchmark"),
+                        help="Thư mục chứa file tổng hợp (được dùng lại giữa các lần chạy)")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Độ trễ mỗi request của OCR giả lập")
+    parser.add_argument("--per-image-ms", type=float, default=20, help="Độ trễ thêm cho mỗi ảnh")
+    parser.add_argument("--no-batch", action="store_true", help="OCR giả lập không hỗ trợ endpoint batch")
+    parser.add_argument("--no-ocr-images", action="store_true", help="Không OCR ảnh trong PDF/Word/Excel (is_image=False)")
+    parser.add_argument("--use-cache", action="store_true", help="Giữ cache kết quả OCR giữa các file / lần chạy")
+    parser.add_argument("--timeout", type=float, default=1800, help="Thời gian tối đa cho mỗi file (giây)")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    parser.add_argument("--compare", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.worker_output, not args.no_ocr_images)
+        return
+
+    sys.path.insert(0, str(TOOLS_DIR))
+    from ocr_stub_server import create_server
+
+    patterns = args.files or [str(DEFAULT_SAMPLES / "*")]
+    files = sorted({Path(path) for pattern in patterns for path in glob.glob(pattern) if Path(path).is_file()})
+    if not args.no_synthetic:
+        files += prepare_synthetic(Path(args.work_dir), args.pdf_pages, args.xlsx_rows)
+    if not files:
+        print("Không có file nào để đo")
+        sys.exit(1)
+
+    server = create_server(port=0, latency_ms=args.latency_ms, per_image_ms=args.per_image_ms,
+                           batch_enabled=not args.no_batch)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    env = dict(os.environ)
+    env.update({
+        "PADDLE_OCR_API_URL": f"http://127.0.0.1:{port}/ocr-fullV2",
+        "PADDLE_OCR_BATCH_API_URL": f"http://127.0.0.1:{port}/ocr-batch",
+        "PYTHONIOENCODING": "utf-8"
+    })
+    cache_dir = None
+    if args.use_cache:
+        env.setdefault("OCR_CACHE_DIR", str(Path(args.work_dir) / "ocr_cache"))
+    else:
+        cache_dir = tempfile.TemporaryDirectory()
+        env.update({"OCR_CACHE_ENABLED": "false", "OCR_CACHE_DIR": cache_dir.name})
+
+    results = []
+    try:
+        for path in files:
+            print(f"Đo {path.name}...", flush=True)
+            measurement = measure_file(path, server, not args.no_ocr_images, env, args.timeout)
+            results.append(measurement)
+            status = f"lỗi: {measurement['error']}" if measurement.get("error") else "ok"
+            print(f"  {measurement.get('wall_s', '-')} s, {measurement['ocr_requests']} request OCR, "
+                  f"{measurement['bytes_sent']} bytes gửi, peak RSS {measurement.get('peak_rss_mb', '-')} MB ({status})")
+    finally:
+        server.shutdown()
+        server.server_close()
+        if cache_dir:
+            cache_dir.cleanup()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "latency_ms": args.latency_ms,
+            "per_image_ms": args.per_image_ms,
+            "batch_enabled": not args.no_batch,
+            "ocr_images": not args.no_ocr_images,
+            "use_cache": args.use_cache,
+            "env": {key: os.environ[key] for key in RECORDED_ENV if key in os.environ}
+        },
+        "files": results,
+        "by_type": summarize_by_type(results)
+    }
+    if args.compare:
+        report["comparison"] = compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+
+    print_report(report)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nĐã ghi kết quả: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+OCR server giả lập để test và benchmark OCRService khi không có Paddle OCR thật.
+
+Hỗ trợ:
+    POST /ocr-fullV2   một ảnh (field 'file'), trả về {"result": [...]} giống ocr-fullV2
+    POST /ocr-batch    nhiều ảnh (field 'files'), trả về {"results": [{"result": [...]}, ...]}
+    GET  /stats        số request, số ảnh, số bytes đã nhận và số request đồng thời cao nhất
+    GET  /control?latency_ms=..&error_rate=..&capacity=..   đổi cấu hình khi đang chạy
+
+Chạy:
+    python tools/ocr_stub_server.py --port 9100 --latency-ms 200
+    PADDLE_OCR_API_URL=http://127.0.0.1:9100/ocr-fullV2
+    PADDLE_OCR_BATCH_API_URL=http://127.0.0.1:9100/ocr-batch
+
+Dùng --no-batch để endpoint batch trả về 404 (kiểm tra fallback gọi từng ảnh).
+Dùng --error-rate để trả về 503 ngẫu nhiên, --capacity để độ trễ tăng theo số request
+đồng thời vượt quá sức chứa (kiểm tra limiter và circuit breaker của OCRService).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+def parse_multipart(content_type: str, body: bytes) -> List[Tuple[str, bytes]]:
+    """Tách body multipart/form-data thành danh sách (tên field, dữ liệu)"""
+    message = BytesParser(policy=default_policy).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    parts = []
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        parts.append((name, part.get_payload(decode=True) or b""))
+    return parts
+
+
+def fake_ocr_result(image_bytes: bytes) -> Dict:
+    """Kết quả OCR xác định theo nội dung ảnh (cùng ảnh -> cùng text)"""
+    digest = hashlib.sha1(image_bytes).hexdigest()[:12]
+    lines = [f"stub-ocr {digest}", f"{len(image_bytes)} bytes"]
+    block = []
+    for idx, line in enumerate(lines):
+        top = idx * 20
+        block.append([[[0, top], [200, top], [200, top + 18], [0, top + 18]], [line, 0.99]])
+    return {"result": [block]}
+
+
+class StubOCRHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Giữ kết nối keep-alive như server thật
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") == "/stats":
+            with self.server.stats_lock:
+                self._send_json(200, dict(self.server.stats))
+            return
+        if url.path.rstrip("/") == "/control":
+            params = parse_qs(url.query)
+            for key in ("latency_ms", "per_image_ms", "error_rate", "capacity"):
+                if key in params:
+                    setattr(self.server, key, float(params[key][0]))
+            self._send_json(200, {key: getattr(self.server, key) for key in ("latency_ms", "per_image_ms", "error_rate", "capacity")})
+            return
+        self._send_json(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = self.path.rstrip("/")
+
+        with self.server.stats_lock:
+            self.server.stats["bytes_received"] += length
+            self.server.in_flight += 1
+            self.server.stats["max_in_flight"] = max(self.server.stats["max_in_flight"], self.server.in_flight)
+        try:
+            self._handle_post(path, body)
+        finally:
+            with self.server.stats_lock:
+                self.server.in_flight -= 1
+
+    def _handle_post(self, path: str, body: bytes) -> None:
+        if path in (self.server.batch_path, self.server.single_path) and random.random() < self.server.error_rate:
+            self._sleep(1)
+            with self.server.stats_lock:
+                self.server.stats["errors"] += 1
+            self._send_json(503, {"detail": "Stub OCR quá tải"})
+            return
+
+        if path == self.server.batch_path and self.server.batch_enabled:
+            images = [data for name, data in parse_multipart(self.headers.get("Content-Type", ""), body) if name == "files"]
+            self._sleep(len(images))
+            self._record(batch_images=len(images))
+            self._send_json(200, {"results": [fake_ocr_result(img) for img in images]})
+        elif path == self.server.single_path:
+            images = [data for name, data in parse_multipart(self.headers.get("Content-Type", ""), body) if name == "file"]
+            if not images:
+                self._send_json(422, {"detail": "Thiếu field 'file'"})
+                return
+            self._sleep(1)
+            self._record()
+            self._send_json(200, fake_ocr_result(images[0]))
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def _sleep(self, image_count: int) -> None:
+        # Độ trễ cố định mỗi request + độ trễ theo số ảnh
+        delay = self.server.latency_ms + self.server.per_image_ms * image_count
+        # Vượt sức chứa: độ trễ tăng tỷ lệ với số request đang xử lý (giống server bị nghẽn)
+        if self.server.capacity > 0 and self.server.in_flight > self.server.capacity:
+            delay *= self.server.in_flight / self.server.capacity
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _record(self, batch_images: int = 0) -> None:
+        with self.server.stats_lock:
+            if batch_images:
+                self.server.stats["batch_requests"] += 1
+                self.server.stats["batched_images"] += batch_images
+            else:
+                self.server.stats["single_requests"] += 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(host: str = "127.0.0.1", port: int = 9100, latency_ms: float = 0, per_image_ms: float = 0,
+                  batch_enabled: bool = True, single_path: str = "/ocr-fullV2", batch_path: str = "/ocr-batch",
+                  verbose: bool = False, error_rate: float = 0, capacity: float = 0) -> ThreadingHTTPServer:
+    """Tạo server (chưa chạy), dùng được trong script benchmark"""
+    server = ThreadingHTTPServer((host, port), StubOCRHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.per_image_ms = per_image_ms
+    server.batch_enabled = batch_enabled
+    server.single_path = single_path
+    server.batch_path = batch_path
+    server.verbose = verbose
+    server.error_rate = error_rate
+    server.capacity = capacity
+    server.in_flight = 0
+    server.stats_lock = threading.Lock()
+    server.stats = {"single_requests": 0, "batch_requests": 0, "batched_images": 0, "errors": 0, "max_in_flight": 0,
+                    "bytes_received": 0}
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR server giả lập cho OCRService")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Độ trễ cố định mỗi request")
+    parser.add_argument("--per-image-ms", type=float, default=0, help="Độ trễ thêm cho mỗi ảnh")
+    parser.add_argument("--no-batch", action="store_true", help="Endpoint batch trả về 404")
+    parser.add_argument("--error-rate", type=float, default=0, help="Tỷ lệ request trả về 503 (0-1)")
+    parser.add_argument("--capacity", type=float, default=0, help="Số request đồng thời trước khi độ trễ tăng, 0 = không giới hạn")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.latency_ms, args.per_image_ms,
+                           batch_enabled=not args.no_batch, verbose=args.verbose,
+                           error_rate=args.error_rate, capacity=args.capacity)
+    print(f"Stub OCR server chạy tại http://{args.host}:{args.port} (batch: {not args.no_batch})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()